@@ -0,0 +1,314 @@
+"""Benchmarks of the load, parse, draw, mask, aperture, render and delivery log paths of rtdicomtools on synthetic data.
+
+The datasets are generated with rtdicomtools.dcmSynthetic, so the suite runs offline and without patient
+data. Every benchmark is repeated and its median time is compared with baselines.json. Times are divided
+by the time of a fixed NumPy calibration workload before the comparison, so baselines recorded on one
+machine remain meaningful on another one.
+
+    python benchmarks/run_benchmarks.py                 # compare with the baselines
+    python benchmarks/run_benchmarks.py --update        # record new baselines
+    python benchmarks/run_benchmarks.py --only render   # run the benchmarks whose name contains "render"
+
+Before the benchmarks, the streamed delivery log statistics are checked against the statistics of the
+injected errors computed in one pass, and a resumed batch pipeline run is checked to keep the rows of
+finished stages when a new stage fails. The exit code is 1 if a check fails, or if a benchmark is slower than
+its baseline times its threshold.
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rtdicomtools import DICOMMLC, DICOMStructureSet, LayerStack, VolumeLayer, ContourLayer, SliceRenderer, DeliveryLogReader, DeliveryLogComparison, CompareDeliveryLog
+from rtdicomtools.Pipeline import RunPipeline
+from rtdicomtools.dcmSynthetic import SyntheticCTSeries, SyntheticStructureSet, SyntheticVMATPlan, SyntheticDeliveryLog, WriteDatasets, WriteDeliveryLog
+
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+DEFAULT_THRESHOLD = 1.5
+NOISY_THRESHOLD = 3.0
+NOISY_SECONDS = 0.005
+
+SIZES = {
+    "quick": {"slices": 24, "size": 128, "structures": 4, "points": 64, "arcs": 1, "control_points": 60, "snapshots": 5000},
+    "full": {"slices": 96, "size": 512, "structures": 12, "points": 256, "arcs": 2, "control_points": 178, "snapshots": 50000},
+}
+
+
+def calibrate(repeat: int = 5) -> float:
+    """Time a fixed workload of array arithmetic, sorting and copying, used to normalize the benchmarks.
+
+    Args:
+        repeat (int, optional): Number of repetitions. Defaults to 5.
+
+    Returns:
+        float: Median time in seconds.
+    """
+
+    rng = np.random.default_rng(0)
+    array = rng.standard_normal((256, 256, 64)).astype(np.float32)
+
+    def workload():
+        scaled = np.clip(array*255, 0, 255).astype(np.uint8)
+        np.sort(array, axis=2)
+        np.ascontiguousarray(scaled.transpose(2, 0, 1))
+
+    return measure(workload, repeat)
+
+
+def measure(function, repeat: int) -> float:
+    """Time a function.
+
+    Args:
+        function (callable): The function.
+        repeat (int): Number of repetitions, after one warm-up call.
+
+    Returns:
+        float: Median time in seconds.
+    """
+
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+
+def generate(directory: str, sizes: dict) -> dict:
+    """Generate and write the synthetic datasets.
+
+    Args:
+        directory (str): Output directory.
+        sizes (dict): Sizes of the datasets, see SIZES.
+
+    Returns:
+        dict: Paths of the CT images, the structure set, the plan and the delivery log of its first beam, and the
+        errors injected into the log.
+    """
+
+    ct = SyntheticCTSeries(sizes["slices"], sizes["size"])
+    structure_set = SyntheticStructureSet(ct, sizes["structures"], sizes["points"])
+    plan = SyntheticVMATPlan(sizes["arcs"], sizes["control_points"], reference=ct[0])
+    paths = {"ct": WriteDatasets(ct, directory),
+             "structure_set": WriteDatasets([structure_set], directory)[0],
+             "plan": WriteDatasets([plan], directory)[0]}
+
+    # Systematic offsets of a few tenths of a millimeter and random errors, as in a real delivery.
+    mlc = DICOMMLC(paths["plan"])
+    offsets = np.random.default_rng(1).uniform(-0.8, 0.8, (2, mlc.getLeafPairs()))
+    meterset, leaves, errors = SyntheticDeliveryLog(mlc, 0, sizes["snapshots"], offsets, noise=0.3)
+    paths["log"] = WriteDeliveryLog(os.path.join(directory, "log.csv"), meterset, leaves)
+    paths["log_errors"] = errors
+
+    return paths
+
+
+def check_delivery_log(paths: dict) -> list:
+    """Check that the statistics of a delivery log streamed in chunks, whose boundaries fall between the
+    control points, equal the statistics of the injected errors computed in one pass.
+
+    Args:
+        paths (dict): Paths returned by generate.
+
+    Returns:
+        list: Descriptions of the failed checks.
+    """
+
+    plan = DICOMMLC(paths["plan"])
+    errors = paths["log_errors"]
+    bins = DeliveryLogComparison(plan, 0).getBinEdges()
+    clipped = np.clip(errors, bins[0], bins[-1])
+    histograms = np.stack([np.stack([np.histogram(clipped[:, bank, leaf], bins)[0] for leaf in range(errors.shape[2])])
+                           for bank in range(2)])
+    expected = {
+        "snapshots": errors.shape[0],
+        "mean": errors.mean(axis=0),
+        "rms": np.sqrt((errors**2).mean(axis=0)),
+        "total rms": np.sqrt((errors**2).mean()),
+        "max": np.abs(errors).max(axis=0),
+        "histograms": histograms,
+    }
+
+    failures = []
+    for chunk_size in (1, 97, errors.shape[0]):
+        if chunk_size == 1:
+            # Every snapshot is added on its own, without parsing the file once per snapshot.
+            comparison = DeliveryLogComparison(plan, 0)
+            for meterset, leaves in DeliveryLogReader(paths["log"], errors.shape[2], chunk_size=errors.shape[0]):
+                for k in range(len(meterset)):
+                    comparison.Update(meterset[k:k + 1], leaves[k:k + 1])
+        else:
+            comparison = CompareDeliveryLog(plan, 0, paths["log"], chunk_size=chunk_size)
+        streamed = {
+            "snapshots": comparison.getNumberOfSnapshots(),
+            "mean": comparison.getMeanErrors(),
+            "rms": comparison.getRMSErrors(),
+            "total rms": comparison.getTotalRMSError(),
+            "max": comparison.getMaxErrors(),
+            "histograms": comparison.getHistograms(),
+        }
+        for name, value in expected.items():
+            if not np.allclose(streamed[name], value, rtol=0, atol=1e-9):
+                failures.append(f"delivery log {name} with chunks of {chunk_size} snapshots")
+
+    return failures
+
+
+def check_pipeline_resume(directory: str) -> list:
+    """Check that resuming the batch pipeline with an additional stage, which fails because the plan of the
+    patient was corrupted in between, keeps the rows of the stage which was finished before, also when the
+    failed patient is skipped in a third run.
+
+    Args:
+        directory (str): Directory for the cohort and the results.
+
+    Returns:
+        list: Descriptions of the failed checks.
+    """
+
+    patient = os.path.join(directory, "cohort", "P1")
+    ct = SyntheticCTSeries(8, 64)
+    WriteDatasets(ct, patient)
+    WriteDatasets([SyntheticStructureSet(ct, 2, 32)], patient)
+    plan = SyntheticVMATPlan(1, 4, reference=ct[0])
+    plan_path = WriteDatasets([plan], patient)[0]
+
+    output = os.path.join(directory, "results")
+    structures = os.path.join(output, "structures.csv")
+
+    def rows():
+        with open(structures, newline="") as f:
+            return list(csv.DictReader(f))
+
+    def run(stages, retry_failed=True):
+        RunPipeline(os.path.join(directory, "cohort"), output, stages, workers=1, retry_failed=retry_failed, log=lambda message: None)
+
+    run(["structures"])
+    expected = rows()
+    if not expected:
+        return ["pipeline wrote no structure rows"]
+
+    # A plan without beams is still found by the scan, but fails to parse.
+    del plan.BeamSequence
+    plan.save_as(plan_path)
+
+    failures = []
+    run(["structures", "apertures"])
+    if rows() != expected:
+        failures.append("pipeline lost the structure rows when the apertures stage failed")
+    run(["structures", "apertures"], retry_failed=False)
+    if rows() != expected:
+        failures.append("pipeline lost the structure rows of a skipped failed patient")
+
+    return failures
+
+
+def benchmarks(paths: dict) -> dict:
+    """Build the benchmarks. Objects which a benchmark does not measure are created up front.
+
+    Args:
+        paths (dict): Paths returned by generate.
+
+    Returns:
+        dict: Functions by benchmark name.
+    """
+
+    structure_set = DICOMStructureSet(paths["structure_set"], CT=paths["ct"])
+    plan = DICOMMLC(paths["plan"])
+    beam = plan.getBeamMLCSequence()[0]
+    renderer = SliceRenderer(LayerStack([VolumeLayer(structure_set.slices, 255, 127.5), ContourLayer(structure_set)]))
+    depth = renderer.getShape()[0]
+
+    return {
+        "load_ct_and_structures": lambda: DICOMStructureSet(paths["structure_set"], CT=paths["ct"]),
+        "parse_structures": lambda: DICOMStructureSet(paths["structure_set"]),
+        "parse_plan": lambda: DICOMMLC(paths["plan"]),
+        "parse_plan_lazy": lambda: DICOMMLC(paths["plan"], lazy=True),
+        "draw_all_contours": lambda: structure_set.DrawAllContours(),
+        "mask_structure": lambda: structure_set.DrawStructureContours(structure_set.getAvailableStructureNames()[0], fill=True),
+        "draw_apertures": lambda: [plan.DrawMLCAperture(0, k) for k in range(beam.getNumberOfControlPoints())],
+        "calculate_fluence": lambda: plan.CalculateFluence(0),
+        "render_axial_slices": lambda: [renderer.RenderView(0, k, (512, 512)) for k in range(depth)],
+        "render_triple_views": lambda: [renderer.RenderTripleView((k, 0, 0), 512) for k in range(0, depth, max(depth//8, 1))],
+        "stream_delivery_log": lambda: CompareDeliveryLog(plan, 0, paths["log"]),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", choices=SIZES, default="quick", help="size of the synthetic datasets")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of every benchmark")
+    parser.add_argument("--only", default=None, help="only run benchmarks whose name contains this text")
+    parser.add_argument("--update", action="store_true", help="record the results as the new baselines")
+    parser.add_argument("--baselines", default=BASELINES, help="path of the baselines file")
+    arguments = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(arguments.baselines):
+        with open(arguments.baselines) as f:
+            baselines = json.load(f)
+    recorded = baselines.setdefault(arguments.size, {})
+
+    calibration = calibrate()
+    print(f"calibration: {calibration*1e3:.1f} ms")
+
+    regressions = []
+    with tempfile.TemporaryDirectory() as directory:
+        paths = generate(directory, SIZES[arguments.size])
+        failures = check_delivery_log(paths) + check_pipeline_resume(os.path.join(directory, "pipeline"))
+        for failure in failures:
+            print(f"CHECK FAILED: {failure}")
+        if failures:
+            return 1
+        print("checks passed")
+
+        for name, function in benchmarks(paths).items():
+            if arguments.only and arguments.only not in name:
+                continue
+            seconds = measure(function, arguments.repeat)
+            relative = seconds/calibration
+            baseline = recorded.get(name)
+
+            line = f"{name:<26} {seconds*1e3:10.1f} ms {relative:8.2f} x"
+            if baseline is not None:
+                ratio = relative/baseline["relative"]
+                threshold = baseline.get("threshold", DEFAULT_THRESHOLD)
+                line += f"   {ratio:5.2f} of baseline"
+                if ratio > threshold:
+                    line += f"   REGRESSION (threshold {threshold})"
+                    regressions.append(name)
+            print(line)
+
+            if arguments.update:
+                # Benchmarks of a few milliseconds are dominated by timer and scheduler noise.
+                threshold = NOISY_THRESHOLD if seconds < NOISY_SECONDS else DEFAULT_THRESHOLD
+                if baseline is not None and "threshold" in baseline:
+                    threshold = baseline["threshold"]
+                recorded[name] = {"seconds": round(seconds, 6), "relative": round(relative, 4), "threshold": threshold}
+
+    if arguments.update:
+        with open(arguments.baselines, "w") as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+            f.write("\n")
+        print(f"Baselines written to {arguments.baselines}")
+        return 0
+
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,68 +1,471 @@
 from rtdicomtools import *
+import os
+import queue
+import pydicom
+import threading
 import customtkinter as ctk
 import tkinter as tk
+from tkinter import filedialog, ttk
+from PIL import Image, ImageTk
+from concurrent.futures import ThreadPoolExecutor
+from rtdicomtools.dcmBrowser import ScanDirectory, ThumbnailCache
+from rtdicomtools.npSliceProvider import OrientedViews
+from rtdicomtools.npViewer3D import debounce
+
+
+class LoadCancelled(Exception):
+    """Raised in the loading thread when the user cancels loading."""
+
+
+class PatientLoader(threading.Thread):
+    """Loads the DICOM files of a patient directory in a background thread. The directory is scanned
+    header-only, then the structure set with its CT and the plans are parsed. Progress, the result and
+    errors are reported as messages on a thread-safe queue, which the Tk thread polls:
+
+        ("progress", fraction, text), ("done", patient), ("error", exception) or ("cancelled",)
+    """
+
+    def __init__(self, directory: str) -> None:
+        """Initializes the PatientLoader class.
+
+        Args:
+            directory (str): The patient directory.
+        """
+
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.messages = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.scan_fraction = 0.2
+
+    def cancel(self) -> None:
+        """Requests the loading to stop after the current file."""
+
+        self.cancel_event.set()
+
+    def check_cancelled(self) -> None:
+        if self.cancel_event.is_set():
+            raise LoadCancelled()
+
+    def run(self) -> None:
+        try:
+            self.messages.put(("done", self.load()))
+        except LoadCancelled:
+            self.messages.put(("cancelled",))
+        except Exception as e:
+            self.messages.put(("error", e))
+
+    def load(self) -> dict:
+        """Loads the patient.
+
+        Returns:
+            dict: The structure set, or None, and the plans by file name.
+        """
+
+        files = [os.path.join(root, name) for root, _, names in os.walk(self.directory) for name in names]
+        series = {"CT": [], "RTSTRUCT": [], "RTPLAN": []}
+        for n, file in enumerate(files):
+            self.check_cancelled()
+            try:
+                modality = pydicom.dcmread(file, stop_before_pixels=True, specific_tags=["Modality"]).Modality
+            except Exception:
+                modality = None
+            if modality in series:
+                series[modality].append(file)
+            self.messages.put(("progress", self.scan_fraction*(n + 1)/len(files), f"Scanning {os.path.basename(file)}"))
+
+        total = max(len(series["CT"]), 1) + len(series["RTPLAN"])
+        done = 0
+
+        def progress(loaded, count):
+            self.check_cancelled()
+            self.messages.put(("progress", self.scan_fraction + (1 - self.scan_fraction)*(done + loaded)/total, f"Loading CT {loaded}/{count}"))
+
+        structure_set = None
+        if series["RTSTRUCT"]:
+            structure_set = DICOMStructureSet(series["RTSTRUCT"][0], CT=series["CT"] or None, ignore_for=True, progress=progress)
+        done = max(len(series["CT"]), 1)
+
+        plans = {}
+        for file in series["RTPLAN"]:
+            self.check_cancelled()
+            plans[os.path.basename(file)] = DICOMMLC(file, lazy=True)
+            done += 1
+            self.messages.put(("progress", self.scan_fraction + (1 - self.scan_fraction)*done/total, f"Loaded {os.path.basename(file)}"))
+
+        return {"directory": self.directory, "structure_set": structure_set, "plans": plans}
+
+
+class SeriesLoader(PatientLoader):
+    """Prepares an image series for the viewer in a background thread. The headers are read to sort the
+    images, the value range is estimated, and the planes which the viewer shows first are decoded, so
+    opening the viewer window does not block the Tk thread. Reports the same messages as PatientLoader.
+    """
+
+    def __init__(self, series) -> None:
+        """Initializes the SeriesLoader class.
+
+        Args:
+            series (DICOMSeries): The series.
+        """
+
+        super().__init__(os.path.dirname(series.getFiles()[0]))
+        self.series = series
+
+    def load(self) -> dict:
+        """Loads the series.
+
+        Returns:
+            dict: The layers of the series.
+        """
+
+        self.messages.put(("progress", 0.0, f"Reading {self.series.getNumberOfFiles()} headers"))
+        provider = DICOMSeriesSliceProvider(self.series.getFiles())
+        self.check_cancelled()
+
+        # The middle planes of the triple view, the first axial plane and the samples of the value range.
+        views = OrientedViews(provider)
+        for axis in range(3):
+            self.messages.put(("progress", 0.2 + 0.2*axis, f"Decoding {['X', 'Y', 'Z'][axis]} view"))
+            views[axis][views[axis].shape[0]//2]
+            self.check_cancelled()
+        provider.getSlice(0, 0)
+        self.messages.put(("progress", 0.8, "Estimating the value range"))
+        layers = LayerStack([VolumeLayer(provider)])
+
+        return {"directory": self.directory, "layers": layers}
+
 
 class Explorer(ctk.CTk):
-    
+
     def __init__(self):
-        
+
         super().__init__(fg_color="#FFFFFF")
-        
-        self.appname = "Explorer" 
+
+        self.appname = "Explorer"
         self.author = "Sebastian Schäfer"
         self.version = "0.1"
-        
+
         ctk.set_appearance_mode("light")
         ctk.set_default_color_theme("dark-blue")
-        
+
         self.title(f"{self.appname} v{self.version} by {self.author}")
-        
+
         self.geometry("800x600")
         self.minsize(800, 600)
 
+        self.loader = None
+        self.patient = None
+        self.poll_interval = 50
+
         self.mainframe = ctk.CTkFrame(self)
         self.menu = self.Menu(self)
-        
+
         self.mainframe.rowconfigure(0, weight=1)
         self.mainframe.rowconfigure(1, weight=0)
         self.mainframe.columnconfigure(0, weight=1)
-        
+
         self.viewframe = ctk.CTkFrame(self.mainframe)
+        self.browser = self.Browser(self.viewframe)
+        self.browser.pack(side="left", fill="y", padx=(10, 0), pady=10)
+        self.summary = ctk.CTkLabel(self.viewframe, text="", justify="left", anchor="nw")
+        self.summary.pack(fill="both", expand=True, padx=10, pady=10)
         self.progressbar = self.ProgressBar(self.mainframe)
-        
+
         self.viewframe.grid(row=0, column=0, sticky="nsew")
         self.progressbar.grid(row=1, column=0, sticky="nsew")
-        
+
         self.mainframe.pack(fill="both", expand=True, padx= 15)
-        
+
+    def open_patient(self):
+        """Asks for a patient directory and loads it in the background.
+        """
+
+        if self.loader is not None:
+            return
+        directory = filedialog.askdirectory(parent=self, title="Open Patient")
+        if not directory:
+            return
+
+        self.start_loader(PatientLoader(directory))
+
+    def open_folder(self):
+        """Asks for a folder, e.g. a clinical export, and lists its series in the browser.
+        """
+
+        directory = filedialog.askdirectory(parent=self, title="Open Folder")
+        if directory:
+            self.browser.browse(directory)
+
+    def open_series(self, series):
+        """Opens a series selected in the browser. Image series are prepared in the background and shown in
+        a viewer window, and the folder of an RTSTRUCT or RTPLAN is loaded as a patient.
+
+        Args:
+            series (DICOMSeries): The series.
+        """
+
+        if self.loader is not None:
+            return
+        if series.modality in ("RTSTRUCT", "RTPLAN"):
+            self.start_loader(PatientLoader(os.path.dirname(series.getFiles()[0])))
+        else:
+            self.start_loader(SeriesLoader(series))
+
+    def start_loader(self, loader):
+        """Starts a loading thread and polls its messages until it is finished.
+
+        Args:
+            loader (PatientLoader | SeriesLoader): The loader, which must not have been started yet.
+        """
+
+        self.loader = loader
+        self.progressbar.start_loading()
+        self.menu.filemenu.entryconfig("Cancel Loading", state="normal")
+        self.loader.start()
+        self.after(self.poll_interval, self.poll_loader)
+
+    def cancel_loading(self):
+        if self.loader is not None:
+            self.loader.cancel()
+
+    def poll_loader(self):
+        """Processes the messages of the loading thread without blocking the event loop.
+        """
+
+        finished = False
+        try:
+            while True:
+                message = self.loader.messages.get_nowait()
+                if message[0] == "progress":
+                    self.progressbar.set(message[1], message[2])
+                else:
+                    finished = True
+                    self.finish_loading(message)
+                    break
+        except queue.Empty:
+            pass
+
+        if not finished:
+            self.after(self.poll_interval, self.poll_loader)
+
+    def finish_loading(self, message: tuple):
+        self.loader = None
+        self.menu.filemenu.entryconfig("Cancel Loading", state="disabled")
+
+        if message[0] == "done" and "layers" in message[1]:
+            self.progressbar.stop_loading("Done")
+            NumpyViewerWindow(self, message[1]["layers"])
+        elif message[0] == "done":
+            self.progressbar.stop_loading("Done")
+            self.show_patient(message[1])
+        elif message[0] == "cancelled":
+            self.progressbar.stop_loading("Cancelled")
+        else:
+            self.progressbar.stop_loading(f"Error: {message[1]}")
+
+    def show_patient(self, patient: dict):
+        """Shows a summary of the loaded patient and opens the CT with its contours in a viewer window.
+
+        Args:
+            patient (dict): The patient returned by PatientLoader.
+        """
+
+        self.patient = patient
+        structure_set = patient["structure_set"]
+        lines = [patient["directory"], ""]
+        if structure_set is not None:
+            lines.append("Structures: " + ", ".join(structure_set.getAvailableStructureNames()))
+        for name, plan in patient["plans"].items():
+            lines.append(f"{name}: {plan.getNumberOfBeams()} beams")
+        self.summary.configure(text="\n".join(lines))
+
+        if structure_set is not None and hasattr(structure_set, "slices"):
+            NumpyViewerWindow(self, LayerStack([VolumeLayer(structure_set.slices, 255, 127.5), ContourLayer(structure_set)]))
+
+    class Browser(ctk.CTkFrame):
+        """Patient, study and series tree of a folder. The folder is scanned header-only in the background,
+        and thumbnails are generated in a thread pool for the visible series only, so large folders are
+        listed without reading any pixel data.
+        """
+
+        def __init__(self, master):
+
+            super().__init__(master)
+
+            self.thumbnails = ThumbnailCache()
+            self.executor = ThreadPoolExecutor(max_workers=4)
+            self.series = {}
+            self.images = {}
+            self.pending = {}
+            self.scan = None
+            self.scroll_job = None
+            self.poll_job = None
+            self.poll_interval = 50
+
+            style = ttk.Style(self)
+            style.configure("Browser.Treeview", rowheight=self.thumbnails.size + 4)
+            self.tree = ttk.Treeview(self, columns=("files",), style="Browser.Treeview", selectmode="browse")
+            self.tree.heading("#0", text="Series")
+            self.tree.heading("files", text="Files")
+            self.tree.column("#0", width=320)
+            self.tree.column("files", width=60, anchor="e")
+            self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+            self.tree.configure(yscrollcommand=self.on_scroll)
+
+            self.tree.pack(side="left", fill="both", expand=True)
+            self.scrollbar.pack(side="right", fill="y")
+
+            self.tree.bind("<<TreeviewOpen>>", lambda event: self.schedule_thumbnails())
+            self.tree.bind("<Configure>", lambda event: self.schedule_thumbnails())
+            self.tree.bind("<Double-1>", self.on_double_click)
+
+        def browse(self, directory):
+            """Scans a folder in the background and lists its series.
+
+            Args:
+                directory (str): The folder.
+            """
+
+            self.tree.delete(*self.tree.get_children())
+            self.series.clear()
+            self.images.clear()
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+            self.scan = self.executor.submit(ScanDirectory, directory)
+            self.after(self.poll_interval, self.poll_scan)
+
+        def poll_scan(self):
+            if self.scan is None:
+                return
+            if not self.scan.done():
+                self.after(self.poll_interval, self.poll_scan)
+                return
+            scan, self.scan = self.scan, None
+            try:
+                self.show_series(scan.result())
+            except Exception as e:
+                self.tree.insert("", "end", text=f"Error: {e}")
+
+        def show_series(self, series):
+            """Fills the tree with the series, grouped by patient and study.
+
+            Args:
+                series (list): DICOMSeries objects returned by ScanDirectory.
+            """
+
+            nodes = {}
+            for entry in series:
+                patient = nodes.get(entry.patient_id)
+                if patient is None:
+                    patient = nodes[entry.patient_id] = self.tree.insert("", "end", text=f"{entry.patient_name} ({entry.patient_id})", open=True)
+                study = nodes.get((entry.patient_id, entry.study_uid))
+                if study is None:
+                    study = nodes[(entry.patient_id, entry.study_uid)] = self.tree.insert(patient, "end", text=entry.study_description or entry.study_uid or "Study", open=True)
+                item = self.tree.insert(study, "end", text=f"{entry.modality} {entry.series_description}", values=(entry.getNumberOfFiles(),))
+                self.series[item] = entry
+
+            self.schedule_thumbnails()
+
+        def on_scroll(self, first, last):
+            self.scrollbar.set(first, last)
+            self.schedule_thumbnails()
+
+        def schedule_thumbnails(self):
+            self.scroll_job = debounce(self, self.scroll_job, 100, self.request_thumbnails)
+
+        def request_thumbnails(self):
+            """Submits the thumbnails of the visible series which are neither shown nor pending, and
+            withdraws the pending ones which were scrolled out of view before they were started.
+            """
+
+            self.scroll_job = None
+            for item, series in self.series.items():
+                if item in self.images:
+                    continue
+                visible = bool(self.tree.bbox(item))
+                if item in self.pending:
+                    if not visible and self.pending[item].cancel():
+                        del self.pending[item]
+                elif visible:
+                    self.pending[item] = self.executor.submit(self.thumbnails.getThumbnail, series)
+
+            if self.pending and self.poll_job is None:
+                self.poll_job = self.after(self.poll_interval, self.poll_thumbnails)
+
+        def poll_thumbnails(self):
+            self.poll_job = None
+            for item in [item for item, future in self.pending.items() if future.done()]:
+                future = self.pending.pop(item)
+                try:
+                    image = future.result()
+                except Exception:
+                    image = None
+                if item not in self.series:
+                    continue
+                self.images[item] = None if image is None else ImageTk.PhotoImage(Image.fromarray(image))
+                if self.images[item] is not None:
+                    self.tree.item(item, image=self.images[item])
+
+            if self.pending:
+                self.poll_job = self.after(self.poll_interval, self.poll_thumbnails)
+
+        def on_double_click(self, event):
+            item = self.tree.identify_row(event.y)
+            if item in self.series:
+                self.winfo_toplevel().open_series(self.series[item])
+
+        def destroy(self):
+            for future in self.pending.values():
+                future.cancel()
+            self.executor.shutdown(wait=False)
+            super().destroy()
+
     class ProgressBar(ctk.CTkFrame):
-        
+
         def __init__(self, master):
-            
+
             super().__init__(master)
-            
-            self.progressbar = ctk.CTkProgressBar(self, orientation="horizontal", mode="indeterminate",fg_color="#FFFFFF", height = 15, corner_radius=0)
-            self.progressbar.start()
+
+            self.progressbar = ctk.CTkProgressBar(self, orientation="horizontal", mode="determinate",fg_color="#FFFFFF", height = 15, corner_radius=0)
+            self.progressbar.set(0)
+            self.label = ctk.CTkLabel(self, text="", anchor="w")
             self.progressbar.pack(fill="x", expand=True)
-            
-        def set(self, value):
+            self.label.pack(fill="x", expand=True)
+
+        def set(self, value, text=None):
             self.progressbar.set(value)
-            
+            if text is not None:
+                self.label.configure(text=text)
+
         def get(self):
             return self.progressbar.get()
-        
+
+        def start_loading(self):
+            self.set(0, "Scanning")
+
+        def stop_loading(self, text):
+            self.set(1 if text == "Done" else 0, text)
+
     class Menu(tk.Menu):
-        
+
         def __init__(self, master):
-            
+
             self.parent = master
             super().__init__(self.parent, tearoff=0, relief="flat", font=("Segoe UI", 10))
-            
+
             self.filemenu = tk.Menu(self, tearoff=0)
+            self.filemenu.add_command(label="Open Patient...", command=self.parent.open_patient)
+            self.filemenu.add_command(label="Open Folder...", command=self.parent.open_folder)
+            self.filemenu.add_command(label="Cancel Loading", command=self.parent.cancel_loading, state="disabled")
+            self.filemenu.add_separator()
+            self.filemenu.add_command(label="Exit", command=self.parent.destroy)
             self.add_cascade(label="File", menu=self.filemenu)
-            
+
             self.parent.config(menu=self)
-            
-            
-app = Explorer()
-app.mainloop()
\ No newline at end of file
+
+
+if __name__ == "__main__":
+    app = Explorer()
+    app.mainloop()
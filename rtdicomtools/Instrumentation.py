@@ -0,0 +1,279 @@
+"""Optional timing and memory instrumentation of the load and render stages.
+
+Instrumentation is disabled by default, and a disabled span costs a single flag check. Once enabled, every
+span records its wall time and, if memory tracking is enabled, the peak of the memory allocated while it
+was open, as measured by tracemalloc. Spans can be nested and are tracked per thread, but tracemalloc
+measures the whole process, so the peaks of spans running concurrently in other threads are included.
+
+    from rtdicomtools import Instrumentation
+
+    Instrumentation.EnableInstrumentation(memory=True)
+    structure_set = DICOMStructureSet(rtstruct, CT=files)
+    print(Instrumentation.getSummary())
+    Instrumentation.ExportChromeTrace("trace.json")
+
+Instrumentation can also be enabled by setting the environment variable RTDICOMTOOLS_INSTRUMENTATION to 1,
+or to "memory" to track memory as well.
+"""
+
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+
+from collections import deque
+
+
+_enabled = False
+_memory = False
+_callback = None
+_lock = threading.Lock()
+_local = threading.local()
+_origin = time.perf_counter_ns()
+_events = deque(maxlen=100000)
+_summary = {}
+
+
+class _Span:
+    """A span which is being recorded.
+    """
+
+    __slots__ = ("name", "attributes", "start", "memory_start", "memory_peak")
+
+    def __init__(self, name: str, attributes: dict) -> None:
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        stack = _Stack()
+        if _memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].memory_peak = max(stack[-1].memory_peak, peak)
+            _ResetPeak()
+            self.memory_start = self.memory_peak = current
+        else:
+            self.memory_start = None
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exception):
+        end = time.perf_counter_ns()
+        stack = _Stack()
+        stack.pop()
+
+        allocated = None
+        if self.memory_start is not None and tracemalloc.is_tracing():
+            self.memory_peak = max(self.memory_peak, tracemalloc.get_traced_memory()[1])
+            allocated = self.memory_peak - self.memory_start
+            if stack and stack[-1].memory_start is not None:
+                stack[-1].memory_peak = max(stack[-1].memory_peak, self.memory_peak)
+            _ResetPeak()
+
+        _Record({"name": self.name, "start": (self.start - _origin)/1e3, "duration": (end - self.start)/1e3,
+                 "thread": threading.get_ident(), "depth": len(stack), "peak_memory": allocated,
+                 "attributes": self.attributes})
+        return False
+
+
+class _DisabledSpan:
+    """The span returned while instrumentation is disabled, which does nothing.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+_DISABLED = _DisabledSpan()
+
+
+def _Stack() -> list:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _ResetPeak() -> None:
+    # tracemalloc.reset_peak is only available from Python 3.9, before that the peak covers the whole process.
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+
+
+def _Record(event: dict) -> None:
+    with _lock:
+        _events.append(event)
+        summary = _summary.get(event["name"])
+        if summary is None:
+            summary = _summary[event["name"]] = {"count": 0, "total": 0.0, "min": float("inf"), "max": 0.0, "peak_memory": None}
+        summary["count"] += 1
+        summary["total"] += event["duration"]
+        summary["min"] = min(summary["min"], event["duration"])
+        summary["max"] = max(summary["max"], event["duration"])
+        if event["peak_memory"] is not None:
+            summary["peak_memory"] = max(summary["peak_memory"] or 0, event["peak_memory"])
+        callback = _callback
+
+    if callback is not None:
+        callback(event)
+
+
+def span(name: str, **attributes):
+    """Open a span, which is recorded when the returned context manager exits.
+
+    Args:
+        name (str): Name of the span, e.g. "DICOMMLC.DrawMLCAperture".
+        **attributes: Values stored with the span, e.g. the beam number.
+
+    Returns:
+        The context manager.
+    """
+
+    if not _enabled:
+        return _DISABLED
+    return _Span(name, attributes)
+
+
+def instrumented(name: str = None):
+    """Decorator which records every call of a function as a span.
+
+    Args:
+        name (str, optional): Name of the span. Defaults to the qualified name of the function.
+
+    Returns:
+        The decorator.
+    """
+
+    def decorator(function):
+        label = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Span(label, {}):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def EnableInstrumentation(memory: bool = False, callback=None) -> None:
+    """Start recording spans.
+
+    Args:
+        memory (bool, optional): Record the peak memory allocated in every span, which starts tracemalloc and
+        slows down allocations considerably. Defaults to False.
+        callback (callable, optional): Called with every recorded span as a dictionary with the keys "name",
+        "start" and "duration" in microseconds, "thread", "depth", "peak_memory" in bytes or None, and
+        "attributes". Defaults to None.
+    """
+
+    global _enabled, _memory, _callback
+
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _memory = memory
+    _callback = callback
+    _enabled = True
+
+
+def DisableInstrumentation() -> None:
+    """Stop recording spans. The recorded spans are kept.
+    """
+
+    global _enabled, _memory, _callback
+
+    _enabled = False
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _memory = False
+    _callback = None
+
+
+def ResetInstrumentation() -> None:
+    """Discard the recorded spans.
+    """
+
+    with _lock:
+        _events.clear()
+        _summary.clear()
+
+
+def isEnabled() -> bool:
+    """Check if spans are recorded.
+
+    Returns:
+        bool: True if instrumentation is enabled.
+    """
+
+    return _enabled
+
+
+def getEvents() -> list:
+    """Get the recorded spans, up to the last 100000.
+
+    Returns:
+        list: Spans as dictionaries, see EnableInstrumentation.
+    """
+
+    with _lock:
+        return list(_events)
+
+
+def getSummary() -> dict:
+    """Get the statistics of every span name over all recorded spans.
+
+    Returns:
+        dict: Call count, total, mean, minimum and maximum wall time in seconds, and peak memory in bytes, by span name.
+    """
+
+    with _lock:
+        return {name: {"count": s["count"], "total": s["total"]/1e6, "mean": s["total"]/s["count"]/1e6,
+                       "min": s["min"]/1e6, "max": s["max"]/1e6, "peak_memory": s["peak_memory"]}
+                for name, s in _summary.items()}
+
+
+def ExportJSON(path: str) -> None:
+    """Write the summary and the recorded spans to a JSON file.
+
+    Args:
+        path (str): Path of the file.
+    """
+
+    with open(path, "w") as f:
+        json.dump({"summary": getSummary(), "events": getEvents()}, f, indent=2, default=str)
+
+
+def ExportChromeTrace(path: str) -> None:
+    """Write the recorded spans in the Chrome trace event format, which can be opened with chrome://tracing
+    or Perfetto.
+
+    Args:
+        path (str): Path of the file.
+    """
+
+    pid = os.getpid()
+    events = []
+    for event in getEvents():
+        arguments = {key: value for key, value in event["attributes"].items()}
+        if event["peak_memory"] is not None:
+            arguments["peak_memory"] = event["peak_memory"]
+        events.append({"name": event["name"], "cat": "rtdicomtools", "ph": "X", "ts": event["start"], "dur": event["duration"],
+                       "pid": pid, "tid": event["thread"], "args": arguments})
+
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+if os.environ.get("RTDICOMTOOLS_INSTRUMENTATION", "0").lower() not in ("", "0", "false", "no"):
+    EnableInstrumentation(memory=os.environ["RTDICOMTOOLS_INSTRUMENTATION"].lower() == "memory")
@@ -0,0 +1,486 @@
+"""Resumable batch processing of patient cohorts.
+
+Every patient directory is scanned header-only, and the selected stages run on its structure set, CT and
+plans in a pool of worker processes:
+
+    structures  volume, extent and number of contours of every structure
+    apertures   aperture area, open leaf pairs and mean leaf gap of every control point
+    fluence     statistics of the integrated MLC fluence of every beam
+    snapshots   triple view PNG of the CT with its contours
+
+The rows of every stage are streamed to <output>/<stage>.csv as patients finish, and optionally converted
+to Parquet at the end. The results of every patient are checkpointed in <output>/checkpoints, so an
+interrupted run skips the finished patients when it is started again with the same output directory. A
+checkpoint records the stages it contains, so a run with other stages only processes the missing ones.
+
+    rtdicomtools COHORT_DIRECTORY -o results --stages structures,apertures --workers 8
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+import numpy as np
+
+from rtdicomtools.dcmBrowser import ScanDirectory
+from rtdicomtools.Instrumentation import span
+
+
+STAGES = ["structures", "apertures", "fluence", "snapshots"]
+
+
+def ReadManifest(path: str) -> dict:
+    """Read the patients to process from a directory or a manifest file. In a directory, every subdirectory
+    is a patient, or the directory itself if it contains no subdirectories. A manifest is a text file with
+    one directory per line, a JSON list of directories or an object of directories by patient ID, or a CSV
+    file with the columns "directory" and optionally "patient". Relative paths are relative to the manifest.
+
+    Args:
+        path (str): The directory or manifest.
+
+    Returns:
+        dict: Patient directories by patient ID.
+    """
+
+    if os.path.isdir(path):
+        subdirectories = sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+        if not subdirectories:
+            return {os.path.basename(os.path.normpath(path)): path}
+        return {name: os.path.join(path, name) for name in subdirectories}
+
+    root = os.path.dirname(os.path.abspath(path))
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline="") as f:
+        if extension == ".json":
+            entries = json.load(f)
+            if isinstance(entries, list):
+                entries = {os.path.basename(os.path.normpath(directory)): directory for directory in entries}
+        elif extension == ".csv":
+            entries = {}
+            for row in csv.DictReader(f):
+                entries[row.get("patient") or os.path.basename(os.path.normpath(row["directory"]))] = row["directory"]
+        else:
+            directories = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+            entries = {os.path.basename(os.path.normpath(directory)): directory for directory in directories}
+
+    return {str(patient): os.path.join(root, directory) for patient, directory in entries.items()}
+
+
+def StructureRows(structure_set) -> list:
+    """Calculate the volume and extent of every structure of a structure set from its contours. The area of
+    every contour is calculated with the shoelace formula, and the areas are summed over the slices,
+    weighted by the median distance between the contoured slices.
+
+    Args:
+        structure_set (DICOMStructureSet): The structure set.
+
+    Returns:
+        list: One row per structure.
+    """
+
+    rows = []
+    for name in structure_set.getAvailableStructureNames():
+        structure = structure_set.getStructureContour(name)
+        if structure is None or not structure.getContours():
+            rows.append({"structure": name, "contours": 0, "slices": 0, "volume_cm3": 0.0, "z_min_mm": None, "z_max_mm": None})
+            continue
+
+        areas = []
+        for points in structure.getContours():
+            x, y = points[:, 0], points[:, 1]
+            areas.append(0.5*abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))))
+        z = np.unique(np.asarray(structure.getSlices(), dtype=np.float64))
+        thickness = float(np.median(np.diff(z))) if len(z) > 1 else 0.0
+
+        rows.append({"structure": name, "contours": len(areas), "slices": len(z), "volume_cm3": round(sum(areas)*thickness/1000, 4),
+                     "z_min_mm": float(z[0]), "z_max_mm": float(z[-1])})
+
+    return rows
+
+
+def ApertureRows(plan) -> list:
+    """Calculate the aperture metrics of every control point of a plan. The open area of every leaf pair
+    is limited by the jaws, where the plan defines them.
+
+    Args:
+        plan (DICOMMLC): The plan.
+
+    Returns:
+        list: One row per control point.
+    """
+
+    rows = []
+    for beam in range(plan.getNumberOfBeams()):
+        metadata = plan.getBeamMetadata(beam)
+        if metadata["Leaf Pairs"] == 0:
+            continue
+        beam_mlc = plan.getBeamMLCSequence()[beam]
+        leaves = beam_mlc.getLeafPositionArray()
+        jaws = np.nan_to_num(beam_mlc.getJawPositionArray(), nan=np.inf)
+        jaws[:, :, 0] = np.where(np.isinf(jaws[:, :, 0]), -np.inf, jaws[:, :, 0])
+        boundaries = beam_mlc.getLeafBoundaryArray()
+
+        gaps = np.clip(np.minimum(leaves[:, 1], jaws[:, 0, 1, None]) - np.maximum(leaves[:, 0], jaws[:, 0, 0, None]), 0, None)
+        widths = np.clip(np.minimum(boundaries[None, 1:], jaws[:, 1, 1, None]) - np.maximum(boundaries[None, :-1], jaws[:, 1, 0, None]), 0, None)
+        areas = (gaps*widths).sum(axis=1)
+        open_leaves = ((gaps > 0) & (widths > 0)).sum(axis=1)
+        mean_gaps = np.where(open_leaves > 0, (gaps*(widths > 0)).sum(axis=1)/np.maximum(open_leaves, 1), 0)
+
+        for control_point, (gantry, weight) in enumerate(zip(beam_mlc.getGantryAngles(), beam_mlc.getCumulativeMetersetWeights())):
+            rows.append({"beam": metadata["Beam Number"], "beam_name": metadata["Beam Name"], "control_point": control_point,
+                         "gantry_angle": gantry, "cumulative_meterset_weight": float(weight), "area_mm2": round(float(areas[control_point]), 3),
+                         "open_leaf_pairs": int(open_leaves[control_point]), "mean_gap_mm": round(float(mean_gaps[control_point]), 3)})
+
+    return rows
+
+
+def FluenceRows(plan) -> list:
+    """Calculate statistics of the integrated MLC fluence of every beam of a plan.
+
+    Args:
+        plan (DICOMMLC): The plan.
+
+    Returns:
+        list: One row per beam.
+    """
+
+    rows = []
+    pixel_area = (1/plan.getPixelSpacing())**2
+    for beam in range(plan.getNumberOfBeams()):
+        metadata = plan.getBeamMetadata(beam)
+        if metadata["Leaf Pairs"] == 0:
+            continue
+        fluence = plan.CalculateFluence(beam)
+        irradiated = fluence > 0
+        rows.append({"beam": metadata["Beam Number"], "beam_name": metadata["Beam Name"], "beam_meterset": metadata["Beam Meterset [MU]"],
+                     "max_fluence": float(fluence.max()), "mean_fluence": float(fluence[irradiated].mean()) if irradiated.any() else 0.0,
+                     "irradiated_area_mm2": round(float(irradiated.sum()*pixel_area), 3)})
+
+    return rows
+
+
+def ProcessPatient(job: dict) -> dict:
+    """Run the stages on one patient. Runs in a worker process.
+
+    Args:
+        job (dict): Patient ID, directory, stages and output directory.
+
+    Returns:
+        dict: The result with the patient ID, the status, the rows by stage, and the error if the patient failed.
+    """
+
+    from rtdicomtools.dcmMLC import DICOMMLC
+    from rtdicomtools.dcmStructureSet import DICOMStructureSet
+
+    patient, stages = job["patient"], job["stages"]
+    result = {"patient": patient, "status": "done", "stages": list(stages), "rows": {stage: [] for stage in stages}, "seconds": 0.0}
+    start = time.perf_counter()
+
+    try:
+        with span("Pipeline.ScanDirectory"):
+            series = ScanDirectory(job["directory"])
+        if not series:
+            raise FileNotFoundError(f"No DICOM files in {job['directory']}")
+        ct = max((s for s in series if s.modality == "CT"), key=lambda s: s.getNumberOfFiles(), default=None)
+        structure_files = [f for s in series if s.modality == "RTSTRUCT" for f in s.getFiles()]
+        plan_files = [f for s in series if s.modality == "RTPLAN" for f in s.getFiles()]
+
+        structure_set = None
+        if structure_files and ("structures" in stages or "snapshots" in stages):
+            with span("Pipeline.LoadStructureSet"):
+                structure_set = DICOMStructureSet(structure_files[0], CT=ct.getFiles() if ct is not None and "snapshots" in stages else None, ignore_for=True)
+
+        if "structures" in stages and structure_set is not None:
+            with span("Pipeline.structures"):
+                result["rows"]["structures"] = [dict(patient=patient, file=os.path.basename(structure_files[0]), **row) for row in StructureRows(structure_set)]
+
+        if "apertures" in stages or "fluence" in stages:
+            for file in plan_files:
+                plan = DICOMMLC(file, lazy=True)
+                if "apertures" in stages:
+                    with span("Pipeline.apertures"):
+                        result["rows"]["apertures"] += [dict(patient=patient, file=os.path.basename(file), **row) for row in ApertureRows(plan)]
+                if "fluence" in stages:
+                    with span("Pipeline.fluence"):
+                        result["rows"]["fluence"] += [dict(patient=patient, file=os.path.basename(file), **row) for row in FluenceRows(plan)]
+
+        if "snapshots" in stages and structure_set is not None and hasattr(structure_set, "slices"):
+            from rtdicomtools.npLayers import LayerStack, VolumeLayer, ContourLayer
+            from rtdicomtools.npRender import SliceRenderer, SaveImage
+
+            with span("Pipeline.snapshots"):
+                path = os.path.join(job["output"], "snapshots", f"{patient}.png")
+                renderer = SliceRenderer(LayerStack([VolumeLayer(structure_set.slices, 255, 127.5), ContourLayer(structure_set)]))
+                SaveImage(path, renderer.RenderTripleView(height=job.get("snapshot_height", 512)))
+                result["rows"]["snapshots"] = [{"patient": patient, "path": path}]
+
+    except Exception as e:
+        result["status"] = "error"
+        result["stages"] = []
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["traceback"] = traceback.format_exc()
+
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def _LimitMemory(megabytes: int) -> None:
+    """Limit the address space of a worker process, so a patient which needs too much memory fails with a
+    MemoryError instead of exhausting the machine. Only supported on POSIX systems.
+
+    Args:
+        megabytes (int): The limit in MiB, or None.
+    """
+
+    if not megabytes:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = int(megabytes)*1024**2
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+class ResultWriter:
+    """Streams the rows of every stage to CSV files, and keeps the per-patient checkpoints. The columns of
+    a file are fixed by its first row, later rows with other columns are aligned to them.
+    """
+
+    def __init__(self, output: str, stages: list) -> None:
+        """Initializes the ResultWriter class.
+
+        Args:
+            output (str): Output directory.
+            stages (list): The stages, one CSV file is written per stage.
+        """
+
+        self.output = output
+        self.stages = stages
+        self.checkpoints = os.path.join(output, "checkpoints")
+        os.makedirs(self.checkpoints, exist_ok=True)
+        os.makedirs(os.path.join(output, "snapshots"), exist_ok=True)
+        self._files = {}
+        self._writers = {}
+
+    def getCheckpoint(self, patient: str) -> dict:
+        """Get the checkpoint of a patient.
+
+        Args:
+            patient (str): Patient ID.
+
+        Returns:
+            dict: The result of the patient, or None if the patient has not been processed. The key "stages"
+            lists the stages whose rows are complete.
+        """
+
+        path = self._CheckpointPath(patient)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+        except ValueError:
+            return None
+
+        # Checkpoints written before the stages were recorded contain the rows of all stages which were run.
+        if "stages" not in checkpoint:
+            checkpoint["stages"] = list(checkpoint.get("rows", {})) if checkpoint.get("status") == "done" else []
+        return checkpoint
+
+    def _CheckpointPath(self, patient: str) -> str:
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in patient)
+        return os.path.join(self.checkpoints, f"{safe}.json")
+
+    def Open(self, finished: list) -> None:
+        """Recreate the CSV files from the checkpoints of the patients which are not processed again, so rows of
+        a patient which was interrupted after its checkpoint are neither lost nor duplicated.
+
+        Args:
+            finished (list): Checkpoints of the patients which are not processed again. The rows of their complete stages are written.
+        """
+
+        for stage in self.stages:
+            self._files[stage] = open(os.path.join(self.output, f"{stage}.csv"), "w", newline="")
+            self._writers[stage] = None
+        for result in finished:
+            self._WriteRows(result)
+
+    def Write(self, result: dict, previous: dict = None) -> None:
+        """Checkpoint the result of a patient, and append the rows of its complete stages to the CSV files, also
+        if a new stage failed.
+
+        Args:
+            result (dict): The result returned by ProcessPatient.
+            previous (dict, optional): The checkpoint of an earlier run with other stages, whose complete stages
+            are kept in the new checkpoint. Defaults to None.
+        """
+
+        if previous is not None:
+            rows = {stage: previous["rows"][stage] for stage in previous["stages"]}
+            if result["status"] == "done":
+                rows.update(result["rows"])
+            result = dict(result, rows=rows, stages=[stage for stage in STAGES if stage in rows])
+
+        path = self._CheckpointPath(result["patient"])
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(result, f, default=str)
+        os.replace(f"{path}.tmp", path)
+
+        self._WriteRows(result)
+
+    def _WriteRows(self, result: dict) -> None:
+        for stage in self.stages:
+            rows = result["rows"].get(stage, []) if stage in result["stages"] else []
+            if not rows:
+                continue
+            if self._writers[stage] is None:
+                self._writers[stage] = csv.DictWriter(self._files[stage], fieldnames=list(rows[0]), extrasaction="ignore")
+                self._writers[stage].writeheader()
+            self._writers[stage].writerows(rows)
+            self._files[stage].flush()
+
+    def Close(self) -> None:
+        for f in self._files.values():
+            f.close()
+
+    def ExportParquet(self) -> list:
+        """Convert the CSV files to Parquet, which requires pyarrow or fastparquet.
+
+        Returns:
+            list: Paths of the written files.
+        """
+
+        import pandas as pd
+
+        paths = []
+        for stage in self.stages:
+            source = os.path.join(self.output, f"{stage}.csv")
+            if os.path.getsize(source) == 0:
+                continue
+            path = os.path.join(self.output, f"{stage}.parquet")
+            pd.read_csv(source).to_parquet(path, index=False)
+            paths.append(path)
+
+        return paths
+
+
+def RunPipeline(source: str, output: str, stages: list = None, workers: int = None, max_tasks_per_child: int = 1,
+                memory_limit: int = None, resume: bool = True, retry_failed: bool = True, parquet: bool = False,
+                snapshot_height: int = 512, log=print) -> dict:
+    """Run the stages on all patients of a directory or manifest in a process pool.
+
+    Args:
+        source (str): The directory or manifest, see ReadManifest.
+        output (str): Output directory.
+        stages (list, optional): The stages to run. Defaults to all stages.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        max_tasks_per_child (int, optional): Number of patients after which a worker is replaced, which returns
+        its memory to the system. Defaults to 1.
+        memory_limit (int, optional): Address space limit of every worker in MiB. Defaults to None.
+        resume (bool, optional): Skip the patients whose checkpoint contains all stages, and only run the missing
+        stages of the others. Defaults to True.
+        retry_failed (bool, optional): Process failed patients again when resuming. Defaults to True.
+        parquet (bool, optional): Also write the results as Parquet files. Defaults to False.
+        snapshot_height (int, optional): Height of the snapshots in pixels. Defaults to 512.
+        log (callable, optional): Called with progress messages. Defaults to print.
+
+    Returns:
+        dict: Number of processed, skipped and failed patients.
+    """
+
+    stages = list(STAGES if stages is None else stages)
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(unknown)}. Available stages: {', '.join(STAGES)}")
+    if parquet:
+        import pandas as pd
+        try:
+            pd.io.parquet.get_engine("auto")
+        except ImportError as e:
+            raise ImportError("Writing Parquet files requires pyarrow or fastparquet") from e
+
+    patients = ReadManifest(source)
+    writer = ResultWriter(output, stages)
+
+    finished, jobs, previous = [], [], {}
+    for patient, directory in patients.items():
+        checkpoint = writer.getCheckpoint(patient) if resume else None
+        missing = stages
+        if checkpoint is not None:
+            missing = [stage for stage in stages if stage not in checkpoint["stages"]]
+            if not missing:
+                finished.append(checkpoint)
+                continue
+            if checkpoint["status"] != "done" and not retry_failed:
+                finished.append(checkpoint)
+                continue
+            if checkpoint["stages"]:
+                previous[patient] = checkpoint
+        jobs.append({"patient": patient, "directory": directory, "stages": missing, "output": output, "snapshot_height": snapshot_height})
+
+    writer.Open(finished)
+    summary = {"patients": len(patients), "skipped": len(patients) - len(jobs), "done": 0, "failed": 0}
+    log(f"{len(patients)} patients, {summary['skipped']} already processed, {len(jobs)} to process")
+
+    pool = multiprocessing.Pool(workers, initializer=_LimitMemory, initargs=(memory_limit,), maxtasksperchild=max_tasks_per_child)
+    try:
+        for n, result in enumerate(pool.imap_unordered(ProcessPatient, jobs), start=1):
+            writer.Write(result, previous.get(result["patient"]))
+            if result["status"] == "done":
+                summary["done"] += 1
+                log(f"[{n}/{len(jobs)}] {result['patient']} done in {result['seconds']} s")
+            else:
+                summary["failed"] += 1
+                log(f"[{n}/{len(jobs)}] {result['patient']} failed: {result['error']}")
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        writer.Close()
+
+    if parquet:
+        writer.ExportParquet()
+
+    return summary
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="rtdicomtools", description=__doc__.splitlines()[0],
+                                     epilog=__doc__.split("\n\n", 1)[1], formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="directory of patient directories, or a manifest (.txt, .json or .csv)")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("-s", "--stages", default=",".join(STAGES), help=f"comma separated stages (default: {','.join(STAGES)})")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--max-tasks-per-child", type=int, default=1, help="patients per worker process before it is replaced (default: 1)")
+    parser.add_argument("--memory-limit", type=int, default=None, help="address space limit per worker in MiB (POSIX only)")
+    parser.add_argument("--restart", action="store_true", help="ignore existing checkpoints and process all patients again")
+    parser.add_argument("--skip-failed", action="store_true", help="do not retry patients which failed in a previous run")
+    parser.add_argument("--parquet", action="store_true", help="also write the results as Parquet files")
+    parser.add_argument("--snapshot-height", type=int, default=512, help="height of the snapshots in pixels (default: 512)")
+    arguments = parser.parse_args(argv)
+
+    stages = [stage.strip() for stage in arguments.stages.split(",") if stage.strip()]
+    try:
+        summary = RunPipeline(arguments.source, arguments.output, stages, arguments.workers, arguments.max_tasks_per_child,
+                              arguments.memory_limit, not arguments.restart, not arguments.skip_failed, arguments.parquet,
+                              arguments.snapshot_height)
+    except KeyboardInterrupt:
+        print("Interrupted. Run the same command again to resume.", file=sys.stderr)
+        return 130
+    except (ValueError, ImportError, OSError) as e:
+        print(f"rtdicomtools: error: {e}", file=sys.stderr)
+        return 2
+
+    print(f"{summary['done']} done, {summary['failed']} failed, {summary['skipped']} skipped")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,445 @@
+"""Local HTTP service which renders CT slices with contours and MLC apertures on request.
+
+The patients are the subdirectories of a root directory. Parsed structure sets, CTs and plans are kept in
+a least recently used pool, so only the first request of a patient reads its files. Images are rendered in
+a thread pool and returned as PNG with an ETag, so clients and proxies can revalidate them with
+If-None-Match instead of downloading them again.
+
+    GET /patients                                               patient IDs
+    GET /patients/<patient>                                     structures, slice counts and plans
+    GET /patients/<patient>/slices/<axis>/<index>.png           CT slice with contours
+        ?size=512&contours=1&structures=PTV,Rectum&thickness=1&window=400&level=40&colormap=gray
+    GET /patients/<patient>/plans/<plan>/beams/<beam>/control_points/<control_point>.png
+        ?size=512&rotate=0&edges=1
+
+    python -m rtdicomtools.Server ROOT --port 8765
+"""
+
+import os
+import cv2
+import sys
+import json
+import asyncio
+import hashlib
+import argparse
+import threading
+import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from rtdicomtools.dcmBrowser import ScanDirectory
+from rtdicomtools.Instrumentation import span
+
+
+STATUS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+          500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    """Raised while handling a request to respond with an error status.
+    """
+
+    def __init__(self, status: int, message: str = None) -> None:
+        super().__init__(message or STATUS[status])
+        self.status = status
+
+
+class PatientData:
+    """The parsed objects of one patient: the structure set with its CT, a renderer of the CT with the
+    contours, and the plans, which are parsed lazily on their first request.
+    """
+
+    def __init__(self, patient: str, directory: str) -> None:
+        """Initializes the PatientData class. Reads the headers and parses the structure set and the CT.
+
+        Args:
+            patient (str): Patient ID.
+            directory (str): Patient directory.
+        """
+
+        from rtdicomtools.dcmStructureSet import DICOMStructureSet
+        from rtdicomtools.npLayers import LayerStack, VolumeLayer, ContourLayer
+        from rtdicomtools.npRender import SliceRenderer
+        from rtdicomtools.npSliceProvider import DICOMSeriesSliceProvider
+
+        self.patient = patient
+        series = ScanDirectory(directory)
+        if not series:
+            raise HTTPError(404, f"No DICOM files for patient {patient}")
+
+        digest = hashlib.sha1()
+        for s in series:
+            digest.update(s.getKey().encode())
+        self.version = digest.hexdigest()[:16]
+
+        ct = max((s for s in series if s.modality == "CT"), key=lambda s: s.getNumberOfFiles(), default=None)
+        structure_files = [f for s in series if s.modality == "RTSTRUCT" for f in s.getFiles()]
+        self.plan_files = {os.path.basename(f): f for s in series if s.modality == "RTPLAN" for f in s.getFiles()}
+        self._plans = {}
+        self._lock = threading.Lock()
+
+        self.structure_set = None
+        self.renderer = None
+        if structure_files and ct is not None:
+            self.structure_set = DICOMStructureSet(structure_files[0], CT=ct.getFiles(), ignore_for=True)
+            self.structure_set.getSliceContours(0)
+            self.renderer = SliceRenderer(LayerStack([VolumeLayer(self.structure_set.slices, 255, 127.5), ContourLayer(self.structure_set)]))
+        elif ct is not None:
+            self.renderer = SliceRenderer(DICOMSeriesSliceProvider(ct.getFiles()), 400, 40)
+        elif structure_files:
+            self.structure_set = DICOMStructureSet(structure_files[0])
+
+    def getPlan(self, name: str):
+        """Get a plan, parsing it on the first request.
+
+        Args:
+            name (str): File name of the plan.
+
+        Returns:
+            DICOMMLC: The plan.
+        """
+
+        from rtdicomtools.dcmMLC import DICOMMLC
+
+        if name not in self.plan_files:
+            raise HTTPError(404, f"No plan {name} for patient {self.patient}")
+        with self._lock:
+            if name not in self._plans:
+                self._plans[name] = DICOMMLC(self.plan_files[name], lazy=True)
+            return self._plans[name]
+
+    def getInfo(self) -> dict:
+        """Get the description of the patient returned by /patients/<patient>.
+
+        Returns:
+            dict: Structures, slice counts of the three axes and plans with their beams.
+        """
+
+        info = {"patient": self.patient, "version": self.version, "structures": [], "slices": None, "plans": {}}
+        if self.structure_set is not None:
+            info["structures"] = self.structure_set.getAvailableStructureNames()
+        if self.renderer is not None:
+            info["slices"] = [self.renderer.getViews()[axis].shape[0] for axis in range(3)]
+        for name in self.plan_files:
+            plan = self.getPlan(name)
+            info["plans"][name] = [{"beam": beam, "name": plan.getBeamMetadata(beam)["Beam Name"],
+                                    "control_points": plan.getBeamMetadata(beam)["Number of Control Points"]}
+                                   for beam in range(plan.getNumberOfBeams()) if plan.getBeamMetadata(beam)["Leaf Pairs"] > 0]
+        return info
+
+
+class RenderServer:
+    """Asynchronous HTTP server for the rendered images of the patients in a root directory. Requests are
+    handled on the event loop, while parsing and rendering run in a thread pool. Every patient is loaded
+    only once, even if several requests for it arrive while it is loading.
+    """
+
+    def __init__(self, root: str, max_patients: int = 8, workers: int = 4, cache_bytes: int = 64*1024**2,
+                 max_age: int = 3600, compression: int = 3) -> None:
+        """Initializes the RenderServer class.
+
+        Args:
+            root (str): Directory with one subdirectory per patient.
+            max_patients (int, optional): Number of patients kept in memory. Defaults to 8.
+            workers (int, optional): Number of render threads. Defaults to 4.
+            cache_bytes (int, optional): Size of the cache of encoded images in bytes. Defaults to 64 MiB.
+            max_age (int, optional): Time in seconds clients may reuse an image without revalidating it. Defaults to 3600.
+            compression (int, optional): PNG compression level between 0 and 9. Defaults to 3.
+        """
+
+        self.root = root
+        self.max_patients = max_patients
+        self.cache_bytes = cache_bytes
+        self.max_age = max_age
+        self.compression = compression
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._patients = OrderedDict()
+        self._images = OrderedDict()
+        self._images_size = 0
+        self._server = None
+
+    def getPatients(self) -> list:
+        """Get the IDs of the patients in the root directory.
+
+        Returns:
+            list: Patient IDs.
+        """
+
+        return sorted(entry.name for entry in os.scandir(self.root) if entry.is_dir())
+
+    async def getPatient(self, patient: str) -> PatientData:
+        """Get the parsed objects of a patient, loading them in the thread pool if they are not in the pool.
+        The least recently used patient is evicted when the pool is full.
+
+        Args:
+            patient (str): Patient ID.
+
+        Returns:
+            PatientData: The patient.
+        """
+
+        if patient not in self._patients:
+            directory = os.path.join(self.root, patient)
+            if patient in (".", "..") or "/" in patient or os.sep in patient or not os.path.isdir(directory):
+                raise HTTPError(404, f"No patient {patient}")
+            self._patients[patient] = asyncio.get_running_loop().run_in_executor(self.executor, PatientData, patient, directory)
+            while len(self._patients) > self.max_patients:
+                self._patients.popitem(last=False)
+
+        self._patients.move_to_end(patient)
+        future = self._patients[patient]
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            if self._patients.get(patient) is future:
+                del self._patients[patient]
+            raise
+
+    def _Encode(self, image: np.ndarray) -> bytes:
+        """Encode an RGB image as PNG.
+
+        Args:
+            image (np.ndarray): The RGB image.
+
+        Returns:
+            bytes: The PNG file.
+        """
+
+        success, encoded = cv2.imencode(".png", cv2.cvtColor(image, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_PNG_COMPRESSION, self.compression])
+        if not success:
+            raise HTTPError(500, "Could not encode the image")
+        return encoded.tobytes()
+
+    def _RenderSlice(self, data: PatientData, axis: int, index: int, query: dict) -> bytes:
+        if data.renderer is None:
+            raise HTTPError(404, f"No CT for patient {data.patient}")
+        if axis not in (0, 1, 2) or not 0 <= index < data.renderer.getViews()[axis].shape[0]:
+            raise HTTPError(404, f"No slice {index} along axis {axis}")
+
+        # The display settings are passed as a state, so concurrent requests never change the shared layers.
+        state = list(data.renderer.getLayers().getState())
+        window, level, colormap, opacity, threshold, visible = state[0]
+        state[0] = (float(query.get("window", window)), float(query.get("level", level)), query.get("colormap", colormap), opacity, threshold, visible)
+        if len(state) > 1:
+            structures = query["structures"].split(",") if query.get("structures") else None
+            _, thickness, opacity, _ = state[1]
+            state[1] = (None if structures is None else tuple(structures), int(query.get("thickness", thickness)), opacity, query.get("contours", "1") != "0")
+
+        size = self._Size(query, data.renderer.getViews()[axis].shape[1:3])
+        with span("RenderServer.RenderSlice"):
+            return self._Encode(data.renderer.RenderView(axis, index, size, state=tuple(state)))
+
+    def _RenderAperture(self, data: PatientData, plan_name: str, beam: int, control_point: int, query: dict) -> bytes:
+        plan = data.getPlan(plan_name)
+        if beam not in range(plan.getNumberOfBeams()) or plan.getBeamMetadata(beam)["Leaf Pairs"] == 0:
+            raise HTTPError(404, f"No MLC beam {beam} in plan {plan_name}")
+        if control_point not in range(plan.getBeamMLCSequence()[beam].getNumberOfControlPoints()):
+            raise HTTPError(404, f"No control point {control_point} in beam {beam}")
+
+        with span("RenderServer.RenderAperture"):
+            image = plan.DrawMLCAperture(beam, control_point, query.get("rotate", "0") != "0", query.get("edges", "1") != "0")
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            size = self._Size(query, image.shape[:2])
+            if size is not None:
+                image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            return self._Encode(image)
+
+    @staticmethod
+    def _Size(query: dict, shape: tuple) -> tuple:
+        """Get the image size requested by the size parameter, which scales the longer side.
+
+        Args:
+            query (dict): The query parameters.
+            shape (tuple): Rows and columns of the unscaled image.
+
+        Returns:
+            tuple: Width and height, or None for the unscaled size.
+        """
+
+        if "size" not in query:
+            return None
+        size = int(query["size"])
+        if not 0 < size <= 4096:
+            raise HTTPError(400, "The size must be between 1 and 4096")
+        scale = size/max(shape)
+        return (max(int(round(shape[1]*scale)), 1), max(int(round(shape[0]*scale)), 1))
+
+    def _getCachedImage(self, key: str) -> bytes:
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+        return image
+
+    def _CacheImage(self, key: str, image: bytes) -> None:
+        if len(image) > self.cache_bytes or key in self._images:
+            return
+        self._images[key] = image
+        self._images_size += len(image)
+        while self._images_size > self.cache_bytes:
+            _, evicted = self._images.popitem(last=False)
+            self._images_size -= len(evicted)
+
+    async def Handle(self, method: str, target: str, headers: dict) -> tuple:
+        """Handle a request.
+
+        Args:
+            method (str): The request method.
+            target (str): The request target, i.e. the path and the query.
+            headers (dict): The request headers with lower case names.
+
+        Returns:
+            tuple: Status, response headers and body.
+        """
+
+        if method not in ("GET", "HEAD"):
+            raise HTTPError(405)
+
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        loop = asyncio.get_running_loop()
+
+        if parts == ["patients"]:
+            return self._Json(await loop.run_in_executor(self.executor, self.getPatients))
+        if len(parts) < 2 or parts[0] != "patients":
+            raise HTTPError(404)
+
+        data = await self.getPatient(parts[1])
+        if len(parts) == 2:
+            return self._Json(await loop.run_in_executor(self.executor, data.getInfo))
+
+        try:
+            if len(parts) == 5 and parts[2] == "slices" and parts[4].endswith(".png"):
+                arguments = (int(parts[3]), int(parts[4][:-4]))
+                render = self._RenderSlice
+            elif len(parts) == 8 and parts[2] == "plans" and parts[4] == "beams" and parts[6] == "control_points" and parts[7].endswith(".png"):
+                arguments = (parts[3], int(parts[5]), int(parts[7][:-4]))
+                render = self._RenderAperture
+            else:
+                raise HTTPError(404)
+        except ValueError:
+            raise HTTPError(400, "Indices must be integers")
+
+        # The ETag identifies the version of the patient's files and the rendered image, so it can be checked
+        # before rendering anything.
+        etag = '"' + hashlib.sha1(f"{data.version}|{url.path}|{sorted(query.items())}".encode()).hexdigest()[:32] + '"'
+        response_headers = {"ETag": etag, "Cache-Control": f"private, max-age={self.max_age}"}
+        if etag in [tag.strip() for tag in headers.get("if-none-match", "").split(",")]:
+            return 304, response_headers, b""
+
+        image = self._getCachedImage(etag)
+        if image is None:
+            try:
+                image = await loop.run_in_executor(self.executor, render, data, *arguments, query)
+            except (ValueError, KeyError) as e:
+                raise HTTPError(400, str(e))
+            self._CacheImage(etag, image)
+
+        response_headers["Content-Type"] = "image/png"
+        return 200, response_headers, image
+
+    @staticmethod
+    def _Json(value) -> tuple:
+        return 200, {"Content-Type": "application/json", "Cache-Control": "no-cache"}, json.dumps(value).encode()
+
+    async def _HandleConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve the requests of a connection. Connections are kept alive unless the client closes them.
+        """
+
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=30)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    await self._Respond(writer, 400, {}, b"Bad Request", False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+                try:
+                    status, response_headers, body = await self.Handle(method, target, headers)
+                except HTTPError as e:
+                    status, response_headers, body = e.status, {"Content-Type": "text/plain; charset=utf-8"}, str(e).encode()
+                except Exception as e:
+                    status, response_headers, body = 500, {"Content-Type": "text/plain; charset=utf-8"}, f"{type(e).__name__}: {e}".encode()
+
+                await self._Respond(writer, status, response_headers, b"" if method == "HEAD" else body, keep_alive, len(body))
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _Respond(writer: asyncio.StreamWriter, status: int, headers: dict, body: bytes, keep_alive: bool, length: int = None) -> None:
+        lines = [f"HTTP/1.1 {status} {STATUS.get(status, '')}"]
+        headers = dict(headers, **{"Content-Length": str(len(body) if length is None else length),
+                                   "Connection": "keep-alive" if keep_alive else "close"})
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def Start(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.AbstractServer:
+        """Start listening. Use port 0 to pick a free port, which can be read from the sockets of the
+        returned server.
+
+        Args:
+            host (str, optional): Address to bind to. Defaults to "127.0.0.1".
+            port (int, optional): Port to listen on. Defaults to 8765.
+
+        Returns:
+            asyncio.AbstractServer: The server.
+        """
+
+        self._server = await asyncio.start_server(self._HandleConnection, host, port)
+        return self._server
+
+    async def Serve(self, host: str = "127.0.0.1", port: int = 8765) -> None:
+        """Start listening and serve until cancelled.
+
+        Args:
+            host (str, optional): Address to bind to. Defaults to "127.0.0.1".
+            port (int, optional): Port to listen on. Defaults to 8765.
+        """
+
+        server = await self.Start(host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m rtdicomtools.Server", description=__doc__.splitlines()[0],
+                                     epilog=__doc__.split("\n\n", 1)[1], formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="directory with one subdirectory per patient")
+    parser.add_argument("--host", default="127.0.0.1", help="address to bind to (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on (default: 8765)")
+    parser.add_argument("--max-patients", type=int, default=8, help="patients kept in memory (default: 8)")
+    parser.add_argument("--workers", type=int, default=4, help="render threads (default: 4)")
+    parser.add_argument("--cache-mb", type=int, default=64, help="size of the image cache in MiB (default: 64)")
+    arguments = parser.parse_args(argv)
+
+    server = RenderServer(arguments.root, arguments.max_patients, arguments.workers, arguments.cache_mb*1024**2)
+    print(f"Serving {arguments.root} on http://{arguments.host}:{arguments.port}")
+    try:
+        asyncio.run(server.Serve(arguments.host, arguments.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
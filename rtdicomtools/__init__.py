@@ -1,3 +1,50 @@
-from rtdicomtools.dcmMLC import DICOMMLC as DICOMMLC
-from rtdicomtools.dcmStructureSet import DICOMStructureSet as DICOMStructureSet
-from rtdicomtools.npViewer3D import NumpyViewer3D as NumpyViewer3D
\ No newline at end of file
+"""Public classes and functions of rtdicomtools. They are imported lazily on first access, so importing the
+package only loads the dependencies of the modules which are actually used, and the GUI modules are never
+loaded in headless processes.
+"""
+
+import importlib
+
+_EXPORTS = {
+    "DICOMMLC": "rtdicomtools.dcmMLC",
+    "DICOMStructureSet": "rtdicomtools.dcmStructureSet",
+    "NumpyViewer3D": "rtdicomtools.npViewer3D",
+    "DICOMMLCComparison": "rtdicomtools.dcmMLCComparison",
+    "CompareMLCPlans": "rtdicomtools.dcmMLCComparison",
+    "DeliveryLogReader": "rtdicomtools.dcmDeliveryLog",
+    "DeliveryLogComparison": "rtdicomtools.dcmDeliveryLog",
+    "CompareDeliveryLog": "rtdicomtools.dcmDeliveryLog",
+    "SharedArrays": "rtdicomtools.npSharedMemory",
+    "SliceProvider": "rtdicomtools.npSliceProvider",
+    "ArraySliceProvider": "rtdicomtools.npSliceProvider",
+    "DICOMSeriesSliceProvider": "rtdicomtools.npSliceProvider",
+    "LayerStack": "rtdicomtools.npLayers",
+    "VolumeLayer": "rtdicomtools.npLayers",
+    "MaskLayer": "rtdicomtools.npLayers",
+    "ContourLayer": "rtdicomtools.npLayers",
+    "SliceRenderer": "rtdicomtools.npRender",
+    "ExportSnapshots": "rtdicomtools.npRender",
+    "SaveImage": "rtdicomtools.npRender",
+    "ResliceVolume": "rtdicomtools.npReslice",
+    "ResliceBeamsEyeView": "rtdicomtools.npReslice",
+    "NumpyViewerWindow": "rtdicomtools.npViewer3D",
+    "ScanDirectory": "rtdicomtools.dcmBrowser",
+    "ThumbnailCache": "rtdicomtools.dcmBrowser",
+    "DICOMBeamsEyeView": "rtdicomtools.dcmBEV",
+    "ProjectToBeamsEyeView": "rtdicomtools.dcmBEV",
+    "CompareStructureApertures": "rtdicomtools.dcmBEV",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
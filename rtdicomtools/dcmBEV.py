@@ -0,0 +1,455 @@
+import cv2
+import numpy as np
+import pandas as pd
+
+from rtdicomtools.dcmMLC import DICOMMLC
+from rtdicomtools.dcmStructureSet import DICOMStructureSet
+from rtdicomtools.Instrumentation import instrumented
+
+
+# Axes of the IEC fixed coordinate system in the DICOM patient coordinate system, for every patient position.
+PATIENT_POSITIONS = {
+    "HFS": np.array([[1, 0, 0], [0, 0, 1], [0, -1, 0]], dtype=np.float64),
+    "HFP": np.array([[-1, 0, 0], [0, 0, 1], [0, 1, 0]], dtype=np.float64),
+    "FFS": np.array([[-1, 0, 0], [0, 0, -1], [0, -1, 0]], dtype=np.float64),
+    "FFP": np.array([[1, 0, 0], [0, 0, -1], [0, 1, 0]], dtype=np.float64),
+}
+
+SUMMARY_COLUMNS = ["Beam", "Structure", "Control Point", "Gantry Angle [deg]", "Structure Area [mm²]", "Aperture Area [mm²]",
+                   "Covered Area [mm²]", "Overexposed Area [mm²]", "Underexposed Area [mm²]", "Coverage"]
+
+
+def BeamLimitingDeviceAxes(gantry_angles, collimator_angle: float = 0.0, couch_angle: float = 0.0, patient_position: str = "HFS") -> np.ndarray:
+    """Calculate the axes of the IEC 61217 beam limiting device coordinate system in the DICOM patient
+    coordinate system. The gantry rotates about the IEC fixed Y axis, the collimator about the beam axis
+    and the patient support about the vertical axis.
+
+    Args:
+        gantry_angles (array_like): Gantry angles in degrees.
+        collimator_angle (float, optional): Collimator angle in degrees. Defaults to 0.0.
+        couch_angle (float, optional): Patient support angle in degrees. Defaults to 0.0.
+        patient_position (str, optional): Patient position, one of PATIENT_POSITIONS. Defaults to "HFS".
+
+    Returns:
+        np.ndarray: X (leaf travel), Y (across the leaves) and Z (towards the source) axes of shape (gantry angles, 3, 3).
+    """
+
+    if patient_position not in PATIENT_POSITIONS:
+        raise ValueError(f"Unsupported patient position {patient_position}, use one of {', '.join(PATIENT_POSITIONS)}")
+
+    gantry = np.deg2rad(np.atleast_1d(np.asarray(gantry_angles, dtype=np.float64)))
+    collimator = np.deg2rad(collimator_angle)
+    couch = np.deg2rad(couch_angle)
+
+    cos, sin = np.cos(gantry), np.sin(gantry)
+    zeros, ones = np.zeros_like(gantry), np.ones_like(gantry)
+    gantry_axes = np.stack([np.stack([cos, zeros, -sin], -1),
+                            np.stack([zeros, ones, zeros], -1),
+                            np.stack([sin, zeros, cos], -1)], axis=1)
+
+    collimator_rotation = np.array([[np.cos(collimator), np.sin(collimator), 0],
+                                    [-np.sin(collimator), np.cos(collimator), 0],
+                                    [0, 0, 1]])
+    couch_rotation = np.array([[np.cos(couch), -np.sin(couch), 0],
+                               [np.sin(couch), np.cos(couch), 0],
+                               [0, 0, 1]])
+
+    # Rows of the result map patient coordinates to beam limiting device coordinates.
+    return collimator_rotation @ gantry_axes @ couch_rotation @ PATIENT_POSITIONS[patient_position]
+
+
+def ProjectToBeamsEyeView(points: np.ndarray, isocenter, gantry_angles, collimator_angle: float = 0.0, couch_angle: float = 0.0,
+                          source_axis_distance: float = 1000.0, patient_position: str = "HFS") -> np.ndarray:
+    """Project points in the DICOM patient coordinate system into the beam's-eye view of many gantry angles
+    at once. The points are projected from the source onto the isocenter plane, so the result is in the
+    coordinates of the MLC leaf positions.
+
+    Args:
+        points (np.ndarray): Points of shape (n, 3) in mm.
+        isocenter (array_like): Isocenter in the DICOM patient coordinate system in mm.
+        gantry_angles (array_like): Gantry angles in degrees.
+        collimator_angle (float, optional): Collimator angle in degrees. Defaults to 0.0.
+        couch_angle (float, optional): Patient support angle in degrees. Defaults to 0.0.
+        source_axis_distance (float, optional): Source to isocenter distance in mm. Defaults to 1000.0.
+        patient_position (str, optional): Patient position, one of PATIENT_POSITIONS. Defaults to "HFS".
+
+    Returns:
+        np.ndarray: X and Y in the isocenter plane of shape (gantry angles, n, 2) in mm.
+    """
+
+    axes = BeamLimitingDeviceAxes(gantry_angles, collimator_angle, couch_angle, patient_position)
+    relative = np.asarray(points, dtype=np.float64) - np.asarray(isocenter, dtype=np.float64)
+    device = np.einsum("gij,nj->gni", axes, relative)
+
+    depth = source_axis_distance - device[..., 2]
+    if np.any(depth <= 0):
+        raise ValueError("Points at or behind the source cannot be projected")
+
+    return device[..., :2] * (source_axis_distance/depth)[..., None]
+
+
+class DICOMBeamsEyeView:
+    """Class to compare a structure with the MLC apertures of a beam in the beam's-eye view. The structure
+    is projected into the beam's-eye view of every control point and rasterized on the pixel grid of
+    DrawMLCAperture, and the coverage of the structure by the aperture, limited by the jaws, is
+    calculated for all control points in one call.
+
+    Every contour is extruded by half the slice thickness to both sides, and the projections of both
+    caps and all side faces of the resulting slabs are filled, so the projection is the silhouette of
+    the structure even when the beam runs parallel to the slices. Inner contours are filled as well. The
+    projection of all contour points is calculated in one vectorized pass for all control points.
+    """
+
+    def __init__(self, structure_set: DICOMStructureSet, plan: DICOMMLC, structure: str, beam: int, control_points: list = None,
+                 slice_thickness: float = None, patient_position: str = None) -> None:
+        """Initialize the DICOMBeamsEyeView class.
+
+        Args:
+            structure_set (DICOMStructureSet): Structure set containing the structure.
+            plan (DICOMMLC): The plan, which has to specify the isocenter.
+            structure (str): Name of the structure, e.g. the PTV.
+            beam (int): Beam number.
+            control_points (list, optional): Control point indices. Defaults to all control points.
+            slice_thickness (float, optional): Distance between the contoured slices in mm. Defaults to the median distance of the slices of the structure.
+            patient_position (str, optional): Patient position, one of PATIENT_POSITIONS, which overrides the patient
+            position of the patient setup of the beam. Defaults to the plan, or "HFS" if the plan does not specify it.
+        """
+
+        contour = structure_set.getStructureContour(structure)
+        if contour is None or not contour.getContours():
+            raise ValueError(f"The structure {structure} has no contours")
+
+        self._plan = plan
+        self._beam = beam
+        self._structure = structure
+        self._beam_mlc = plan.getBeamMLCSequence()[beam]
+        if self._beam_mlc.getLeafBoundaryArray().size == 0:
+            raise ValueError(f"Beam {beam} does not have an MLC")
+        if self._beam_mlc.getIsocenter() is None:
+            raise ValueError(f"Beam {beam} does not specify an isocenter")
+
+        if patient_position is None:
+            patient_position = self._beam_mlc.getPatientPosition() or "HFS"
+        self._patient_position = patient_position
+
+        self._control_points = np.arange(self._beam_mlc.getNumberOfControlPoints()) if control_points is None else np.asarray(control_points, dtype=int)
+        self._gantry_angles = np.asarray(self._beam_mlc.getGantryAngles(), dtype=np.float64)[self._control_points]
+
+        rows, columns = plan.getDimensions()[0], plan.getDimensions()[1]
+        self._rows, self._columns = rows, columns
+        self._center = (int(columns/2), int(rows/2))
+        self._spacing = plan.getPixelSpacing()
+
+        slices = np.asarray(contour.getSlices(), dtype=np.float64)
+        if slice_thickness is None:
+            distances = np.diff(np.unique(slices))
+            slice_thickness = float(np.median(distances)) if distances.size else 1.0
+        self._slice_thickness = slice_thickness
+
+        # All contour points at both caps of their slabs, and the offsets of the contours in the stacked array.
+        lengths = np.array([len(points) for points in contour.getContours()])
+        self._offsets = np.concatenate([[0], np.cumsum(lengths)])
+        xy = np.concatenate(contour.getContours())
+        z = np.repeat(slices, lengths)
+        points = np.concatenate([np.column_stack([xy, z - slice_thickness/2]), np.column_stack([xy, z + slice_thickness/2])])
+
+        projected = ProjectToBeamsEyeView(points, self._beam_mlc.getIsocenter(), self._gantry_angles, self._beam_mlc.getCollimatorAngle(),
+                                          self._beam_mlc.getCouchAngle(), self._beam_mlc.getSourceAxisDistance(), self._patient_position)
+        self._projections = self._ToPixels(projected)
+
+        self._target_areas, self._aperture_areas, self._covered_areas = self._CalculateAreas()
+
+    def _ToPixels(self, coordinates: np.ndarray) -> np.ndarray:
+        """Convert beam's-eye view coordinates to pixel coordinates of the DrawMLCAperture grid.
+
+        Args:
+            coordinates (np.ndarray): X and Y in mm.
+
+        Returns:
+            np.ndarray: Columns and rows as float.
+        """
+
+        pixels = np.empty_like(coordinates)
+        pixels[..., 0] = self._center[0] + coordinates[..., 0]*self._spacing
+        pixels[..., 1] = self._rows - 1 - (self._center[1] + coordinates[..., 1]*self._spacing)
+        return pixels
+
+    def _ApertureBounds(self, control_point: int) -> tuple:
+        """Calculate the open columns of every pixel row of the aperture, limited by the jaws.
+
+        Args:
+            control_point (int): Control point index.
+
+        Returns:
+            tuple: First open column and the column after the last open column of every row.
+        """
+
+        boundaries = self._beam_mlc.getLeafBoundaryArray()
+        leaves = self._beam_mlc.getLeafPositionArray()[control_point]
+        jaws = self._beam_mlc.getJawPositionArray()[control_point]
+
+        # Leaves and their tips are truncated to pixels like in DrawMLCAperture, where the leaves include their
+        # tip pixels and both boundary rows, so a boundary row is only open where both of its leaves are open.
+        y = self._rows - 1 - np.arange(self._rows)
+        pixel_boundaries = self._center[1] + np.trunc(boundaries*self._spacing)
+        upper = np.clip(np.searchsorted(pixel_boundaries, y, side="right") - 1, 0, leaves.shape[1] - 1)
+        lower = np.clip(np.searchsorted(pixel_boundaries, y, side="left") - 1, 0, leaves.shape[1] - 1)
+        inside = (y >= pixel_boundaries[0]) & (y <= pixel_boundaries[-1])
+        if not np.isnan(jaws[1]).any():
+            position = (y - self._center[1])/self._spacing
+            inside &= (position >= jaws[1, 0]) & (position < jaws[1, 1])
+
+        tips = self._center[0] + np.trunc(leaves*self._spacing)
+        start = np.maximum(tips[0, lower], tips[0, upper]) + 1
+        stop = np.minimum(tips[1, lower], tips[1, upper])
+        if not np.isnan(jaws[0]).any():
+            start = np.maximum(start, np.ceil(self._center[0] + jaws[0, 0]*self._spacing))
+            stop = np.minimum(stop, np.ceil(self._center[0] + jaws[0, 1]*self._spacing))
+        start = np.clip(start, 0, self._columns).astype(np.int64)
+        stop = np.clip(stop, 0, self._columns).astype(np.int64)
+        stop = np.where(inside, np.maximum(stop, start), start)
+
+        return start, stop
+
+    def _RasterizeTarget(self, index: int, shape: tuple = None, offset: tuple = (0, 0)) -> np.ndarray:
+        """Fill the projection of the structure for one control point.
+
+        Args:
+            index (int): Position of the control point in the control points of this object.
+            shape (tuple, optional): Rows and columns of the mask. Defaults to the aperture grid.
+            offset (tuple, optional): Column and row of the aperture grid at the origin of the mask. Defaults to (0, 0).
+
+        Returns:
+            np.ndarray: The mask as uint8.
+        """
+
+        mask = np.zeros((self._rows, self._columns) if shape is None else shape, dtype=np.uint8)
+        pixels = np.round((self._projections[index] - np.asarray(offset))*16).astype(np.int32)
+        lower, upper = np.split(pixels, 2)
+
+        caps = [cap[start:stop] for cap in (lower, upper) for start, stop in zip(self._offsets[:-1], self._offsets[1:])]
+        for cap in caps:
+            cv2.fillPoly(mask, [cap], 1, lineType=cv2.LINE_8, shift=4)
+
+        # Side faces between the caps. Faces are convex, and cv2.fillPoly would cancel overlapping faces, so
+        # they are filled one by one.
+        following = np.arange(len(lower)) + 1
+        following[self._offsets[1:] - 1] = self._offsets[:-1]
+        faces = np.stack([lower, lower[following], upper[following], upper], axis=1)
+        for face in faces:
+            cv2.fillConvexPoly(mask, face, 1, lineType=cv2.LINE_8, shift=4)
+
+        return mask
+
+    @instrumented()
+    def _CalculateAreas(self) -> tuple:
+        """Rasterize the structure of every control point within its bounding box, and count the pixels of
+        the structure, the aperture and their intersection.
+
+        Returns:
+            tuple: Structure, aperture and covered areas of every control point in mm².
+        """
+
+        pixel_area = 1/self._spacing**2
+        target_areas = np.zeros(len(self._control_points), dtype=np.float64)
+        aperture_areas = np.zeros(len(self._control_points), dtype=np.float64)
+        covered_areas = np.zeros(len(self._control_points), dtype=np.float64)
+
+        for n, control_point in enumerate(self._control_points):
+            start, stop = self._ApertureBounds(control_point)
+            aperture_areas[n] = (stop - start).sum()*pixel_area
+
+            low = np.clip(np.floor(self._projections[n].min(axis=0)).astype(int) - 1, 0, None)
+            high = np.minimum(np.ceil(self._projections[n].max(axis=0)).astype(int) + 2, (self._columns, self._rows))
+            if np.any(high <= low):
+                continue
+            target = self._RasterizeTarget(n, (high[1] - low[1], high[0] - low[0]), tuple(low)).astype(bool)
+
+            columns = np.arange(low[0], high[0])
+            aperture = (columns[None, :] >= start[low[1]:high[1], None]) & (columns[None, :] < stop[low[1]:high[1], None])
+            target_areas[n] = np.count_nonzero(target)*pixel_area
+            covered_areas[n] = np.count_nonzero(target & aperture)*pixel_area
+
+        return target_areas, aperture_areas, covered_areas
+
+    def getControlPointIndices(self) -> np.ndarray:
+        """Get the indices of the evaluated control points.
+
+        Returns:
+            np.ndarray: Control point indices.
+        """
+
+        return self._control_points
+
+    def getPatientPosition(self) -> str:
+        """Get the patient position used for the projection.
+
+        Returns:
+            str: Patient position, e.g. "HFS".
+        """
+
+        return self._patient_position
+
+    def getGantryAngles(self) -> np.ndarray:
+        """Get the gantry angles of the evaluated control points.
+
+        Returns:
+            np.ndarray: Gantry angles in degrees.
+        """
+
+        return self._gantry_angles
+
+    def getProjection(self, control_point: int) -> list:
+        """Get the projected contours of a control point, at the center of their slabs.
+
+        Args:
+            control_point (int): Control point index.
+
+        Returns:
+            list: Contours in the beam's-eye view as arrays of shape (n, 2) of X and Y in mm.
+        """
+
+        index = self._Index(control_point)
+        lower, upper = np.split(self._projections[index], 2)
+        middle = (lower + upper)/2
+        coordinates = np.column_stack([(middle[:, 0] - self._center[0])/self._spacing,
+                                       (self._rows - 1 - middle[:, 1] - self._center[1])/self._spacing])
+        return [coordinates[start:stop] for start, stop in zip(self._offsets[:-1], self._offsets[1:])]
+
+    def getTargetAreas(self) -> np.ndarray:
+        """Get the projected area of the structure of every control point.
+
+        Returns:
+            np.ndarray: Areas in mm² in the isocenter plane.
+        """
+
+        return self._target_areas
+
+    def getApertureAreas(self) -> np.ndarray:
+        """Get the aperture area of every control point, limited by the jaws.
+
+        Returns:
+            np.ndarray: Areas in mm² in the isocenter plane.
+        """
+
+        return self._aperture_areas
+
+    def getCoverage(self) -> np.ndarray:
+        """Get the fraction of the projected structure inside the aperture of every control point.
+
+        Returns:
+            np.ndarray: Coverage between 0 and 1, NaN if the structure is outside of the pixel grid.
+        """
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self._target_areas > 0, self._covered_areas/self._target_areas, np.nan)
+
+    def getOverexposedAreas(self) -> np.ndarray:
+        """Get the aperture area outside of the projected structure of every control point.
+
+        Returns:
+            np.ndarray: Areas in mm² in the isocenter plane.
+        """
+
+        return self._aperture_areas - self._covered_areas
+
+    def getUnderexposedAreas(self) -> np.ndarray:
+        """Get the area of the projected structure blocked by the MLC or the jaws of every control point.
+
+        Returns:
+            np.ndarray: Areas in mm² in the isocenter plane.
+        """
+
+        return self._target_areas - self._covered_areas
+
+    def getSummary(self) -> pd.DataFrame:
+        """Summarize the comparison per control point.
+
+        Returns:
+            pd.DataFrame: Gantry angle, structure, aperture, covered, overexposed and underexposed area and coverage of each control point.
+        """
+
+        values = [self._beam, self._structure, self._control_points, self._gantry_angles, self._target_areas, self._aperture_areas,
+                  self._covered_areas, self.getOverexposedAreas(), self.getUnderexposedAreas(), self.getCoverage()]
+        return pd.DataFrame(dict(zip(SUMMARY_COLUMNS, values)))
+
+    def _Index(self, control_point: int) -> int:
+        indices = np.flatnonzero(self._control_points == control_point)
+        if indices.size == 0:
+            raise KeyError(f"Control point {control_point} was not evaluated")
+        return int(indices[0])
+
+    def DrawTargetMask(self, control_point: int) -> np.ndarray:
+        """Draw the projected structure of a control point on the pixel grid of DrawMLCAperture.
+
+        Args:
+            control_point (int): Control point index.
+
+        Returns:
+            np.ndarray: The mask as bool.
+        """
+
+        return self._RasterizeTarget(self._Index(control_point)).astype(bool)
+
+    def DrawApertureMask(self, control_point: int) -> np.ndarray:
+        """Draw the aperture of a control point, limited by the jaws, on the pixel grid of DrawMLCAperture.
+
+        Args:
+            control_point (int): Control point index.
+
+        Returns:
+            np.ndarray: The mask as bool.
+        """
+
+        start, stop = self._ApertureBounds(control_point)
+        columns = np.arange(self._columns)
+        return (columns[None, :] >= start[:, None]) & (columns[None, :] < stop[:, None])
+
+    def DrawBeamsEyeView(self, control_point: int, rotate: bool = False) -> np.ndarray:
+        """Draw the aperture of a control point with the projected structure. Covered parts of the structure
+        are green, blocked parts red and the aperture outside of the structure white.
+
+        Args:
+            control_point (int): Control point index.
+            rotate (bool, optional): Rotate the image with the collimator, like DrawMLCAperture. Defaults to False.
+
+        Returns:
+            np.ndarray: The RGB image.
+        """
+
+        target = self.DrawTargetMask(control_point)
+        aperture = self.DrawApertureMask(control_point)
+
+        image = np.zeros((self._rows, self._columns, 3), dtype=np.uint8)
+        image[aperture] = (255, 255, 255)
+        image[target & aperture] = (0, 200, 0)
+        image[target & ~aperture] = (200, 0, 0)
+
+        if rotate:
+            matrix = cv2.getRotationMatrix2D((self._columns/2, self._rows/2), self._beam_mlc.getCollimatorAngle(), 1.0)
+            image = cv2.warpAffine(image, matrix, (self._columns, self._rows), flags=cv2.INTER_NEAREST)
+
+        return image
+
+
+def CompareStructureApertures(structure_set: DICOMStructureSet, plan: DICOMMLC, structures: list, beams: list = None, **options) -> pd.DataFrame:
+    """Compare structures with the apertures of the beams of a plan and collect the per control point summaries.
+
+    Args:
+        structure_set (DICOMStructureSet): Structure set containing the structures.
+        plan (DICOMMLC): The plan.
+        structures (list): Names of the structures.
+        beams (list, optional): Beam numbers. Defaults to all beams with an MLC.
+        **options: Options passed to DICOMBeamsEyeView, e.g. patient_position.
+
+    Returns:
+        pd.DataFrame: The per control point summaries of all structures and beams, empty if there are none.
+    """
+
+    if beams is None:
+        beams = [beam for beam in range(plan.getNumberOfBeams()) if plan.getBeamMetadata(beam)["Leaf Pairs"] > 0]
+
+    summaries = [DICOMBeamsEyeView(structure_set, plan, structure, beam, **options).getSummary() for structure in structures for beam in beams]
+    if not summaries:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+    return pd.concat(summaries, ignore_index=True)
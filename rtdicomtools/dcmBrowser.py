@@ -0,0 +1,227 @@
+import os
+import cv2
+import hashlib
+import pydicom
+import numpy as np
+
+from pydicom.pixel_data_handlers import apply_rescale
+
+
+SCAN_TAGS = ["PatientID", "PatientName", "StudyInstanceUID", "StudyDescription", "StudyDate", "SeriesInstanceUID",
+             "SeriesDescription", "SeriesNumber", "Modality", "ImagePositionPatient", "InstanceNumber"]
+
+
+class DICOMSeries:
+    """A series of a patient directory, as found by a header-only scan. Only the tags needed to list and sort
+    the series are kept, the files are not read until a thumbnail or the series itself is requested.
+    """
+
+    def __init__(self, patient_id: str, patient_name: str, study_uid: str, study_description: str, series_uid: str,
+                 series_description: str, modality: str) -> None:
+        """Initializes the DICOMSeries class.
+
+        Args:
+            patient_id (str): Patient ID.
+            patient_name (str): Patient name.
+            study_uid (str): Study Instance UID.
+            study_description (str): Study description.
+            series_uid (str): Series Instance UID.
+            series_description (str): Series description.
+            modality (str): Modality of the series.
+        """
+
+        self.patient_id = patient_id
+        self.patient_name = patient_name
+        self.study_uid = study_uid
+        self.study_description = study_description
+        self.series_uid = series_uid
+        self.series_description = series_description
+        self.modality = modality
+        self._files = []
+        self._positions = []
+
+    def __str__(self):
+        return f"{self.modality} {self.series_description or self.series_uid} ({len(self._files)} files)"
+
+    def _AddFile(self, file: str, position: float) -> None:
+        self._files.append(file)
+        self._positions.append(position)
+
+    def getFiles(self) -> list:
+        """Get the files of the series, sorted along the patient z axis for images.
+
+        Returns:
+            list: Paths to the files.
+        """
+
+        order = np.argsort(self._positions, kind="stable")
+        return [self._files[i] for i in order]
+
+    def getNumberOfFiles(self) -> int:
+        """Get the number of files of the series.
+
+        Returns:
+            int: Number of files.
+        """
+
+        return len(self._files)
+
+    def getKey(self) -> str:
+        """Get a key which changes whenever a file of the series is added, removed or modified, used to
+        name the cached thumbnail.
+
+        Returns:
+            str: Hexadecimal key.
+        """
+
+        digest = hashlib.sha1(self.series_uid.encode())
+        for file in sorted(self._files):
+            stat = os.stat(file)
+            digest.update(f"{file}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+
+
+def ScanDirectory(directory: str, progress=None) -> list:
+    """Scan a directory for DICOM files, reading only the headers needed to group them into patients,
+    studies and series. Files which are not DICOM are skipped.
+
+    Args:
+        directory (str): The directory, which is searched recursively.
+        progress (callable, optional): Called with the number of scanned files and the total number of files. Defaults to None.
+
+    Returns:
+        list: DICOMSeries objects, sorted by patient, study and series.
+    """
+
+    files = [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names]
+    series = {}
+    for n, file in enumerate(files):
+        try:
+            ds = pydicom.dcmread(file, stop_before_pixels=True, specific_tags=SCAN_TAGS)
+            modality = ds.Modality
+        except Exception:
+            modality = None
+
+        if modality is not None:
+            uid = str(ds.get("SeriesInstanceUID", file))
+            if uid not in series:
+                series[uid] = DICOMSeries(str(ds.get("PatientID", "")), str(ds.get("PatientName", "")), str(ds.get("StudyInstanceUID", "")),
+                                          str(ds.get("StudyDescription", "")), uid, str(ds.get("SeriesDescription", "")), str(modality))
+            if "ImagePositionPatient" in ds:
+                position = float(ds.ImagePositionPatient[2])
+            else:
+                position = float(ds.get("InstanceNumber", None) or 0)
+            series[uid]._AddFile(file, position)
+
+        if progress is not None:
+            progress(n + 1, len(files))
+
+    return sorted(series.values(), key=lambda s: (s.patient_id, s.study_uid, s.modality, s.series_description, s.series_uid))
+
+
+class ThumbnailCache:
+    """On-disk cache of series thumbnails. A CT or other image series is shown by its downsampled middle
+    slice and a plan by the aperture of the first control point of its first MLC beam. Thumbnails are
+    stored as PNG files named by the key of the series, so they are only generated once per version of
+    the files. Generating thumbnails is thread-safe.
+    """
+
+    def __init__(self, directory: str = None, size: int = 64, window: float = 400, level: float = 40) -> None:
+        """Initializes the ThumbnailCache class.
+
+        Args:
+            directory (str, optional): Cache directory. Defaults to ~/.cache/rtdicomtools/thumbnails.
+            size (int, optional): Width and height of the thumbnails in pixels. Defaults to 64.
+            window (float, optional): Width of the display window of CT images. Defaults to 400.
+            level (float, optional): Center of the display window of CT images. Defaults to 40.
+        """
+
+        self.directory = directory or os.path.join(os.path.expanduser("~"), ".cache", "rtdicomtools", "thumbnails")
+        self.size = size
+        self.window = window
+        self.level = level
+        os.makedirs(self.directory, exist_ok=True)
+
+    def getPath(self, series: DICOMSeries) -> str:
+        """Get the path of the cached thumbnail of a series.
+
+        Args:
+            series (DICOMSeries): The series.
+
+        Returns:
+            str: Path of the PNG file.
+        """
+
+        return os.path.join(self.directory, f"{series.getKey()}_{self.size}.png")
+
+    def getThumbnail(self, series: DICOMSeries) -> np.ndarray:
+        """Get the thumbnail of a series, generating it if it is not cached.
+
+        Args:
+            series (DICOMSeries): The series.
+
+        Returns:
+            np.ndarray: The RGB thumbnail, or None if the modality has no thumbnail.
+        """
+
+        path = self.getPath(series)
+        if os.path.exists(path):
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is not None:
+                return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+        image = self.DrawThumbnail(series)
+        if image is None:
+            return None
+
+        temporary = f"{path}.{os.getpid()}.{id(image)}.png"
+        if cv2.imwrite(temporary, cv2.cvtColor(image, cv2.COLOR_RGB2BGR)):
+            os.replace(temporary, path)
+        return image
+
+    def DrawThumbnail(self, series: DICOMSeries) -> np.ndarray:
+        """Draw the thumbnail of a series without using the cache.
+
+        Args:
+            series (DICOMSeries): The series.
+
+        Returns:
+            np.ndarray: The RGB thumbnail, or None if the modality has no thumbnail.
+        """
+
+        if series.modality == "RTPLAN":
+            from rtdicomtools.dcmMLC import DICOMMLC
+
+            try:
+                plan = DICOMMLC(series.getFiles()[0], lazy=True)
+            except ValueError:
+                # The plan does not contain a beam with an MLC.
+                return None
+            # Setup and electron beams have no MLC, and their aperture would be empty.
+            beam = next((beam for beam in range(plan.getNumberOfBeams()) if plan.getBeamMetadata(beam)["Leaf Pairs"] > 0), None)
+            if beam is None:
+                return None
+            image = plan.DrawMLCAperture(beam, 0, rotate=True, draw_edges=False)
+        elif series.modality in ("RTSTRUCT", "RTDOSE", "RTRECORD", "SR", "REG"):
+            return None
+        else:
+            files = series.getFiles()
+            ds = pydicom.dcmread(files[len(files)//2])
+            pixels = apply_rescale(ds.pixel_array, ds).astype(np.float32)
+            if pixels.ndim == 3 and pixels.shape[-1] != 3:
+                pixels = pixels[len(pixels)//2]
+            if pixels.ndim == 2:
+                window, level = (self.window, self.level) if series.modality == "CT" else (np.ptp(pixels) or 1.0, (pixels.max() + pixels.min())/2)
+                pixels = np.clip((pixels - (level - window/2))*255/window, 0, 255)
+                image = cv2.cvtColor(pixels.astype(np.uint8), cv2.COLOR_GRAY2RGB)
+            else:
+                image = np.clip(pixels, 0, 255).astype(np.uint8)
+
+        height, width = image.shape[:2]
+        scale = self.size/max(height, width)
+        resized = cv2.resize(np.ascontiguousarray(image), (max(int(width*scale), 1), max(int(height*scale), 1)), interpolation=cv2.INTER_AREA)
+        thumbnail = np.zeros((self.size, self.size, 3), dtype=np.uint8)
+        top, left = (self.size - resized.shape[0])//2, (self.size - resized.shape[1])//2
+        thumbnail[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+
+        return thumbnail
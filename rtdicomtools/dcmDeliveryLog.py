@@ -0,0 +1,238 @@
+import itertools
+import numpy as np
+
+from rtdicomtools.dcmMLC import DICOMMLC
+
+
+class DeliveryLogReader:
+    """Streaming reader for delimited text delivery logs, such as machine trajectory logs or DynaLogs
+    exported to text. Every row is one snapshot containing the delivered meterset and the leaf positions.
+    The file is read in chunks of rows, so memory stays bounded for long logs.
+
+    The leaf positions are expected in the same order as the DICOM LeafJawPositions, i.e. all leaves of
+    bank 1 followed by all leaves of bank 2, starting at `leaf_column` and `columns_per_leaf` columns apart.
+    Vendor specific units are converted with `meterset_scale` and `position_scale`.
+    """
+
+    def __init__(self, path: str, leaf_pairs: int, meterset_column: int = 0, leaf_column: int = 1, columns_per_leaf: int = 1,
+                 meterset_scale: float = 1.0, position_scale: float = 1.0, delimiter: str = ",", skip_header: int = 0,
+                 comments: str = "#", chunk_size: int = 4096) -> None:
+        """Initialize the DeliveryLogReader class.
+
+        Args:
+            path (str): Path to the log file.
+            leaf_pairs (int): Number of leaf pairs in the log.
+            meterset_column (int, optional): Column of the delivered meterset. Defaults to 0.
+            leaf_column (int, optional): Column of the first leaf of bank 1. Defaults to 1.
+            columns_per_leaf (int, optional): Number of columns between two consecutive leaves. Defaults to 1.
+            meterset_scale (float, optional): Factor converting the meterset column to a fraction of the beam meterset. Defaults to 1.0.
+            position_scale (float, optional): Factor converting the leaf columns to mm. Defaults to 1.0.
+            delimiter (str, optional): Column delimiter. Defaults to ",".
+            skip_header (int, optional): Number of header lines to skip. Defaults to 0.
+            comments (str, optional): Prefix of comment lines. Defaults to "#".
+            chunk_size (int, optional): Number of snapshots per block. Defaults to 4096.
+        """
+
+        if chunk_size < 1:
+            raise ValueError("The chunk size must be at least 1")
+
+        self._path = path
+        self._leaf_pairs = leaf_pairs
+        self._meterset_scale = meterset_scale
+        self._position_scale = position_scale
+        self._delimiter = delimiter
+        self._skip_header = skip_header
+        self._comments = comments
+        self._chunk_size = chunk_size
+        self._columns = [meterset_column] + [leaf_column + i * columns_per_leaf for i in range(2 * leaf_pairs)]
+
+    def __iter__(self):
+        """Read the log one block of snapshots at a time.
+
+        Yields:
+            tuple: Meterset fractions of shape (snapshots,) and leaf positions of shape (snapshots, 2, leaf pairs) in mm.
+        """
+
+        with open(self._path, "r") as file:
+            for _ in range(self._skip_header):
+                next(file, None)
+
+            while True:
+                lines = list(itertools.islice(file, self._chunk_size))
+                if not lines:
+                    break
+                block = np.loadtxt(lines, delimiter=self._delimiter, comments=self._comments, usecols=self._columns, ndmin=2)
+                if block.size == 0:
+                    continue
+
+                meterset = block[:, 0] * self._meterset_scale
+                leaves = block[:, 1:].reshape(-1, 2, self._leaf_pairs) * self._position_scale
+                yield meterset, leaves
+
+    def getLeafPairs(self) -> int:
+        """Get the number of leaf pairs.
+
+        Returns:
+            int: Number of leaf pairs.
+        """
+
+        return self._leaf_pairs
+
+
+class DeliveryLogComparison:
+    """Class to compare delivered leaf positions with the planned positions of a beam. Every snapshot is
+    aligned to the plan by its meterset fraction, and the planned leaf positions are linearly interpolated
+    between the control points. Error statistics and per-leaf histograms are accumulated incrementally,
+    so blocks of any log length can be added with Update.
+    """
+
+    def __init__(self, plan: DICOMMLC, beam: int, bins: np.ndarray = None) -> None:
+        """Initialize the DeliveryLogComparison class.
+
+        Args:
+            plan (DICOMMLC): Planned MLC sequence.
+            beam (int): Beam number.
+            bins (np.ndarray, optional): Edges of the error histogram bins in mm. Errors outside the range are counted
+            in the outermost bins. Defaults to 0.1 mm bins from -5 mm to 5 mm.
+        """
+
+        beam_mlc = plan.getBeamMLCSequence()[beam]
+        self._planned_leaves = beam_mlc.getLeafPositionArray()
+        meterset_weights = beam_mlc.getCumulativeMetersetWeights()
+        self._meterset_fractions = meterset_weights / meterset_weights[-1] if meterset_weights[-1] > 0 else meterset_weights
+
+        self._bins = np.linspace(-5, 5, 101) if bins is None else np.asarray(bins, dtype=np.float64)
+        leaf_shape = self._planned_leaves.shape[1:]
+        self._snapshots = 0
+        self._sum = np.zeros(leaf_shape, dtype=np.float64)
+        self._sum_of_squares = np.zeros(leaf_shape, dtype=np.float64)
+        self._max = np.zeros(leaf_shape, dtype=np.float64)
+        self._histograms = np.zeros(leaf_shape + (len(self._bins) - 1,), dtype=np.int64)
+
+    def getPlannedLeafPositions(self, meterset: np.ndarray) -> np.ndarray:
+        """Interpolate the planned leaf positions at the given meterset fractions.
+
+        Args:
+            meterset (np.ndarray): Meterset fractions between 0 and 1.
+
+        Returns:
+            np.ndarray: Planned leaf positions of shape (snapshots, 2, leaf pairs) in mm.
+        """
+
+        fractions = self._meterset_fractions
+        if len(fractions) == 1:
+            return np.broadcast_to(self._planned_leaves[0], (len(meterset),) + self._planned_leaves.shape[1:]).copy()
+
+        meterset = np.clip(np.asarray(meterset, dtype=np.float64), fractions[0], fractions[-1])
+        index = np.clip(np.searchsorted(fractions, meterset, side="right") - 1, 0, len(fractions) - 2)
+        length = fractions[index + 1] - fractions[index]
+        t = np.divide(meterset - fractions[index], length, out=np.zeros_like(meterset), where=length > 0)[:, None, None]
+
+        return self._planned_leaves[index] * (1 - t) + self._planned_leaves[index + 1] * t
+
+    def Update(self, meterset: np.ndarray, leaves: np.ndarray) -> None:
+        """Add a block of delivered snapshots to the statistics.
+
+        Args:
+            meterset (np.ndarray): Meterset fractions of shape (snapshots,).
+            leaves (np.ndarray): Delivered leaf positions of shape (snapshots, 2, leaf pairs) in mm.
+        """
+
+        if leaves.shape[1:] != self._planned_leaves.shape[1:]:
+            raise ValueError("The number of leaf pairs of the log does not match the plan")
+
+        errors = leaves - self.getPlannedLeafPositions(meterset)
+        self._snapshots += errors.shape[0]
+        self._sum += errors.sum(axis=0)
+        self._sum_of_squares += (errors**2).sum(axis=0)
+        self._max = np.maximum(self._max, np.abs(errors).max(axis=0, initial=0))
+
+        bins = len(self._bins) - 1
+        index = np.clip(np.searchsorted(self._bins, errors, side="right") - 1, 0, bins - 1)
+        index += (np.arange(errors[0].size).reshape(errors.shape[1:]) * bins)[None]
+        self._histograms += np.bincount(index.ravel(), minlength=self._histograms.size).reshape(self._histograms.shape)
+
+    def getNumberOfSnapshots(self) -> int:
+        """Get the number of snapshots added so far.
+
+        Returns:
+            int: Number of snapshots.
+        """
+
+        return self._snapshots
+
+    def getMeanErrors(self) -> np.ndarray:
+        """Get the mean error of each leaf.
+
+        Returns:
+            np.ndarray: Mean errors of shape (2, leaf pairs) in mm.
+        """
+
+        return self._sum / max(self._snapshots, 1)
+
+    def getRMSErrors(self) -> np.ndarray:
+        """Get the root mean square error of each leaf.
+
+        Returns:
+            np.ndarray: RMS errors of shape (2, leaf pairs) in mm.
+        """
+
+        return np.sqrt(self._sum_of_squares / max(self._snapshots, 1))
+
+    def getTotalRMSError(self) -> float:
+        """Get the root mean square error over all leaves and snapshots.
+
+        Returns:
+            float: RMS error in mm.
+        """
+
+        return float(np.sqrt(self._sum_of_squares.sum() / max(self._snapshots * self._sum_of_squares.size, 1)))
+
+    def getMaxErrors(self) -> np.ndarray:
+        """Get the maximum absolute error of each leaf.
+
+        Returns:
+            np.ndarray: Maximum errors of shape (2, leaf pairs) in mm.
+        """
+
+        return self._max
+
+    def getHistograms(self) -> np.ndarray:
+        """Get the error histogram of each leaf.
+
+        Returns:
+            np.ndarray: Counts of shape (2, leaf pairs, bins).
+        """
+
+        return self._histograms
+
+    def getBinEdges(self) -> np.ndarray:
+        """Get the edges of the histogram bins.
+
+        Returns:
+            np.ndarray: Bin edges in mm.
+        """
+
+        return self._bins
+
+
+def CompareDeliveryLog(plan: DICOMMLC, beam: int, path: str, bins: np.ndarray = None, **reader_options) -> DeliveryLogComparison:
+    """Stream a delivery log and compare it with the planned leaf positions of a beam.
+
+    Args:
+        plan (DICOMMLC): Planned MLC sequence.
+        beam (int): Beam number.
+        path (str): Path to the log file.
+        bins (np.ndarray, optional): Edges of the error histogram bins in mm. Defaults to None.
+        **reader_options: Options passed to DeliveryLogReader.
+
+    Returns:
+        DeliveryLogComparison: The accumulated comparison.
+    """
+
+    comparison = DeliveryLogComparison(plan, beam, bins)
+    leaf_pairs = plan.getBeamMLCSequence()[beam].getLeafPositionArray().shape[2]
+    for meterset, leaves in DeliveryLogReader(path, leaf_pairs, **reader_options):
+        comparison.Update(meterset, leaves)
+
+    return comparison
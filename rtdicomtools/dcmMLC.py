@@ -1,31 +1,57 @@
+import os
 import cv2
-import imutils
 import pydicom
+import threading
 import numpy as np
 import pandas as pd
 
+from collections import deque
+from collections.abc import Mapping
 from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from rtdicomtools.npSharedMemory import SharedArrays
+from rtdicomtools.Instrumentation import instrumented
 
 @dataclass
 class DICOMBeamMLC:
     """Class to represent the MLC Sequence for a beam.
     """
 
-    def __init__(self, control_points:int, collimator_angle:float, mlc_leaf_sequence: dict, gantry_angles:list) -> None:
+    def __init__(self, control_points:int, collimator_angle:float, mlc_leaf_sequence: dict, gantry_angles:list,
+                 leaf_positions: np.ndarray = None, meterset_weights: list = None, beam_meterset: float = None,
+                 leaf_boundaries: np.ndarray = None, jaw_positions: np.ndarray = None, isocenter: np.ndarray = None,
+                 source_axis_distance: float = 1000.0, couch_angle: float = 0.0, patient_position: str = None) -> None:
         """Initialize the DICOMBeamMLC class.
 
         Args:
             control_points (int): Number of control points.
             collimator_angle (float): Collimator angle.
-            mlc_leaf_sequence (dict): MLC leaf sequence.
+            mlc_leaf_sequence (dict): MLC leaf sequence. If None, it is built from `leaf_positions` on first access.
             gantry_angles (list): Gantry angles.
+            leaf_positions (np.ndarray, optional): Leaf positions of shape (control points, 2, leaf pairs) in mm. Defaults to None.
+            meterset_weights (list, optional): Cumulative meterset weight of each control point. Defaults to None.
+            beam_meterset (float, optional): Beam meterset in MU. Defaults to None.
+            leaf_boundaries (np.ndarray, optional): Leaf position boundaries of the MLC of this beam in mm. Defaults to None.
+            jaw_positions (np.ndarray, optional): X and Y jaw positions of shape (control points, 2, 2) in mm. Defaults to None.
+            isocenter (np.ndarray, optional): Isocenter in the DICOM patient coordinate system in mm. Defaults to None.
+            source_axis_distance (float, optional): Source to isocenter distance in mm. Defaults to 1000.0.
+            couch_angle (float, optional): Patient support angle in degrees. Defaults to 0.0.
+            patient_position (str, optional): Patient position of the patient setup of the beam, e.g. "HFS". Defaults to None.
         """
 
         self._control_points = control_points
         self._collimator_angle = collimator_angle
         self._mlc_leaf_sequence = mlc_leaf_sequence	
         self._gantry_angles = gantry_angles
-
+        self._leaf_positions = leaf_positions
+        self._meterset_weights = meterset_weights
+        self._beam_meterset = beam_meterset
+        self._leaf_boundaries = leaf_boundaries
+        self._jaw_positions = jaw_positions
+        self._isocenter = isocenter
+        self._source_axis_distance = source_axis_distance
+        self._couch_angle = couch_angle
+        self._patient_position = patient_position
 
     def getNumberOfControlPoints(self) -> int:
         """Get the number of control points.
@@ -52,6 +78,13 @@ class DICOMBeamMLC:
             dict: MLC leaf sequence.
         """
 
+        if self._mlc_leaf_sequence is None:
+            self._mlc_leaf_sequence = {
+                j: {"LeafBank1": pd.DataFrame({"Leaf Bank 1 [mm]": self._leaf_positions[j, 0]}),
+                    "LeafBank2": pd.DataFrame({" Leaf Bank 2 [mm]": self._leaf_positions[j, 1]})}
+                for j in range(self._control_points)
+            }
+
         return self._mlc_leaf_sequence
 
     def getGantryAngles(self) -> list:
@@ -63,6 +96,121 @@ class DICOMBeamMLC:
 
         return self._gantry_angles
 
+    def getLeafPositionArray(self) -> np.ndarray:
+        """Get the leaf positions of all control points as one array.
+
+        Returns:
+            np.ndarray: Leaf positions of shape (control points, 2, leaf pairs) in mm.
+        """
+
+        return self._leaf_positions
+
+    def getCumulativeMetersetWeights(self) -> np.ndarray:
+        """Get the cumulative meterset weight of each control point.
+
+        Returns:
+            np.ndarray: Cumulative meterset weights.
+        """
+
+        return np.asarray(self._meterset_weights, dtype=np.float64)
+
+    def getBeamMeterset(self) -> float:
+        """Get the beam meterset referenced in the fraction group.
+
+        Returns:
+            float: Beam meterset in MU, or None if the plan does not specify it.
+        """
+
+        return self._beam_meterset
+
+    def getLeafBoundaryArray(self) -> np.ndarray:
+        """Get the leaf position boundaries of the MLC of this beam.
+
+        Returns:
+            np.ndarray: Leaf position boundaries in mm.
+        """
+
+        return self._leaf_boundaries
+
+    def getJawPositionArray(self) -> np.ndarray:
+        """Get the jaw positions of all control points as one array.
+
+        Returns:
+            np.ndarray: X (index 0) and Y (index 1) jaw positions of shape (control points, 2, 2) in mm, NaN if the beam has no such jaw.
+        """
+
+        return self._jaw_positions
+
+    def getIsocenter(self) -> np.ndarray:
+        """Get the isocenter of the beam.
+
+        Returns:
+            np.ndarray: Isocenter (x, y, z) in the DICOM patient coordinate system in mm, or None if the plan does not specify it.
+        """
+
+        return self._isocenter
+
+    def getSourceAxisDistance(self) -> float:
+        """Get the distance from the source to the isocenter.
+
+        Returns:
+            float: Source to axis distance in mm.
+        """
+
+        return self._source_axis_distance
+
+    def getCouchAngle(self) -> float:
+        """Get the patient support angle of the beam.
+
+        Returns:
+            float: Patient support angle in degrees.
+        """
+
+        return self._couch_angle
+
+    def getPatientPosition(self) -> str:
+        """Get the patient position of the patient setup of the beam.
+
+        Returns:
+            str: Patient position, e.g. "HFS", or None if the plan does not specify it.
+        """
+
+        return self._patient_position
+
+
+class _LazyBeamMLCSequence(Mapping):
+    """Mapping of beam numbers to DICOMBeamMLC objects, which decodes the control points of a beam
+    on first access and keeps the result.
+    """
+
+    def __init__(self, decode, number_of_beams: int) -> None:
+        """Initialize the _LazyBeamMLCSequence class.
+
+        Args:
+            decode (callable): Function which decodes the beam with the given number.
+            number_of_beams (int): Number of beams.
+        """
+
+        self._decode = decode
+        self._number_of_beams = number_of_beams
+        self._beams = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, beam: int) -> DICOMBeamMLC:
+        if beam not in range(self._number_of_beams):
+            raise KeyError(beam)
+        if beam not in self._beams:
+            with self._lock:
+                if beam not in self._beams:
+                    self._beams[beam] = self._decode(beam)
+        return self._beams[beam]
+
+    def __iter__(self):
+        return iter(range(self._number_of_beams))
+
+    def __len__(self) -> int:
+        return self._number_of_beams
+
 
 class DICOMMLC:
     """Class to represent the MLC Sequence for a DICOM plan. The MLC sequence is
@@ -70,11 +218,13 @@ class DICOMMLC:
     the center of gravity of the MLC openings can be determined.
     """
 
-    def __init__(self, RTPlan) -> None:
+    def __init__(self, RTPlan, lazy: bool = False) -> None:
         """Initialize the DICOMMLC class.
 
         Args:
             RTPlan (pathlike or pydicom.FileDataset): DICOM dataset.
+            lazy (bool, optional): Only index the beams and their MLC definitions, and decode the control
+            points of a beam when it is first accessed. Defaults to False.
         """
 
         if type(RTPlan) == str:
@@ -89,17 +239,17 @@ class DICOMMLC:
 
 
         self._number_of_beams = len(ds.BeamSequence)
-
-        for i in range(len(ds.BeamSequence[0].BeamLimitingDeviceSequence)):
-            if ds.BeamSequence[0].BeamLimitingDeviceSequence[i].RTBeamLimitingDeviceType in ["MLCX","MLCY"] :
-                mlc_index = i
-                leaf_pairs = ds.BeamSequence[0].BeamLimitingDeviceSequence[i].NumberOfLeafJawPairs
-                mlc_offsets = pd.DataFrame({"Offset [mm]":ds.BeamSequence[0].BeamLimitingDeviceSequence[i].LeafPositionBoundaries})
-                break
-        self._leaf_pairs = int(leaf_pairs)
-        self._leaf_position_boundaries = mlc_offsets
+        self._beam_metersets = self._InitializeBeamMetersets(ds)
+        self._beam_index = self._InitializeBeamIndex(ds)
+        self._patient_positions = self._InitializePatientPositions(ds)
+
+        mlc_beams = [beam for beam in self._beam_index if beam["Leaf Pairs"] > 0]
+        if len(mlc_beams) == 0:
+            raise ValueError("The plan does not contain a beam with an MLC")
+        self._leaf_pairs = mlc_beams[0]["Leaf Pairs"]
+        self._leaf_position_boundaries = pd.DataFrame({"Offset [mm]": mlc_beams[0]["Leaf Position Boundaries [mm]"]})
         self._leaf_positions = self._InitializeLeafPositions()
-        self._beam_mlc_sequence = self._InitializeBeamMLCSequence(ds)
+        self._beam_mlc_sequence = self._InitializeBeamMLCSequence(ds, lazy)
 
         self._image_width = 1200
         self._image_height = 1200
@@ -136,42 +286,148 @@ class DICOMMLC:
 
         return leaf_positions
 
-    def _InitializeBeamMLCSequence(self, ds) -> list:
+    def _InitializeBeamMetersets(self, ds) -> dict:
+        """Read the beam metersets from the first fraction group.
+
+        Args:
+            ds (pydicom.FileDataset): DICOM dataset.
+
+        Returns:
+            dict: Beam meterset in MU for each referenced beam number.
+        """
+
+        beam_metersets = {}
+        try:
+            for reference in ds.FractionGroupSequence[0].ReferencedBeamSequence:
+                if "BeamMeterset" in reference and reference.BeamMeterset is not None:
+                    beam_metersets[int(reference.ReferencedBeamNumber)] = float(reference.BeamMeterset)
+        except (AttributeError, IndexError):
+            pass
+
+        return beam_metersets
+
+    def _InitializeBeamIndex(self, ds) -> list:
+        """Index the beams and their own MLC definitions without decoding the control points.
+
+        Args:
+            ds (pydicom.FileDataset): DICOM dataset.
+
+        Returns:
+            list: Metadata of each beam.
+        """
+
+        beam_index = []
+        for i, beam in enumerate(ds.BeamSequence):
+            leaf_pairs = 0
+            leaf_boundaries = None
+            for device in beam.get("BeamLimitingDeviceSequence", []):
+                if device.RTBeamLimitingDeviceType in ["MLCX","MLCY"]:
+                    leaf_pairs = int(device.NumberOfLeafJawPairs)
+                    leaf_boundaries = np.asarray(device.LeafPositionBoundaries, dtype=np.float64)
+                    break
+
+            beam_number = int(beam.get("BeamNumber", i + 1))
+            beam_index.append({
+                "Beam Number": beam_number,
+                "Beam Name": str(beam.get("BeamName", "")),
+                "Beam Type": str(beam.get("BeamType", "")),
+                "Radiation Type": str(beam.get("RadiationType", "")),
+                "Number of Control Points": int(beam.get("NumberOfControlPoints", 0)),
+                "Beam Meterset [MU]": self._beam_metersets.get(beam_number),
+                "Leaf Pairs": leaf_pairs,
+                "Leaf Position Boundaries [mm]": leaf_boundaries,
+            })
+
+        return beam_index
+
+    def _InitializePatientPositions(self, ds) -> dict:
+        """Read the patient positions of the patient setups, which the beams reference.
+
+        Args:
+            ds (pydicom.FileDataset): DICOM dataset.
+
+        Returns:
+            dict: Patient position by patient setup number.
+        """
+
+        return {int(setup.PatientSetupNumber): str(setup.PatientPosition)
+                for setup in ds.get("PatientSetupSequence", []) if "PatientSetupNumber" in setup and setup.get("PatientPosition")}
+
+    @instrumented()
+    def _InitializeBeamMLCSequence(self, ds, lazy: bool = False) -> dict:
         """Initialize the beam MLC sequence.
 
         Args:
             ds (pydicom.FileDataset): DICOM dataset.
+            lazy (bool, optional): Decode the control points of a beam on first access. Defaults to False.
 
         Returns:
-            list: Beam MLC sequence.
+            dict: Beam MLC sequence.
         """
 
-        beam_mlc_sequence = {}
+        if lazy:
+            return _LazyBeamMLCSequence(lambda i: self._DecodeBeamMLC(ds.BeamSequence[i], i), self._number_of_beams)
 
-        for i in range(self._number_of_beams):
-            mlc_positions = {}
-            control_points = len(ds.BeamSequence[i].ControlPointSequence)
-            collimator_angle = float(ds.BeamSequence[i].ControlPointSequence[0].BeamLimitingDeviceAngle)
-            gantry_angles = [ds.BeamSequence[i].ControlPointSequence[j].GantryAngle for j in range(control_points)]
-            for j in range(control_points):
-                for mlc_index in range(len(ds.BeamSequence[i].ControlPointSequence[j].BeamLimitingDevicePositionSequence)):
-                    if ds.BeamSequence[i].ControlPointSequence[j].BeamLimitingDevicePositionSequence[mlc_index].RTBeamLimitingDeviceType in ["MLCX","MLCY"] :
-                        break
+        return {i: self._DecodeBeamMLC(ds.BeamSequence[i], i) for i in range(self._number_of_beams)}
 
-                LeafBank1 = []
-                LeafBank2 = []
-                positions = ds.BeamSequence[i].ControlPointSequence[j].BeamLimitingDevicePositionSequence[mlc_index].LeafJawPositions	
+    @instrumented()
+    def _DecodeBeamMLC(self, beam, index: int) -> DICOMBeamMLC:
+        """Decode the control points of a beam. Values which are not repeated in a control point
+        are carried over from the previous one.
 
-                LeafBank1 += ds.BeamSequence[i].ControlPointSequence[j].BeamLimitingDevicePositionSequence[mlc_index].LeafJawPositions[:self.getLeafPairs()]
-                LeafBank2 += ds.BeamSequence[i].ControlPointSequence[j].BeamLimitingDevicePositionSequence[mlc_index].LeafJawPositions[self.getLeafPairs():]
+        Args:
+            beam (pydicom.Dataset): Item of the BeamSequence.
+            index (int): Beam number.
 
-                mlc_positions[j] = {}
-                mlc_positions[j]["LeafBank1"] = pd.DataFrame({"Leaf Bank 1 [mm]":LeafBank1})	
-                mlc_positions[j]["LeafBank2"] = pd.DataFrame({" Leaf Bank 2 [mm]":LeafBank2})	
+        Returns:
+            DICOMBeamMLC: The MLC sequence of the beam.
+        """
 
-            beam_mlc_sequence[i] = DICOMBeamMLC(control_points, collimator_angle, mlc_positions, gantry_angles)
+        leaf_pairs = self._beam_index[index]["Leaf Pairs"]
+        control_point_sequence = beam.ControlPointSequence
+        control_points = len(control_point_sequence)
+        collimator_angle = float(control_point_sequence[0].BeamLimitingDeviceAngle)
+
+        gantry_angles = []
+        meterset_weights = []
+        leaf_positions = np.zeros((control_points, 2, leaf_pairs), dtype=np.float64)
+        jaw_positions = np.full((control_points, 2, 2), np.nan, dtype=np.float64)
+        jaws = {"X": 0, "ASYMX": 0, "Y": 1, "ASYMY": 1}
+        gantry_angle, positions = None, None
+        for j, control_point in enumerate(control_point_sequence):
+            if "GantryAngle" in control_point:
+                gantry_angle = float(control_point.GantryAngle)
+            gantry_angles.append(gantry_angle)
+            meterset_weights.append(float(control_point.CumulativeMetersetWeight))
+            if j > 0:
+                jaw_positions[j] = jaw_positions[j - 1]
+
+            for device in control_point.get("BeamLimitingDevicePositionSequence", []):
+                if device.RTBeamLimitingDeviceType in ["MLCX","MLCY"]:
+                    positions = device.LeafJawPositions
+                elif device.RTBeamLimitingDeviceType in jaws:
+                    jaw_positions[j, jaws[device.RTBeamLimitingDeviceType]] = np.asarray(device.LeafJawPositions, dtype=np.float64)[:2]
+            if positions is not None:
+                leaf_positions[j] = np.reshape(np.asarray(positions, dtype=np.float64), (2, leaf_pairs))
+
+        leaf_boundaries = self._beam_index[index]["Leaf Position Boundaries [mm]"]
+        if leaf_boundaries is None:
+            leaf_boundaries = np.zeros(0, dtype=np.float64)
+
+        first = control_point_sequence[0]
+        isocenter = np.asarray(first.IsocenterPosition, dtype=np.float64) if "IsocenterPosition" in first else None
+        source_axis_distance = float(beam.get("SourceAxisDistance", 1000.0))
+        couch_angle = float(first.get("PatientSupportAngle", 0.0))
+        if "ReferencedPatientSetupNumber" in beam:
+            patient_position = self._patient_positions.get(int(beam.ReferencedPatientSetupNumber))
+        else:
+            # A beam may omit the reference if the plan has a single patient setup.
+            positions = set(self._patient_positions.values())
+            patient_position = positions.pop() if len(positions) == 1 else None
 
-        return beam_mlc_sequence
+        return DICOMBeamMLC(control_points, collimator_angle, None, gantry_angles, leaf_positions, meterset_weights,
+                            self._beam_index[index]["Beam Meterset [MU]"], leaf_boundaries, jaw_positions, isocenter,
+                            source_axis_distance, couch_angle, patient_position)
 
     def DrawEntireMLCSequence(self, rotate=False, draw_edges=True):
         """Draw the entire MLC sequence.
@@ -181,14 +437,99 @@ class DICOMMLC:
             draw_edges (bool, optional): Draw the edges of the MLC. Defaults to True.
         """
 
-        images = []
-        for i in range(self.getNumberOfBeams()):
+        frames = sum(self.getBeamMLCSequence()[i].getNumberOfControlPoints() for i in range(self.getNumberOfBeams()))
+        images = np.empty((frames,) + tuple(self._dimensions), dtype=np.uint8)
+        for i, image in enumerate(self.IterateMLCSequence(rotate, draw_edges)):
+            images[i] = image
+
+        return images
+
+    def IterateMLCSequence(self, rotate=False, draw_edges=True, beams: list = None):
+        """Draw the MLC sequence one control point at a time.
+
+        Args:
+            rotate (bool, optional): Rotate the MLC. Defaults to False.
+            draw_edges (bool, optional): Draw the edges of the MLC. Defaults to True.
+            beams (list, optional): Beam numbers to draw. Defaults to None, which draws all beams.
+
+        Yields:
+            np.ndarray: The MLC aperture of the next control point.
+        """
+
+        for i in (range(self.getNumberOfBeams()) if beams is None else beams):
             for j in range(self.getBeamMLCSequence()[i].getNumberOfControlPoints()):
-                images.append(self.DrawMLCAperture(i, j, rotate, draw_edges))
+                yield self.DrawMLCAperture(i, j, rotate, draw_edges)
+
+    def ExportMLCSequence(self, path: str, fps: float = 25, rotate=False, draw_edges=True, beams: list = None,
+                          workers: int = 2, buffer_size: int = 8) -> int:
+        """Export the MLC sequence to a video file or a numbered PNG sequence.
 
-        return np.array(images)
+        The frames are rendered in background threads and written as soon as they are ready, so only
+        `buffer_size` frames are held in memory at any time, regardless of the number of control points.
+        Paths ending in .mp4, .avi or .mkv are written with OpenCV's VideoWriter. Any other path is treated
+        as a PNG sequence, either as a directory or as a pattern like "frames/mlc_{:05d}.png".
 
+        Args:
+            path (str): Output video file, directory or file name pattern.
+            fps (float, optional): Frames per second of the video. Defaults to 25.
+            rotate (bool, optional): Rotate the MLC. Defaults to False.
+            draw_edges (bool, optional): Draw the edges of the MLC. Defaults to True.
+            beams (list, optional): Beam numbers to export. Defaults to None, which exports all beams.
+            workers (int, optional): Number of render threads. Defaults to 2.
+            buffer_size (int, optional): Maximum number of frames rendered ahead of the writer. Defaults to 8.
 
+        Returns:
+            int: Number of frames written.
+        """
+
+        if buffer_size < 1 or workers < 1:
+            raise ValueError("The buffer size and number of workers must be at least 1")
+
+        extension = os.path.splitext(path)[1].lower()
+        codecs = {".mp4": "mp4v", ".avi": "MJPG", ".mkv": "mp4v"}
+        writer = None
+        if extension not in codecs and "{" not in path:
+            path = os.path.join(path, "mlc_{:05d}.png")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        frames = [(i, j) for i in (range(self.getNumberOfBeams()) if beams is None else beams)
+                  for j in range(self.getBeamMLCSequence()[i].getNumberOfControlPoints())]
+        pending = deque()
+        written = 0
+
+        def write(image):
+            nonlocal writer, written
+            frame = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+            if extension in codecs:
+                if writer is None:
+                    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codecs[extension]), fps, (frame.shape[1], frame.shape[0]))
+                    if not writer.isOpened():
+                        raise OSError(f"Could not open the video file {path} for writing with the {codecs[extension]} codec")
+                writer.write(frame)
+            elif not cv2.imwrite(path.format(written), frame):
+                raise OSError(f"Could not write the image {path.format(written)}")
+            written += 1
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for beam, control_point in frames:
+                    pending.append(executor.submit(self.DrawMLCAperture, beam, control_point, rotate, draw_edges))
+                    if len(pending) >= buffer_size:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+            finally:
+                for future in pending:
+                    future.cancel()
+                if writer is not None:
+                    writer.release()
+
+        return written
+
+    @instrumented()
     def DrawMLCAperture(self, beam, control_point, rotate=False, draw_edges=True):
         """Draw the MLC for a given beam and control point.
         
@@ -201,45 +542,176 @@ class DICOMMLC:
 
         image = np.zeros(self._dimensions, np.uint8)
 
-        center = int((image.shape[0])/2)
+        rows, columns = image.shape[0], image.shape[1]
+        center = (int(columns/2), int(rows/2))
         collimator_angle = self.getBeamMLCSequence()[beam].getCollimatorAngle()
         mlc_length = 100 * self.getPixelSpacing()
-        mlc_positions = self.getBeamMLCSequence()[beam].getMLCLeafSequence()
-        
-        for i, leaf in enumerate(mlc_positions[control_point]["LeafBank1"]["Leaf Bank 1 [mm]"]):
-
-            pointA = (center + int((leaf*self.getPixelSpacing())), center + int((self.getLeafPositionBoundaries()["Offset [mm]"][i]*self.getPixelSpacing())))
-            pointB = (center + int((leaf*self.getPixelSpacing())), center + int((self.getLeafPositionBoundaries()["Offset [mm]"][i+1]*self.getPixelSpacing())))
-            pointC = (pointA[0]-mlc_length, pointA[1])
-            pointD = (pointB[0]-mlc_length, pointB[1])
-            
-            cv2.rectangle(image, pointA, pointD, (255,255,255), -1)
-            if draw_edges:
-                cv2.line(image, pointA, pointB, (0,0,255), 1)
-                cv2.line(image, pointA, pointC, (0,0,255), 1)
-                cv2.line(image, pointC, pointD, (0,0,255), 1)
-                cv2.line(image, pointB, pointD, (0,0,255), 1)
-            
-        for i, leaf in enumerate(mlc_positions[control_point]["LeafBank2"][" Leaf Bank 2 [mm]"]):
-
-            pointA = (center + int((leaf*self.getPixelSpacing())), center + int((self.getLeafPositionBoundaries()["Offset [mm]"][i]*self.getPixelSpacing())))
-            pointB = (center + int((leaf*self.getPixelSpacing())), center + int((self.getLeafPositionBoundaries()["Offset [mm]"][i+1]*self.getPixelSpacing())))
-            pointC = (pointA[0]+mlc_length, pointA[1])
-            pointD = (pointB[0]+mlc_length, pointB[1])
-            
-            cv2.rectangle(image, pointA, pointD, (255,255,255), -1)
-            if draw_edges:
-                cv2.line(image, pointA, pointB, (0,0,255), 1)
-                cv2.line(image, pointA, pointC, (0,0,255), 1)
-                cv2.line(image, pointC, pointD, (0,0,255), 1)
-                cv2.line(image, pointB, pointD, (0,0,255), 1)
-            
-        image = np.flip(image, axis=0)
+        leaves = self.getBeamMLCSequence()[beam].getLeafPositionArray()[control_point]
+        boundaries = self.getBeamMLCSequence()[beam].getLeafBoundaryArray()
+
+        # Corners of every leaf in pixel coordinates, ordered A (tip, lower boundary), B (tip, upper boundary),
+        # D (back, upper boundary) and C (back, lower boundary). Bank 1 extends to the left, bank 2 to the right.
+        tips = center[0] + (leaves * self.getPixelSpacing()).astype(np.int64)
+        lower = np.broadcast_to(center[1] + (boundaries[:-1] * self.getPixelSpacing()).astype(np.int64), tips.shape)
+        upper = np.broadcast_to(center[1] + (boundaries[1:] * self.getPixelSpacing()).astype(np.int64), tips.shape)
+        backs = tips + np.array([[-mlc_length], [mlc_length]])
+        polygons = np.stack([np.stack([tips, lower], -1), np.stack([tips, upper], -1),
+                             np.stack([backs, upper], -1), np.stack([backs, lower], -1)], axis=2)
+        polygons = polygons.reshape(-1, 4, 2).astype(np.float64)
+
+        # The image is flipped vertically, and the collimator rotation is applied to the leaf geometry before
+        # rasterization, so the output always has the same dimensions.
+        polygons[..., 1] = rows - 1 - polygons[..., 1]
         if rotate:
-            image = imutils.rotate_bound(image, -collimator_angle) 
+            matrix = cv2.getRotationMatrix2D((columns/2, rows/2), collimator_angle, 1.0)
+            polygons = polygons @ matrix[:, :2].T + matrix[:, 2]
+        polygons = np.round(polygons * 16).astype(np.int32)
+
+        cv2.fillPoly(image, list(polygons), (255,255,255), lineType=cv2.LINE_8, shift=4)
+        if draw_edges:
+            cv2.polylines(image, list(polygons), True, (0,0,255), 1, lineType=cv2.LINE_8, shift=4)
 
         return np.array(image, dtype=np.uint8)
     
+    def CalculateFluence(self, beam: int, subsamples: int = 1, monitor_units: bool = True) -> np.ndarray:
+        """Calculate the integrated MLC fluence of a beam.
+
+        The aperture of every segment between two consecutive control points is weighted by the
+        increase of the CumulativeMetersetWeight. Each segment is sampled at `subsamples` points with
+        the leaf positions linearly interpolated between the control points, which models dynamic
+        delivery. Leaf edges are accounted for with partial pixel coverage. The accumulation runs
+        in chunks of segments, so the memory needed does not depend on the number of control points.
+
+        Args:
+            beam (int): Beam number.
+            subsamples (int, optional): Number of apertures sampled per segment. Defaults to 1.
+            monitor_units (bool, optional): Scale the fluence to the beam meterset in MU, if the plan
+            specifies it. Otherwise the fluence is relative to the final meterset weight. Defaults to True.
+
+        Returns:
+            np.ndarray: Fluence map (float32) on the same pixel grid as DrawMLCAperture.
+        """
+
+        if subsamples < 1:
+            raise ValueError("The number of subsamples must be at least 1")
+
+        beam_mlc = self.getBeamMLCSequence()[beam]
+        leaves = beam_mlc.getLeafPositionArray()
+        meterset_weights = beam_mlc.getCumulativeMetersetWeights()
+        weights = np.diff(meterset_weights)
+        if meterset_weights[-1] > 0:
+            weights = weights / meterset_weights[-1]
+        if monitor_units and beam_mlc.getBeamMeterset() is not None:
+            weights = weights * beam_mlc.getBeamMeterset()
+
+        rows, columns = self._dimensions[0], self._dimensions[1]
+        spacing = self.getPixelSpacing()
+        leaf_pairs = leaves.shape[2]
+
+        # The open fraction of every pixel in a leaf row is the difference of two ramp functions,
+        # which start at the bank 1 and bank 2 leaf tips. The ramps are accumulated as slope and
+        # offset increments at the pixel edges and integrated once at the end.
+        offsets = np.zeros(leaf_pairs * (columns + 1), dtype=np.float64)
+        slopes = np.zeros(leaf_pairs * (columns + 1), dtype=np.float64)
+        row_offsets = (np.arange(leaf_pairs) * (columns + 1))[None, None, :]
+        t = ((np.arange(subsamples) + 0.5) / subsamples)[None, :, None]
+        chunk = max(1, 2**16 // (subsamples * leaf_pairs))
+
+        for start in range(0, len(weights), chunk):
+            stop = min(start + chunk, len(weights))
+            first, second = leaves[start:stop], leaves[start + 1:stop + 1]
+            bank1 = first[:, None, 0] * (1 - t) + second[:, None, 0] * t
+            bank2 = np.maximum(first[:, None, 1] * (1 - t) + second[:, None, 1] * t, bank1)
+            w = np.broadcast_to((weights[start:stop] / subsamples)[:, None, None], bank1.shape)
+
+            for tips, sign in ((bank1, 1), (bank2, -1)):
+                u = np.clip(tips * spacing + int(columns / 2), 0, columns)
+                edge = np.ceil(u)
+                index = (row_offsets + edge.astype(np.int64)).ravel()
+                offsets += sign * np.bincount(index, weights=(w * (edge - u)).ravel(), minlength=offsets.size)
+                slopes += sign * np.bincount(index, weights=w.ravel(), minlength=slopes.size)
+
+        offsets = offsets.reshape(leaf_pairs, columns + 1)
+        slopes = slopes.reshape(leaf_pairs, columns + 1)
+        ramps = np.cumsum(offsets, axis=1)
+        ramps[:, 1:] += np.cumsum(np.cumsum(slopes, axis=1), axis=1)[:, :-1]
+        leaf_fluence = np.diff(ramps, axis=1)
+
+        boundaries = beam_mlc.getLeafBoundaryArray()
+        pixel_edges = (np.arange(rows + 1) - int(rows / 2)) / spacing
+        overlap = np.minimum(pixel_edges[1:, None], boundaries[None, 1:]) - np.maximum(pixel_edges[:-1, None], boundaries[None, :-1])
+        overlap = np.clip(overlap, 0, None) * spacing
+
+        fluence = np.flip(overlap @ leaf_fluence, axis=0)
+
+        return np.ascontiguousarray(fluence, dtype=np.float32)
+
+    def DensifyControlPoints(self, beam: int, gantry_spacing: float = None, meterset_step: float = None) -> dict:
+        """Interpolate virtual control points of a beam at a regular gantry spacing or meterset step.
+
+        The leaf positions, jaw positions, gantry angles and meterset weights are linearly interpolated
+        between the control points of the plan, vectorized over the whole beam. The first and last
+        control points of the beam are always included.
+
+        Args:
+            beam (int): Beam number.
+            gantry_spacing (float, optional): Gantry angle between virtual control points in degrees. Defaults to None.
+            meterset_step (float, optional): Meterset between virtual control points as a fraction of the final
+            cumulative meterset weight. Used if no gantry spacing is given. Defaults to None.
+
+        Returns:
+            dict: Arrays of the virtual control points: "Control Point" (fractional index of the planned control points),
+            "Gantry Angle [deg]", "Cumulative Meterset Weight", "Leaf Positions [mm]" of shape (control points, 2, leaf pairs)
+            and "Jaw Positions [mm]" of shape (control points, 2, 2).
+        """
+
+        if (gantry_spacing is None) == (meterset_step is None):
+            raise ValueError("Either the gantry spacing or the meterset step must be given")
+
+        beam_mlc = self.getBeamMLCSequence()[beam]
+        control_points = np.arange(beam_mlc.getNumberOfControlPoints(), dtype=np.float64)
+        meterset_weights = beam_mlc.getCumulativeMetersetWeights()
+        gantry_angles = np.rad2deg(np.unwrap(np.deg2rad(np.asarray(beam_mlc.getGantryAngles(), dtype=np.float64))))
+
+        if gantry_spacing is not None:
+            if gantry_spacing <= 0:
+                raise ValueError("The gantry spacing must be greater than 0")
+            span = gantry_angles[-1] - gantry_angles[0]
+            if span == 0:
+                raise ValueError("The gantry does not rotate during the beam, use a meterset step instead")
+            progress = np.maximum.accumulate(np.sign(span) * (gantry_angles - gantry_angles[0]))
+            samples = np.arange(0, abs(span), gantry_spacing)
+            samples = np.append(samples[~np.isclose(samples, abs(span))], abs(span))
+        else:
+            if meterset_step <= 0:
+                raise ValueError("The meterset step must be greater than 0")
+            if meterset_weights[-1] <= 0:
+                raise ValueError("The beam does not deliver any meterset")
+            progress = meterset_weights / meterset_weights[-1]
+            samples = np.arange(0, 1, meterset_step)
+            samples = np.append(samples[~np.isclose(samples, 1)], 1)
+
+        index = np.interp(samples, progress, control_points)
+        if len(control_points) < 2:
+            lower, t = np.zeros(len(index), dtype=np.int64), np.zeros(len(index))
+            upper = lower
+        else:
+            lower = np.clip(np.floor(index).astype(np.int64), 0, len(control_points) - 2)
+            upper = lower + 1
+            t = index - lower
+
+        def interpolate(values):
+            weight = t.reshape((-1,) + (1,) * (values.ndim - 1))
+            return values[lower] * (1 - weight) + values[upper] * weight
+
+        return {
+            "Control Point": index,
+            "Gantry Angle [deg]": interpolate(gantry_angles) % 360,
+            "Cumulative Meterset Weight": interpolate(meterset_weights),
+            "Leaf Positions [mm]": interpolate(beam_mlc.getLeafPositionArray()),
+            "Jaw Positions [mm]": interpolate(beam_mlc.getJawPositionArray()),
+        }
+
     def FindApertureCenters(self, beam:int, control_point:int, lower_area_bound:int, upper_area_bound:int) -> tuple:
         """Find the center of the aperture for a given beam and control point.
 
@@ -301,6 +773,97 @@ class DICOMMLC:
         return self._number_of_beams
 
 
+    def ExportSharedMemory(self) -> SharedArrays:
+        """Copy the parsed leaf, jaw, gantry and meterset arrays of all beams into one shared memory block.
+        Worker processes can recreate the plan from its descriptor with FromSharedMemory without parsing
+        the RTPLAN again. The caller owns the block and has to unlink it when the workers are done.
+
+        Returns:
+            SharedArrays: The shared memory block.
+        """
+
+        arrays = {}
+        collimator_angles = []
+        geometry = []
+        beam_index = []
+        for i in range(self.getNumberOfBeams()):
+            beam_mlc = self.getBeamMLCSequence()[i]
+            arrays[f"{i}/leaves"] = beam_mlc.getLeafPositionArray()
+            arrays[f"{i}/jaws"] = beam_mlc.getJawPositionArray()
+            arrays[f"{i}/gantry"] = np.asarray(beam_mlc.getGantryAngles(), dtype=np.float64)
+            arrays[f"{i}/meterset"] = beam_mlc.getCumulativeMetersetWeights()
+            arrays[f"{i}/boundaries"] = beam_mlc.getLeafBoundaryArray()
+            collimator_angles.append(beam_mlc.getCollimatorAngle())
+            isocenter = beam_mlc.getIsocenter()
+            geometry.append((None if isocenter is None else [float(x) for x in isocenter], beam_mlc.getSourceAxisDistance(),
+                             beam_mlc.getCouchAngle(), beam_mlc.getPatientPosition()))
+            beam_index.append(dict(self._beam_index[i], **{"Leaf Position Boundaries [mm]": None}))
+
+        metadata = {
+            "beam_index": beam_index,
+            "collimator_angles": collimator_angles,
+            "geometry": geometry,
+            "dimensions": self._dimensions,
+            "pixel_spacing": self._pixel_spacing,
+        }
+
+        return SharedArrays(arrays, metadata)
+
+    @classmethod
+    def FromSharedMemory(cls, shared) -> "DICOMMLC":
+        """Recreate a plan from a shared memory block exported with ExportSharedMemory. The leaf, jaw,
+        gantry and meterset arrays of the beams are zero-copy views into the block.
+
+        Args:
+            shared (SharedArrays or dict): The shared memory block, or its descriptor.
+
+        Returns:
+            DICOMMLC: The plan.
+        """
+
+        if not isinstance(shared, SharedArrays):
+            shared = SharedArrays.Attach(shared)
+        arrays = shared.getArrays()
+        metadata = shared.getMetadata()
+
+        plan = cls.__new__(cls)
+        plan._shared_arrays = shared
+        plan._number_of_beams = len(metadata["beam_index"])
+        plan._beam_index = [dict(beam, **{"Leaf Position Boundaries [mm]": arrays[f"{i}/boundaries"] if beam["Leaf Pairs"] > 0 else None})
+                            for i, beam in enumerate(metadata["beam_index"])]
+        plan._beam_metersets = {beam["Beam Number"]: beam["Beam Meterset [MU]"] for beam in plan._beam_index if beam["Beam Meterset [MU]"] is not None}
+
+        mlc_beams = [beam for beam in plan._beam_index if beam["Leaf Pairs"] > 0]
+        plan._leaf_pairs = mlc_beams[0]["Leaf Pairs"]
+        plan._leaf_position_boundaries = pd.DataFrame({"Offset [mm]": mlc_beams[0]["Leaf Position Boundaries [mm]"]})
+        plan._leaf_positions = plan._InitializeLeafPositions()
+        geometry = [(None if isocenter is None else np.asarray(isocenter), sad, couch, position) for isocenter, sad, couch, position in metadata["geometry"]]
+        plan._beam_mlc_sequence = {
+            i: DICOMBeamMLC(arrays[f"{i}/leaves"].shape[0], metadata["collimator_angles"][i], None, arrays[f"{i}/gantry"],
+                            arrays[f"{i}/leaves"], arrays[f"{i}/meterset"], plan._beam_index[i]["Beam Meterset [MU]"],
+                            arrays[f"{i}/boundaries"], arrays[f"{i}/jaws"], *geometry[i])
+            for i in range(plan._number_of_beams)
+        }
+
+        plan._dimensions = tuple(metadata["dimensions"])
+        plan._image_width, plan._image_height = plan._dimensions[0], plan._dimensions[1]
+        plan._pixel_spacing = metadata["pixel_spacing"]
+
+        return plan
+
+    def getBeamMetadata(self, beam: int) -> dict:
+        """Get the metadata of a beam. This does not decode the control points of the beam.
+
+        Args:
+            beam (int): Beam number.
+
+        Returns:
+            dict: Beam number, name, type, radiation type, number of control points, beam meterset,
+            number of leaf pairs and leaf position boundaries of the beam.
+        """
+
+        return dict(self._beam_index[beam])
+
     def getLeafPairs(self) -> int:
         """Get the number of leaf pairs.
 
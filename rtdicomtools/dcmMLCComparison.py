@@ -0,0 +1,259 @@
+import numpy as np
+import pandas as pd
+
+from rtdicomtools.dcmMLC import DICOMMLC
+
+
+SUMMARY_COLUMNS = ["Beam", "Max Leaf Deviation [mm]", "RMS Leaf Deviation [mm]", "Max Gantry Deviation [deg]",
+                   "Max Area Deviation [mm²]", "Failed Control Points", "Passed"]
+
+
+class DICOMMLCComparison:
+    """Class to compare the MLC sequences of two DICOM plans control point by control point.
+    The control points of all beams are stacked into single arrays, so all differences and
+    deviations are computed in one vectorized pass. Beams with fewer leaf pairs than the largest
+    MLC in the plans are padded with NaN.
+    """
+
+    def __init__(self, reference: DICOMMLC, evaluated: DICOMMLC, leaf_tolerance: float = 1.0,
+                 gantry_tolerance: float = 1.0, area_tolerance: float = 1.0) -> None:
+        """Initialize the DICOMMLCComparison class.
+
+        Args:
+            reference (DICOMMLC): Reference plan.
+            evaluated (DICOMMLC): Plan which is compared to the reference plan.
+            leaf_tolerance (float, optional): Maximum leaf position deviation in mm. Defaults to 1.0.
+            gantry_tolerance (float, optional): Maximum gantry angle deviation in degrees. Defaults to 1.0.
+            area_tolerance (float, optional): Maximum aperture area deviation in percent of the reference area. Defaults to 1.0.
+        """
+
+        if reference.getNumberOfBeams() != evaluated.getNumberOfBeams():
+            raise ValueError("The plans do not have the same number of beams")
+
+        self._leaf_tolerance = leaf_tolerance
+        self._gantry_tolerance = gantry_tolerance
+        self._area_tolerance = area_tolerance
+
+        reference_beams = [reference.getBeamMLCSequence()[i] for i in range(reference.getNumberOfBeams())]
+        evaluated_beams = [evaluated.getBeamMLCSequence()[i] for i in range(evaluated.getNumberOfBeams())]
+        for i, (a, b) in enumerate(zip(reference_beams, evaluated_beams)):
+            if a.getLeafPositionArray().shape != b.getLeafPositionArray().shape:
+                raise ValueError(f"Beam {i} does not have the same number of control points and leaf pairs in both plans")
+            if a.getLeafBoundaryArray().shape != b.getLeafBoundaryArray().shape or not np.allclose(a.getLeafBoundaryArray(), b.getLeafBoundaryArray()):
+                raise ValueError(f"Beam {i} does not have the same leaf position boundaries in both plans")
+
+        self._beam_indices = np.concatenate([np.full(beam.getNumberOfControlPoints(), i, dtype=np.int32) for i, beam in enumerate(reference_beams)])
+        self._control_point_indices = np.concatenate([np.arange(beam.getNumberOfControlPoints(), dtype=np.int32) for beam in reference_beams])
+
+        reference_leaves, leaf_widths = self._StackLeafPositions(reference_beams)
+        evaluated_leaves, _ = self._StackLeafPositions(evaluated_beams)
+
+        self._leaf_differences = (evaluated_leaves - reference_leaves).astype(np.float32)
+        absolute = np.abs(self._leaf_differences)
+        with np.errstate(invalid="ignore"):
+            self._max_leaf_deviations = np.nanmax(absolute, axis=(1, 2))
+            self._rms_leaf_deviations = np.sqrt(np.nanmean(self._leaf_differences.astype(np.float64)**2, axis=(1, 2))).astype(np.float32)
+
+        reference_gantry = np.concatenate([np.asarray(beam.getGantryAngles(), dtype=np.float64) for beam in reference_beams])
+        evaluated_gantry = np.concatenate([np.asarray(beam.getGantryAngles(), dtype=np.float64) for beam in evaluated_beams])
+        self._gantry_differences = ((evaluated_gantry - reference_gantry + 180) % 360 - 180).astype(np.float32)
+
+        self._reference_areas = self._ApertureAreas(reference_leaves, leaf_widths)
+        self._evaluated_areas = self._ApertureAreas(evaluated_leaves, leaf_widths)
+        self._area_differences = self._evaluated_areas - self._reference_areas
+
+        self._passed = self._EvaluateTolerances()
+
+    @staticmethod
+    def _StackLeafPositions(beams: list) -> tuple:
+        """Stack the leaf positions of all control points of all beams.
+
+        Args:
+            beams (list): DICOMBeamMLC objects.
+
+        Returns:
+            tuple: Leaf positions of shape (control points, 2, leaf pairs) and leaf widths of shape (control points, leaf pairs), NaN padded.
+        """
+
+        leaf_pairs = max(beam.getLeafPositionArray().shape[2] for beam in beams)
+        control_points = sum(beam.getNumberOfControlPoints() for beam in beams)
+        leaves = np.full((control_points, 2, leaf_pairs), np.nan, dtype=np.float64)
+        widths = np.full((control_points, leaf_pairs), np.nan, dtype=np.float64)
+
+        start = 0
+        for beam in beams:
+            positions = beam.getLeafPositionArray()
+            stop = start + positions.shape[0]
+            leaves[start:stop, :, :positions.shape[2]] = positions
+            widths[start:stop, :positions.shape[2]] = np.diff(beam.getLeafBoundaryArray())
+            start = stop
+
+        return leaves, widths
+
+    @staticmethod
+    def _ApertureAreas(leaves: np.ndarray, widths: np.ndarray) -> np.ndarray:
+        """Calculate the open area between the leaf banks of every control point.
+
+        Args:
+            leaves (np.ndarray): Leaf positions of shape (control points, 2, leaf pairs).
+            widths (np.ndarray): Leaf widths of shape (control points, leaf pairs).
+
+        Returns:
+            np.ndarray: Aperture areas in mm².
+        """
+
+        return np.nansum(np.clip(leaves[:, 1] - leaves[:, 0], 0, None) * widths, axis=1).astype(np.float32)
+
+    def _EvaluateTolerances(self) -> np.ndarray:
+        """Check every control point against the tolerances.
+
+        Returns:
+            np.ndarray: Whether each control point is within all tolerances.
+        """
+
+        relative_area = np.divide(np.abs(self._area_differences), self._reference_areas,
+                                  out=np.where(self._area_differences == 0, 0.0, np.inf).astype(np.float32),
+                                  where=self._reference_areas > 0) * 100
+
+        return ((np.nan_to_num(self._max_leaf_deviations) <= self._leaf_tolerance)
+                & (np.abs(self._gantry_differences) <= self._gantry_tolerance)
+                & (relative_area <= self._area_tolerance))
+
+    def getBeamIndices(self) -> np.ndarray:
+        """Get the beam number of every stacked control point.
+
+        Returns:
+            np.ndarray: Beam numbers.
+        """
+
+        return self._beam_indices
+
+    def getControlPointIndices(self) -> np.ndarray:
+        """Get the control point number within its beam of every stacked control point.
+
+        Returns:
+            np.ndarray: Control point numbers.
+        """
+
+        return self._control_point_indices
+
+    def getLeafDifferences(self) -> np.ndarray:
+        """Get the leaf position differences (evaluated - reference).
+
+        Returns:
+            np.ndarray: Differences of shape (control points, 2, leaf pairs) in mm.
+        """
+
+        return self._leaf_differences
+
+    def getMaxLeafDeviations(self) -> np.ndarray:
+        """Get the maximum absolute leaf position deviation of every control point.
+
+        Returns:
+            np.ndarray: Maximum deviations in mm.
+        """
+
+        return self._max_leaf_deviations
+
+    def getRMSLeafDeviations(self) -> np.ndarray:
+        """Get the root mean square leaf position deviation of every control point.
+
+        Returns:
+            np.ndarray: RMS deviations in mm.
+        """
+
+        return self._rms_leaf_deviations
+
+    def getGantryDifferences(self) -> np.ndarray:
+        """Get the gantry angle differences (evaluated - reference), wrapped to [-180, 180).
+
+        Returns:
+            np.ndarray: Gantry angle differences in degrees.
+        """
+
+        return self._gantry_differences
+
+    def getApertureAreas(self) -> tuple:
+        """Get the aperture areas of both plans.
+
+        Returns:
+            tuple: Reference and evaluated aperture areas in mm².
+        """
+
+        return self._reference_areas, self._evaluated_areas
+
+    def getApertureAreaDifferences(self) -> np.ndarray:
+        """Get the aperture area differences (evaluated - reference).
+
+        Returns:
+            np.ndarray: Aperture area differences in mm².
+        """
+
+        return self._area_differences
+
+    def getPassedControlPoints(self) -> np.ndarray:
+        """Get whether each control point is within all tolerances.
+
+        Returns:
+            np.ndarray: Boolean array over all stacked control points.
+        """
+
+        return self._passed
+
+    def hasPassed(self) -> bool:
+        """Check whether all control points are within all tolerances.
+
+        Returns:
+            bool: True if the plans agree within the tolerances.
+        """
+
+        return bool(np.all(self._passed))
+
+    def getSummary(self) -> pd.DataFrame:
+        """Summarize the comparison per beam.
+
+        Returns:
+            pd.DataFrame: Maximum and RMS leaf deviation, maximum gantry and aperture area deviation,
+            number of failed control points and the pass/fail result of each beam.
+        """
+
+        beams = np.arange(self._beam_indices.max() + 1 if self._beam_indices.size else 0)
+        counts = np.bincount(self._beam_indices, minlength=beams.size)
+        squares = np.bincount(self._beam_indices, weights=np.nan_to_num(self._rms_leaf_deviations.astype(np.float64))**2, minlength=beams.size)
+
+        max_leaf = np.zeros(beams.size, dtype=np.float32)
+        max_gantry = np.zeros(beams.size, dtype=np.float32)
+        max_area = np.zeros(beams.size, dtype=np.float32)
+        np.maximum.at(max_leaf, self._beam_indices, np.nan_to_num(self._max_leaf_deviations))
+        np.maximum.at(max_gantry, self._beam_indices, np.abs(self._gantry_differences))
+        np.maximum.at(max_area, self._beam_indices, np.abs(self._area_differences))
+        failed = np.bincount(self._beam_indices, weights=~self._passed, minlength=beams.size).astype(int)
+
+        values = [beams, max_leaf, np.sqrt(squares / np.maximum(counts, 1)), max_gantry, max_area, failed, failed == 0]
+        return pd.DataFrame(dict(zip(SUMMARY_COLUMNS, values)))
+
+
+def CompareMLCPlans(pairs: list, **tolerances) -> pd.DataFrame:
+    """Compare many pairs of plans and collect the per-beam summaries.
+
+    Args:
+        pairs (list): Tuples of (reference, evaluated), either DICOMMLC objects or paths to RTPLAN files.
+        **tolerances: Tolerances passed to DICOMMLCComparison.
+
+    Returns:
+        pd.DataFrame: The per-beam summaries of all pairs, with the index of the pair in the column "Pair", empty if there are no pairs.
+    """
+
+    summaries = []
+    for i, (reference, evaluated) in enumerate(pairs):
+        if not isinstance(reference, DICOMMLC):
+            reference = DICOMMLC(reference, lazy=True)
+        if not isinstance(evaluated, DICOMMLC):
+            evaluated = DICOMMLC(evaluated, lazy=True)
+        summary = DICOMMLCComparison(reference, evaluated, **tolerances).getSummary()
+        summary.insert(0, "Pair", i)
+        summaries.append(summary)
+
+    if not summaries:
+        return pd.DataFrame(columns=["Pair"] + SUMMARY_COLUMNS)
+    return pd.concat(summaries, ignore_index=True)
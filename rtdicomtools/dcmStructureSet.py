@@ -2,6 +2,8 @@ import cv2
 import pydicom
 import numpy as np
 from pydicom.pixel_data_handlers import apply_rescale
+from rtdicomtools.npSharedMemory import SharedArrays
+from rtdicomtools.Instrumentation import instrumented, span
 
 class StructureSetContour:
     """A class to store the relevant countour information of a RTStruct structure.
@@ -60,13 +62,16 @@ class DICOMStructureSet:
     If a CT is supplied, the underlying pixel array of the CT can be used to draw the contours on the CT slices.
     """ 	
     
-    def __init__(self, RTStruct, CT: list = None, ignore_for: bool = False) -> None:
+    @instrumented()
+    def __init__(self, RTStruct, CT: list = None, ignore_for: bool = False, progress = None) -> None:
         """Initializes the DICOMStructureSet class.
 
         Args:
             RTStruct (pathlike or pydicom.FileDataset): The path to the DICOM RTSTRUCT file or the dataset containing the DICOM information.
             CT (list, optional): List of paths to the CT DICOM files. Defaults to None.
             ignore_for (bool, optional): Ignore the Frame of Reference check. Defaults to False.	
+            progress (callable, optional): Called with the number of loaded CT files and the total number of CT files
+            after every file. Loading can be aborted by raising an exception in the callback. Defaults to None.
         """
         
         if type(RTStruct) == str:
@@ -83,22 +88,25 @@ class DICOMStructureSet:
             referenced_images = [i.ReferencedSOPInstanceUID for i in ds.ReferencedFrameOfReferenceSequence[0].RTReferencedStudySequence[0].RTReferencedSeriesSequence[0].ContourImageSequence]
             reference_images = {}
             self.image_position_patients = []
-            for file in CT:
-                if isinstance(file, str):
-                    ct = pydicom.dcmread(file)
-                else:
-                    ct = file
+            for n, file in enumerate(CT):
+                with span("DICOMStructureSet.ReadCT"):
+                    if isinstance(file, str):
+                        ct = pydicom.dcmread(file)
+                    else:
+                        ct = file
 
-                f = lambda x : 51*x/160 + 459/4
+                    f = lambda x : 51*x/160 + 459/4
 
-                
-                array = apply_rescale(ct.pixel_array.copy(), ct)
-                array[array <= -360 ] = -360
-                array[array >= 440] = 440
-                array = f(array)
-                array = array.astype(int)
+                    
+                    array = apply_rescale(ct.pixel_array.copy(), ct)
+                    array[array <= -360 ] = -360
+                    array[array >= 440] = 440
+                    array = f(array)
+                    array = array.astype(int)
                 reference_images[int(ct.InstanceNumber)-1] = (ct.SOPInstanceUID, array, ct.ImagePositionPatient[2])
                 self.image_position_patients.append(ct.ImagePositionPatient[2])
+                if progress is not None:
+                    progress(n + 1, len(CT))
             if set(referenced_images) != set([i[0] for i in reference_images.values()]) and ignore_for == False:
                 raise ValueError("The CTs do not match the RTSTRUCT file.")
             self.slices = []
@@ -158,6 +166,7 @@ class DICOMStructureSet:
             
         return available_structures
             
+    @instrumented()
     def _setStructureContours(self, ds: pydicom.FileDataset) -> dict:
         """Initializes the dictionary which contains the contours of the structures.
 
@@ -184,6 +193,7 @@ class DICOMStructureSet:
             except AttributeError as e: print(e)
         return structure_contours
             
+    @instrumented()
     def _setSlices(self) -> dict:
         """Initializes the dictionary which translates the slice number to the index of the array.
 
@@ -208,6 +218,7 @@ class DICOMStructureSet:
         
         return slice_dict
 
+    @instrumented()
     def DrawAllContours(self, ct:bool = False, fill_ptv: str = None, resample:int = 1) -> np.ndarray:
         """Draw all the contours of all the structures in the structure set.
         
@@ -365,6 +376,100 @@ class DICOMStructureSet:
        
         return image	
         
+    def ExportSharedMemory(self) -> SharedArrays:
+        """Copy the contours of all structures, packed into one point buffer, and the CT volume into one
+        shared memory block. Worker processes can recreate the structure set from its descriptor with
+        FromSharedMemory without parsing the RTSTRUCT again. The caller owns the block and has to unlink
+        it when the workers are done.
+
+        Returns:
+            SharedArrays: The shared memory block.
+        """
+
+        names = list(self._StructureContours.keys())
+        contours = [contour for name in names for contour in self._StructureContours[name].getContours()]
+        lengths = [len(contour) for contour in contours]
+
+        arrays = {
+            "points": np.concatenate(contours).astype(np.float64) if contours else np.zeros((0, 2), dtype=np.float64),
+            "offsets": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            "slices": np.array([z for name in names for z in self._StructureContours[name].getSlices()], dtype=np.float64),
+            "structures": np.array([i for i, name in enumerate(names) for _ in self._StructureContours[name].getContours()], dtype=np.int32),
+        }
+        if hasattr(self, "slices"):
+            arrays["ct"] = self.slices
+
+        metadata = {
+            "names": names,
+            "colors": [list(self._StructureContours[name].getColor()) for name in names],
+            "available_structures": dict(self._AvailableStructures),
+            "slice_indices": dict(self._Slices),
+            "dimensions": self._dimensions,
+            "pixel_spacing": self._pixel_spacing,
+            "center": getattr(self, "_center", None),
+            "image_position_patients": getattr(self, "image_position_patients", None),
+        }
+
+        return SharedArrays(arrays, metadata)
+
+    @classmethod
+    def FromSharedMemory(cls, shared) -> "DICOMStructureSet":
+        """Recreate a structure set from a shared memory block exported with ExportSharedMemory.
+        The contours and the CT volume are zero-copy views into the block.
+
+        Args:
+            shared (SharedArrays or dict): The shared memory block, or its descriptor.
+
+        Returns:
+            DICOMStructureSet: The structure set.
+        """
+
+        if not isinstance(shared, SharedArrays):
+            shared = SharedArrays.Attach(shared)
+        arrays = shared.getArrays()
+        metadata = shared.getMetadata()
+
+        structure_set = cls.__new__(cls)
+        structure_set._shared_arrays = shared
+
+        points, offsets = arrays["points"], arrays["offsets"]
+        contours = {i: [] for i in range(len(metadata["names"]))}
+        slices = {i: [] for i in range(len(metadata["names"]))}
+        for k, structure in enumerate(arrays["structures"]):
+            contours[structure].append(points[offsets[k]:offsets[k + 1]])
+            slices[structure].append(float(arrays["slices"][k]))
+
+        structure_set._StructureContours = {
+            name: StructureSetContour(name, metadata["colors"][i], contours[i], slices[i])
+            for i, name in enumerate(metadata["names"])
+        }
+        structure_set._AvailableStructures = dict(metadata["available_structures"])
+        structure_set._Slices = dict(metadata["slice_indices"])
+
+        if "ct" in arrays:
+            structure_set.slices = arrays["ct"]
+        if metadata["center"] is not None:
+            structure_set._center = tuple(metadata["center"])
+        if metadata["image_position_patients"] is not None:
+            structure_set.image_position_patients = list(metadata["image_position_patients"])
+
+        structure_set._dimensions = tuple(metadata["dimensions"])
+        structure_set._image_width, structure_set._image_height = structure_set._dimensions[0], structure_set._dimensions[1]
+        structure_set._pixel_spacing = metadata["pixel_spacing"]
+
+        return structure_set
+
+    def getStructureContour(self, Structure: str) -> StructureSetContour:
+        """Get the contours of a structure in patient coordinates.
+
+        Args:
+            Structure (str): Name of the structure.
+
+        Returns:
+            StructureSetContour: The contours, or None if the structure has no contours.
+        """
+        return self._StructureContours.get(Structure)
+
     def getSliceIndices(self, Structure: str) -> list:
         """Get the indices of the slices that contain the specified structure.
 
@@ -378,6 +483,39 @@ class DICOMStructureSet:
         for slice_number in self._StructureContours[Structure].getSlices():
             indices.append(self._Slices[slice_number])
         return indices
+
+    def getSliceContours(self, Slice: int) -> list:
+        """Get the contours of all structures on a slice in pixel coordinates, positioned the same way as
+        in DrawAllContours. The contours of all slices are converted on the first call.
+
+        Args:
+            Slice (int): Slice index.
+
+        Returns:
+            list: List of (name, color, points) tuples, where points is an int32 array of shape (n, 2).
+        """
+
+        if getattr(self, "_slice_contours", None) is None:
+            if hasattr(self, "_center"):
+                center = self._center
+            else:
+                min_contour = 10000
+                max_contour = -10000
+                for s in self.getAvailableStructureNames():
+                    min_contour = min(min_contour, np.min([min(points[:,1]) for points in self._StructureContours[s].getContours()]))
+                    max_contour = max(max_contour, np.max([max(points[:,1]) for points in self._StructureContours[s].getContours()]))
+                center = (int(self._dimensions[1]/2), int(self._dimensions[0]/2)-int((max_contour+min_contour)/2))
+
+            slice_contours = {}
+            for Structure in self.getAvailableStructureNames():
+                color = tuple(int(c) for c in self._StructureContours[Structure].getColor())
+                for contour, slice in zip(self._StructureContours[Structure].getContours(), self._StructureContours[Structure].getSlices()):
+                    points = np.array(contour* self.getPixelSpacing(), dtype=np.int32)
+                    points += np.array(center, dtype=np.int32)
+                    slice_contours.setdefault(self._Slices[slice], []).append((Structure, color, points))
+            self._slice_contours = slice_contours
+
+        return self._slice_contours.get(Slice, [])
     	
     
     def setImageWidth(self, width: int) -> None:
@@ -0,0 +1,396 @@
+import os
+import numpy as np
+
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+
+CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2"
+RT_STRUCTURE_SET_STORAGE = "1.2.840.10008.5.1.4.1.1.481.3"
+RT_PLAN_STORAGE = "1.2.840.10008.5.1.4.1.1.481.5"
+
+
+def _NewDataset(modality: str, sop_class_uid: str, reference: Dataset = None) -> FileDataset:
+    """Create an empty dataset with file meta information. Patient, study and frame of reference are
+    copied from a reference dataset, so the generated objects belong together.
+
+    Args:
+        modality (str): Modality of the dataset.
+        sop_class_uid (str): SOP Class UID.
+        reference (Dataset, optional): Dataset of the same patient and study. Defaults to None.
+
+    Returns:
+        FileDataset: The dataset.
+    """
+
+    meta = FileMetaDataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPClassUID = sop_class_uid
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+
+    ds = FileDataset(None, {}, file_meta=meta, preamble=b"\0" * 128)
+    ds.Modality = modality
+    ds.SOPClassUID = sop_class_uid
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.SeriesInstanceUID = generate_uid()
+    if reference is None:
+        ds.PatientID = "SYNTHETIC"
+        ds.PatientName = "Synthetic^Phantom"
+        ds.StudyInstanceUID = generate_uid()
+        ds.FrameOfReferenceUID = generate_uid()
+    else:
+        ds.PatientID = reference.PatientID
+        ds.PatientName = reference.PatientName
+        ds.StudyInstanceUID = reference.StudyInstanceUID
+        ds.FrameOfReferenceUID = reference.FrameOfReferenceUID
+    ds.StudyDescription = "Synthetic"
+
+    return ds
+
+
+def SyntheticCTSeries(slices: int = 64, size: int = 256, pixel_spacing: float = 1.5, slice_thickness: float = 2.5,
+                      noise: float = 20.0, seed: int = 0) -> list:
+    """Generate a CT series of an elliptical body phantom with lungs and a spine, in Hounsfield units.
+
+    Args:
+        slices (int, optional): Number of images. Defaults to 64.
+        size (int, optional): Rows and columns of the images. Defaults to 256.
+        pixel_spacing (float, optional): In-plane pixel spacing in mm. Defaults to 1.5.
+        slice_thickness (float, optional): Distance between the images in mm. Defaults to 2.5.
+        noise (float, optional): Standard deviation of the image noise in HU. Defaults to 20.0.
+        seed (int, optional): Seed of the noise. Defaults to 0.
+
+    Returns:
+        list: The CT images as FileDataset objects, ordered along the patient z axis.
+    """
+
+    rng = np.random.default_rng(seed)
+    coordinates = (np.arange(size) - (size - 1)/2) * pixel_spacing
+    y, x = np.meshgrid(coordinates, coordinates, indexing="ij")
+    extent = size * pixel_spacing / 2
+
+    body = (x/(0.9*extent))**2 + (y/(0.6*extent))**2 < 1
+    lungs = ((np.abs(x) - 0.4*extent)/(0.25*extent))**2 + (y/(0.4*extent))**2 < 1
+    spine = x**2 + (y - 0.4*extent)**2 < (0.08*extent)**2
+    phantom = np.full((size, size), -1000.0)
+    phantom[body] = 0
+    phantom[body & lungs] = -800
+    phantom[spine] = 700
+
+    series = []
+    for k in range(slices):
+        ds = _NewDataset("CT", CT_IMAGE_STORAGE, series[0] if series else None)
+        if series:
+            ds.SeriesInstanceUID = series[0].SeriesInstanceUID
+        ds.SeriesDescription = "Synthetic CT"
+        ds.SeriesNumber = 1
+        ds.InstanceNumber = k + 1
+        ds.ImagePositionPatient = [float(coordinates[0]), float(coordinates[0]), float((k - (slices - 1)/2) * slice_thickness)]
+        ds.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+        ds.PixelSpacing = [float(pixel_spacing), float(pixel_spacing)]
+        ds.SliceThickness = float(slice_thickness)
+        ds.Rows = ds.Columns = size
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1
+        ds.RescaleIntercept = -1024.0
+        ds.RescaleSlope = 1.0
+
+        image = phantom + rng.normal(0, noise, phantom.shape) if noise else phantom
+        ds.PixelData = np.clip(np.round(image + 1024), -32768, 32767).astype(np.int16).tobytes()
+        series.append(ds)
+
+    return series
+
+
+def SyntheticStructureSet(ct: list, structures: int = 8, points: int = 128, seed: int = 0) -> FileDataset:
+    """Generate an RTSTRUCT for a CT series. Every structure is an irregular closed contour whose radius
+    and center vary smoothly along the series, so the structures have a realistic number of points per
+    slice and cover different slice ranges.
+
+    Args:
+        ct (list): The CT images, e.g. from SyntheticCTSeries.
+        structures (int, optional): Number of structures. Defaults to 8.
+        points (int, optional): Number of points per contour. Defaults to 128.
+        seed (int, optional): Seed of the contour shapes. Defaults to 0.
+
+    Returns:
+        FileDataset: The structure set.
+    """
+
+    rng = np.random.default_rng(seed)
+    ds = _NewDataset("RTSTRUCT", RT_STRUCTURE_SET_STORAGE, ct[0])
+    ds.SeriesDescription = "Synthetic RTSTRUCT"
+    ds.StructureSetLabel = "Synthetic"
+
+    contour_images = []
+    for image in ct:
+        item = Dataset()
+        item.ReferencedSOPClassUID = image.SOPClassUID
+        item.ReferencedSOPInstanceUID = image.SOPInstanceUID
+        contour_images.append(item)
+    series = Dataset()
+    series.SeriesInstanceUID = ct[0].SeriesInstanceUID
+    series.ContourImageSequence = Sequence(contour_images)
+    study = Dataset()
+    study.ReferencedSOPInstanceUID = ct[0].StudyInstanceUID
+    study.RTReferencedSeriesSequence = Sequence([series])
+    frame = Dataset()
+    frame.FrameOfReferenceUID = ct[0].FrameOfReferenceUID
+    frame.RTReferencedStudySequence = Sequence([study])
+    ds.ReferencedFrameOfReferenceSequence = Sequence([frame])
+
+    z = np.array([float(image.ImagePositionPatient[2]) for image in ct])
+    extent = min(int(ct[0].Rows), int(ct[0].Columns)) * float(ct[0].PixelSpacing[0]) / 2
+    angles = np.linspace(0, 2*np.pi, points, endpoint=False)
+
+    rois = []
+    roi_contours = []
+    for s in range(structures):
+        roi = Dataset()
+        roi.ROINumber = s + 1
+        roi.ReferencedFrameOfReferenceUID = ct[0].FrameOfReferenceUID
+        roi.ROIName = "PTV" if s == 0 else f"Structure {s}"
+        roi.ROIGenerationAlgorithm = "MANUAL"
+        rois.append(roi)
+
+        first, last = sorted(rng.integers(0, len(ct), 2))
+        last = max(last, first + 1)
+        center = rng.uniform(-0.3, 0.3, 2) * extent
+        radius = rng.uniform(0.05, 0.2) * extent
+        harmonics = rng.uniform(-0.15, 0.15, (3, 2))
+
+        contours = []
+        for k in range(first, last):
+            t = (k - first)/max(last - first - 1, 1)
+            r = radius * (0.6 + 0.4*np.sin(np.pi*t))
+            for n, (a, b) in enumerate(harmonics, start=2):
+                r = r * (1 + a*np.cos(n*angles + 3*t) + b*np.sin(n*angles))
+            xy = center + np.stack([r*np.cos(angles), r*np.sin(angles)], axis=1)
+            contour = Dataset()
+            contour.ContourGeometricType = "CLOSED_PLANAR"
+            contour.NumberOfContourPoints = points
+            contour.ContourData = np.column_stack([xy, np.full(points, z[k])]).round(2).ravel().tolist()
+            image = Dataset()
+            image.ReferencedSOPClassUID = ct[k].SOPClassUID
+            image.ReferencedSOPInstanceUID = ct[k].SOPInstanceUID
+            contour.ContourImageSequence = Sequence([image])
+            contours.append(contour)
+
+        roi_contour = Dataset()
+        roi_contour.ReferencedROINumber = s + 1
+        roi_contour.ROIDisplayColor = [int(c) for c in rng.integers(0, 256, 3)]
+        roi_contour.ContourSequence = Sequence(contours)
+        roi_contours.append(roi_contour)
+
+    ds.StructureSetROISequence = Sequence(rois)
+    ds.ROIContourSequence = Sequence(roi_contours)
+
+    return ds
+
+
+def SyntheticVMATPlan(arcs: int = 2, control_points: int = 178, leaf_pairs: int = 60, field_size: float = 100.0,
+                      reference: Dataset = None, seed: int = 0, patient_position: str = "HFS") -> FileDataset:
+    """Generate a VMAT plan with full arcs of alternating direction. The MLC apertures follow a smooth
+    random target outline, which changes with the gantry angle like a real modulated arc.
+
+    Args:
+        arcs (int, optional): Number of arcs. Defaults to 2.
+        control_points (int, optional): Number of control points per arc. Defaults to 178.
+        leaf_pairs (int, optional): Number of MLC leaf pairs, 60 for a Millennium 120 geometry. Defaults to 60.
+        field_size (float, optional): Width and length of the jaw opening in mm. Defaults to 100.0.
+        reference (Dataset, optional): Dataset, e.g. a CT image, whose patient and study the plan belongs to. Defaults to None.
+        seed (int, optional): Seed of the apertures. Defaults to 0.
+        patient_position (str, optional): Patient position of the patient setup. Defaults to "HFS".
+
+    Returns:
+        FileDataset: The plan.
+    """
+
+    if control_points < 2:
+        raise ValueError("An arc needs at least two control points")
+
+    rng = np.random.default_rng(seed)
+    ds = _NewDataset("RTPLAN", RT_PLAN_STORAGE, reference)
+    ds.SeriesDescription = "Synthetic RTPLAN"
+    ds.RTPlanLabel = "Synthetic VMAT"
+    ds.RTPlanGeometry = "PATIENT"
+    setup = Dataset()
+    setup.PatientSetupNumber = 1
+    setup.PatientPosition = patient_position
+    ds.PatientSetupSequence = Sequence([setup])
+
+    if leaf_pairs == 60:
+        boundaries = np.concatenate([np.arange(-200, -100, 10), np.arange(-100, 100, 5), np.arange(100, 201, 10)]).astype(float)
+    else:
+        boundaries = np.linspace(-200, 200, leaf_pairs + 1)
+    centers = (boundaries[:-1] + boundaries[1:])/2
+    half = field_size/2
+
+    beams = []
+    referenced_beams = []
+    for a in range(arcs):
+        beam = Dataset()
+        beam.BeamNumber = a + 1
+        beam.BeamName = f"Arc {a + 1}"
+        beam.BeamType = "DYNAMIC"
+        beam.RadiationType = "PHOTON"
+        beam.TreatmentDeliveryType = "TREATMENT"
+        beam.SourceAxisDistance = 1000.0
+        beam.ReferencedPatientSetupNumber = 1
+        beam.NumberOfControlPoints = control_points
+
+        devices = []
+        for device_type, pairs in (("ASYMX", 1), ("ASYMY", 1), ("MLCX", leaf_pairs)):
+            device = Dataset()
+            device.RTBeamLimitingDeviceType = device_type
+            device.NumberOfLeafJawPairs = pairs
+            if device_type == "MLCX":
+                device.LeafPositionBoundaries = boundaries.tolist()
+            devices.append(device)
+        beam.BeamLimitingDeviceSequence = Sequence(devices)
+
+        clockwise = a % 2 == 0
+        gantry = np.linspace(181, 539, control_points) if clockwise else np.linspace(539, 181, control_points)
+        phases = rng.uniform(0, 2*np.pi, 4)
+        inside = np.abs(centers) < half
+
+        points = []
+        for k in range(control_points):
+            angle = np.deg2rad(gantry[k])
+            width = half*(0.5 + 0.25*np.sin(angle + phases[0]) + 0.1*np.sin(3*centers/half + phases[1] + angle))
+            shift = 0.2*half*np.sin(2*angle + phases[2]) + 0.1*half*np.cos(centers/half + phases[3])
+            width = np.where(inside, np.clip(width*np.sqrt(np.clip(1 - (centers/half)**2, 0, 1)), 0.5, half), 0.5)
+            bank1 = np.clip(shift - width, -half, half)
+            bank2 = np.clip(shift + width, -half, half)
+            bank2 = np.maximum(bank2, bank1 + 0.5)
+
+            point = Dataset()
+            point.ControlPointIndex = k
+            point.GantryAngle = float(gantry[k] % 360)
+            point.GantryRotationDirection = ("CW" if clockwise else "CC") if k < control_points - 1 else "NONE"
+            point.CumulativeMetersetWeight = k/(control_points - 1)
+            positions = []
+            if k == 0:
+                point.BeamLimitingDeviceAngle = 30.0 if clockwise else 330.0
+                point.PatientSupportAngle = 0.0
+                point.IsocenterPosition = [0.0, 0.0, 0.0]
+                point.NominalBeamEnergy = 6.0
+                for device_type in ("ASYMX", "ASYMY"):
+                    jaw = Dataset()
+                    jaw.RTBeamLimitingDeviceType = device_type
+                    jaw.LeafJawPositions = [-half, half]
+                    positions.append(jaw)
+            mlc = Dataset()
+            mlc.RTBeamLimitingDeviceType = "MLCX"
+            mlc.LeafJawPositions = np.concatenate([bank1, bank2]).round(2).tolist()
+            positions.append(mlc)
+            point.BeamLimitingDevicePositionSequence = Sequence(positions)
+            points.append(point)
+        beam.ControlPointSequence = Sequence(points)
+        beams.append(beam)
+
+        referenced_beam = Dataset()
+        referenced_beam.ReferencedBeamNumber = a + 1
+        referenced_beam.BeamMeterset = float(rng.uniform(200, 400))
+        referenced_beams.append(referenced_beam)
+
+    ds.BeamSequence = Sequence(beams)
+    fraction_group = Dataset()
+    fraction_group.FractionGroupNumber = 1
+    fraction_group.NumberOfFractionsPlanned = 1
+    fraction_group.NumberOfBeams = arcs
+    fraction_group.ReferencedBeamSequence = Sequence(referenced_beams)
+    ds.FractionGroupSequence = Sequence([fraction_group])
+
+    return ds
+
+
+def WriteDatasets(datasets: list, directory: str, prefix: str = None) -> list:
+    """Write generated datasets as DICOM files.
+
+    Args:
+        datasets (list): The datasets.
+        directory (str): Output directory.
+        prefix (str, optional): Prefix of the file names. Defaults to the modality of every dataset.
+
+    Returns:
+        list: Paths of the written files, in the order of the datasets.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for n, ds in enumerate(datasets):
+        path = os.path.join(directory, f"{prefix or ds.Modality}_{n:04d}.dcm")
+        ds.save_as(path)
+        paths.append(path)
+
+    return paths
+
+
+def SyntheticDeliveryLog(plan, beam: int = 0, snapshots: int = 5000, offsets: np.ndarray = None, noise: float = 0.0,
+                         seed: int = 0) -> tuple:
+    """Generate the delivery log of a beam of a plan with known leaf errors. The snapshots are spread over
+    the meterset of the beam, and the planned leaf positions are interpolated between the control points,
+    independently of DeliveryLogComparison, before the errors are added.
+
+    Args:
+        plan (DICOMMLC): The plan, e.g. loaded from SyntheticVMATPlan.
+        beam (int, optional): Beam number. Defaults to 0.
+        snapshots (int, optional): Number of snapshots. Defaults to 5000.
+        offsets (np.ndarray, optional): Systematic error of every leaf of shape (2, leaf pairs) in mm. Defaults to no offsets.
+        noise (float, optional): Standard deviation of random errors in mm. Defaults to 0.0.
+        seed (int, optional): Seed of the random errors. Defaults to 0.
+
+    Returns:
+        tuple: Meterset fractions of shape (snapshots,), delivered leaf positions and injected errors, both of
+        shape (snapshots, 2, leaf pairs) in mm.
+    """
+
+    beam_mlc = plan.getBeamMLCSequence()[beam]
+    planned = beam_mlc.getLeafPositionArray()
+    weights = np.asarray(beam_mlc.getCumulativeMetersetWeights(), dtype=np.float64)
+    fractions = weights/weights[-1]
+
+    rng = np.random.default_rng(seed)
+    meterset = np.linspace(0, 1, snapshots)
+    leaves = np.empty((snapshots,) + planned.shape[1:], dtype=np.float64)
+    for bank in range(planned.shape[1]):
+        for leaf in range(planned.shape[2]):
+            leaves[:, bank, leaf] = np.interp(meterset, fractions, planned[:, bank, leaf])
+
+    errors = np.zeros_like(leaves)
+    if offsets is not None:
+        errors += np.asarray(offsets, dtype=np.float64)
+    if noise > 0:
+        errors += rng.normal(0, noise, errors.shape)
+
+    return meterset, leaves + errors, errors
+
+
+def WriteDeliveryLog(path: str, meterset: np.ndarray, leaves: np.ndarray) -> str:
+    """Write a delivery log as comma separated text with a comment header, which DeliveryLogReader reads with
+    its default options. Values are written with full precision, so they are read back exactly.
+
+    Args:
+        path (str): Path of the file.
+        meterset (np.ndarray): Meterset fractions of shape (snapshots,).
+        leaves (np.ndarray): Leaf positions of shape (snapshots, 2, leaf pairs) in mm.
+
+    Returns:
+        str: The path.
+    """
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    leaf_pairs = leaves.shape[2]
+    header = ",".join(["meterset"] + [f"bank{bank + 1}_leaf{leaf + 1}" for bank in range(2) for leaf in range(leaf_pairs)])
+    np.savetxt(path, np.column_stack([meterset, leaves.reshape(len(meterset), -1)]), delimiter=",", fmt="%.17g", header=header)
+
+    return path
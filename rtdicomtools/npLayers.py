@@ -0,0 +1,384 @@
+import cv2
+import numpy as np
+
+from functools import lru_cache
+from rtdicomtools.npSliceProvider import SliceProvider, ArraySliceProvider, OrientedViews
+
+
+COLORMAPS = {"gray": None}
+COLORMAPS.update({name: getattr(cv2, f"COLORMAP_{name.upper()}") for name in
+                  ["bone", "hot", "jet", "rainbow", "ocean", "cool", "viridis", "inferno", "magma", "plasma", "turbo"]
+                  if hasattr(cv2, f"COLORMAP_{name.upper()}")})
+
+
+@lru_cache(maxsize=None)
+def colormap_lut(colormap: str) -> np.ndarray:
+    """Builds the lookup table of a colormap.
+
+    Args:
+        colormap (str): Name of the colormap, one of COLORMAPS.
+
+    Returns:
+        np.ndarray: RGB values of shape (256, 3), or None for grayscale.
+    """
+
+    if COLORMAPS[colormap] is None:
+        return None
+    return cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(-1, 1), COLORMAPS[colormap]).reshape(256, 3)[:, ::-1].copy()
+
+
+def window_slice(array: np.ndarray, window: float, level: float, lut: np.ndarray = None) -> np.ndarray:
+    """Maps a slice of any dtype to 8 bit through a window and an optional colormap lookup table. RGB
+    slices are passed through unchanged.
+
+    Args:
+        array (np.ndarray): The slice.
+        window (float): Width of the window.
+        level (float): Center of the window.
+        lut (np.ndarray, optional): Colormap lookup table of shape (256, 3). Defaults to None.
+
+    Returns:
+        np.ndarray: Grayscale slice, or RGB slice if a lookup table is given.
+    """
+
+    if array.ndim == 3:
+        return array if array.dtype == np.uint8 else np.clip(array, 0, 255).astype(np.uint8)
+
+    scale = np.float32(255/max(window, np.finfo(np.float32).eps))
+    scaled = (array.astype(np.float32) - np.float32(level - window/2)) * scale
+    np.clip(scaled, 0, 255, out=scaled)
+    np.nan_to_num(scaled, copy=False, nan=0)
+    image = scaled.astype(np.uint8)
+
+    return image if lut is None else lut[image]
+
+
+def blend(image: np.ndarray, overlay: np.ndarray, opacity: float, mask: np.ndarray = None) -> np.ndarray:
+    """Blends an overlay into an RGB image in place.
+
+    Args:
+        image (np.ndarray): The RGB image.
+        overlay (np.ndarray): The RGB overlay.
+        opacity (float): Opacity of the overlay between 0 and 1.
+        mask (np.ndarray, optional): Pixels covered by the overlay. Defaults to all pixels.
+
+    Returns:
+        np.ndarray: The image.
+    """
+
+    if opacity >= 1:
+        blended = overlay
+    else:
+        blended = cv2.addWeighted(image, 1 - opacity, np.ascontiguousarray(overlay), opacity, 0)
+
+    if mask is None:
+        image[...] = blended
+    else:
+        image[mask] = blended[mask]
+
+    return image
+
+
+class VolumeLayer:
+    """A scalar or RGB volume, such as a CT or a dose distribution, displayed through a window, level and
+    colormap. Values below an optional threshold are transparent.
+    """
+
+    def __init__(self, volume, window: float = None, level: float = None, colormap: str = "gray", opacity: float = 1.0,
+                 threshold: float = None, name: str = "Volume") -> None:
+        """Initializes the VolumeLayer class.
+
+        Args:
+            volume (np.ndarray or SliceProvider): The volume.
+            window (float, optional): Width of the display window. Defaults to the range of the volume.
+            level (float, optional): Center of the display window. Defaults to the center of the range of the volume.
+            colormap (str, optional): Name of the colormap. Defaults to "gray".
+            opacity (float, optional): Opacity between 0 and 1. Defaults to 1.0.
+            threshold (float, optional): Values below the threshold are not drawn. Defaults to None.
+            name (str, optional): Name of the layer. Defaults to "Volume".
+        """
+
+        self._provider = volume if isinstance(volume, SliceProvider) else ArraySliceProvider(volume)
+        self._views = OrientedViews(self._provider)
+        self.rgb = self._provider.ndim == 4
+        self.value_range = (0.0, 255.0) if self.rgb else self._provider.getValueRange()
+
+        span = self.value_range[1] - self.value_range[0]
+        self.window = window if window is not None else max(span, 1.0)
+        self.level = level if level is not None else self.value_range[0] + span/2
+        self.colormap = colormap
+        self.opacity = opacity
+        self.threshold = threshold
+        self.name = name
+        self.visible = True
+
+    def getViews(self) -> dict:
+        """Returns the views of the three axes.
+
+        Returns:
+            dict: SliceProviderView objects by axis.
+        """
+
+        return self._views
+
+    def getProvider(self) -> SliceProvider:
+        """Returns the slice provider of the volume.
+
+        Returns:
+            SliceProvider: The volume.
+        """
+
+        return self._provider
+
+    def getState(self) -> tuple:
+        """Returns the display settings of the layer.
+
+        Returns:
+            tuple: Window, level, colormap, opacity, threshold and visibility.
+        """
+
+        return (self.window, self.level, self.colormap, self.opacity, self.threshold, self.visible)
+
+    def Composite(self, image: np.ndarray, axis: int, index: int, state: tuple) -> np.ndarray:
+        """Draws the layer onto an RGB slice.
+
+        Args:
+            image (np.ndarray): The RGB slice.
+            axis (int): The axis to slice.
+            index (int): The slice index.
+            state (tuple): Display settings returned by getState.
+
+        Returns:
+            np.ndarray: The RGB slice.
+        """
+
+        window, level, colormap, opacity, threshold, visible = state
+        if not visible or opacity <= 0:
+            return image
+
+        plane = self._views[axis][index]
+        overlay = window_slice(plane, window, level, None if self.rgb else colormap_lut(colormap))
+        if overlay.ndim == 2:
+            overlay = cv2.cvtColor(overlay, cv2.COLOR_GRAY2RGB)
+        mask = None if threshold is None or self.rgb else plane >= threshold
+
+        return blend(image, overlay, opacity, mask)
+
+
+class MaskLayer:
+    """A binary mask or label volume. Every nonzero label is drawn in its color.
+    """
+
+    def __init__(self, volume, colors=(255, 0, 0), opacity: float = 0.5, name: str = "Mask") -> None:
+        """Initializes the MaskLayer class.
+
+        Args:
+            volume (np.ndarray or SliceProvider): The mask or label volume.
+            colors (tuple or dict, optional): RGB color of the mask, or RGB colors by label. Labels without a color are not drawn. Defaults to (255, 0, 0).
+            opacity (float, optional): Opacity between 0 and 1. Defaults to 0.5.
+            name (str, optional): Name of the layer. Defaults to "Mask".
+        """
+
+        self._provider = volume if isinstance(volume, SliceProvider) else ArraySliceProvider(volume)
+        self._views = OrientedViews(self._provider)
+        self.opacity = opacity
+        self.name = name
+        self.visible = True
+
+        if isinstance(colors, dict):
+            labels = [int(label) for label in colors.keys()]
+            if min(labels, default=0) < 0:
+                raise ValueError("Labels must not be negative")
+            self._lut = np.zeros((max(labels, default=0) + 2, 3), dtype=np.uint8)
+            self._drawn = np.zeros(len(self._lut), dtype=bool)
+            for label, color in colors.items():
+                self._lut[int(label)] = color
+                self._drawn[int(label)] = label != 0
+        else:
+            self._lut = None
+            self._color = np.array(colors, dtype=np.uint8)
+
+    def getViews(self) -> dict:
+        """Returns the views of the three axes.
+
+        Returns:
+            dict: SliceProviderView objects by axis.
+        """
+
+        return self._views
+
+    def getState(self) -> tuple:
+        """Returns the display settings of the layer.
+
+        Returns:
+            tuple: Opacity and visibility.
+        """
+
+        return (self.opacity, self.visible)
+
+    def Composite(self, image: np.ndarray, axis: int, index: int, state: tuple) -> np.ndarray:
+        """Draws the labels of the layer onto an RGB slice.
+
+        Args:
+            image (np.ndarray): The RGB slice.
+            axis (int): The axis to slice.
+            index (int): The slice index.
+            state (tuple): Display settings returned by getState.
+
+        Returns:
+            np.ndarray: The RGB slice.
+        """
+
+        opacity, visible = state
+        if not visible or opacity <= 0:
+            return image
+
+        plane = self._views[axis][index]
+        if self._lut is None:
+            mask = plane != 0
+            overlay = np.broadcast_to(self._color, image.shape)
+        else:
+            labels = np.clip(plane, 0, len(self._lut) - 1).astype(np.intp)
+            mask = self._drawn[labels] & (plane < len(self._lut) - 1)
+            overlay = self._lut[labels]
+
+        return blend(image, overlay, opacity, mask)
+
+
+class ContourLayer:
+    """Contour vector data, which is drawn as polylines on the axial slices only.
+    """
+
+    def __init__(self, contours, structures: list = None, thickness: int = 1, opacity: float = 1.0, name: str = "Contours") -> None:
+        """Initializes the ContourLayer class.
+
+        Args:
+            contours (DICOMStructureSet or callable): A structure set, or a function returning a list of (name, color, points)
+            tuples for a slice index, with the points in pixel coordinates.
+            structures (list, optional): Names of the structures to draw. Defaults to all structures.
+            thickness (int, optional): Line thickness in pixels. Defaults to 1.
+            opacity (float, optional): Opacity between 0 and 1. Defaults to 1.0.
+            name (str, optional): Name of the layer. Defaults to "Contours".
+        """
+
+        self._contours = contours.getSliceContours if hasattr(contours, "getSliceContours") else contours
+        self.structures = structures
+        self.thickness = thickness
+        self.opacity = opacity
+        self.name = name
+        self.visible = True
+
+    def getViews(self) -> dict:
+        """Returns the views of the three axes. Contours are vector data and have none.
+
+        Returns:
+            dict: None.
+        """
+
+        return None
+
+    def getState(self) -> tuple:
+        """Returns the display settings of the layer.
+
+        Returns:
+            tuple: Names of the drawn structures or None for all, thickness, opacity and visibility.
+        """
+
+        return (None if self.structures is None else tuple(self.structures), self.thickness, self.opacity, self.visible)
+
+    def Composite(self, image: np.ndarray, axis: int, index: int, state: tuple) -> np.ndarray:
+        """Draws the contours of an axial slice onto an RGB slice. Slices along the other axes are returned unchanged.
+
+        Args:
+            image (np.ndarray): The RGB slice.
+            axis (int): The axis to slice.
+            index (int): The slice index.
+            state (tuple): Display settings returned by getState.
+
+        Returns:
+            np.ndarray: The RGB slice.
+        """
+
+        structures, thickness, opacity, visible = state
+        if not visible or opacity <= 0 or axis != 0:
+            return image
+
+        contours = [(color, points) for name, color, points in self._contours(index) if structures is None or name in structures]
+        if not contours:
+            return image
+
+        overlay = image.copy()
+        for color, points in contours:
+            cv2.polylines(overlay, [points.reshape(-1, 1, 2)], True, color, thickness)
+
+        return blend(image, overlay, opacity)
+
+
+class LayerStack:
+    """An ordered stack of layers which is composited per slice on demand. The first layer with volume data
+    defines the shape of the slices, and all volumes have to share it. Only the visible slice of every layer
+    is read.
+    """
+
+    def __init__(self, layers: list) -> None:
+        """Initializes the LayerStack class.
+
+        Args:
+            layers (list): The layers, from bottom to top.
+        """
+
+        self._layers = list(layers)
+        views = [layer.getViews() for layer in self._layers if layer.getViews() is not None]
+        if not views:
+            raise ValueError("At least one layer has to contain volume data")
+
+        self._views = views[0]
+        for other in views[1:]:
+            if other[0].shape[:3] != self._views[0].shape[:3]:
+                raise ValueError("All volumes must have the same shape")
+
+    def getLayers(self) -> list:
+        """Returns the layers, from bottom to top.
+
+        Returns:
+            list: The layers.
+        """
+
+        return self._layers
+
+    def getViews(self) -> dict:
+        """Returns the views of the three axes of the first volume.
+
+        Returns:
+            dict: SliceProviderView objects by axis.
+        """
+
+        return self._views
+
+    def getState(self) -> tuple:
+        """Returns the display settings of all layers.
+
+        Returns:
+            tuple: The states of the layers.
+        """
+
+        return tuple(layer.getState() for layer in self._layers)
+
+    def Render(self, axis: int, index: int, state: tuple = None) -> np.ndarray:
+        """Composites a slice of all layers.
+
+        Args:
+            axis (int): The axis to slice.
+            index (int): The slice index.
+            state (tuple, optional): Display settings returned by getState. Defaults to the current settings.
+
+        Returns:
+            np.ndarray: The RGB slice as uint8.
+        """
+
+        state = self.getState() if state is None else state
+        image = np.zeros(self._views[axis].shape[1:3] + (3,), dtype=np.uint8)
+        for layer, layer_state in zip(self._layers, state):
+            image = layer.Composite(image, axis, index, layer_state)
+
+        return image
@@ -0,0 +1,259 @@
+import os
+import cv2
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from rtdicomtools.npLayers import LayerStack, VolumeLayer
+from rtdicomtools.Instrumentation import instrumented
+
+
+def CrosshairPosition(shape: tuple, axis: int, indices: tuple) -> tuple:
+    """Calculate where the planes of the other two axes intersect a view, in the orientation used by
+    NumpyViewer3D.
+
+    Args:
+        shape (tuple): Shape of the volume.
+        axis (int): Axis of the view.
+        indices (tuple): Slice indices of the three axes.
+
+    Returns:
+        tuple: Row and column of the crosshair in the view.
+    """
+
+    depth = shape[0]
+    width = shape[2]
+    i, j, k = indices
+    if axis == 0:
+        return (j, width - 1 - k)
+    elif axis == 1:
+        return (depth - 1 - i, width - 1 - k)
+    else:
+        return (j, i)
+
+
+def SaveImage(path: str, image: np.ndarray) -> None:
+    """Save an RGB image, e.g. as PNG.
+
+    Args:
+        path (str): Path of the image file.
+        image (np.ndarray): The RGB image.
+    """
+
+    if not cv2.imwrite(path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR)):
+        raise OSError(f"Could not write {path}")
+
+
+class SliceRenderer:
+    """GUI-free render core of NumpyViewer3D. Renders single views, triple views with crosshair lines and
+    montages of a volume or layer stack as RGB arrays, and exports them as images.
+    """
+
+    def __init__(self, volume, window: float = None, level: float = None, colormap: str = "gray") -> None:
+        """Initializes the SliceRenderer class.
+
+        Args:
+            volume (np.ndarray, SliceProvider or LayerStack): The volume, or a stack of layers.
+            window (float, optional): Width of the display window of the volume. Defaults to the range of the volume.
+            level (float, optional): Center of the display window of the volume. Defaults to the center of the range of the volume.
+            colormap (str, optional): Name of the colormap used for scalar volumes. Defaults to "gray".
+        """
+
+        self._layers = volume if isinstance(volume, LayerStack) else LayerStack([VolumeLayer(volume, window, level, colormap)])
+        self._views = self._layers.getViews()
+        self._shape = self._views[0].shape[:3]
+
+    def getLayers(self) -> LayerStack:
+        """Get the layer stack.
+
+        Returns:
+            LayerStack: The layers.
+        """
+
+        return self._layers
+
+    def getViews(self) -> dict:
+        """Get the views of the three axes.
+
+        Returns:
+            dict: SliceProviderView objects by axis.
+        """
+
+        return self._views
+
+    def getShape(self) -> tuple:
+        """Get the shape of the volume.
+
+        Returns:
+            tuple: Shape of the volume.
+        """
+
+        return self._shape
+
+    @instrumented()
+    def RenderView(self, axis: int, index: int, size: tuple = None, interpolation: int = cv2.INTER_LINEAR, state: tuple = None) -> np.ndarray:
+        """Render a slice of one axis.
+
+        Args:
+            axis (int): The axis to slice.
+            index (int): The slice index.
+            size (tuple, optional): Width and height of the image. Defaults to the size of the slice.
+            interpolation (int, optional): OpenCV interpolation used for resizing. Defaults to cv2.INTER_LINEAR.
+            state (tuple, optional): Display settings of the layers. Defaults to the current settings.
+
+        Returns:
+            np.ndarray: The RGB image.
+        """
+
+        image = self._layers.Render(axis, index, state)
+        if size is not None and tuple(size) != (image.shape[1], image.shape[0]):
+            image = cv2.resize(image, tuple(int(s) for s in size), interpolation=interpolation)
+
+        return image
+
+    def RenderTripleView(self, indices: tuple = None, height: int = None, crosshairs: bool = True, color: tuple = (255, 0, 0),
+                         interpolation: int = cv2.INTER_LINEAR) -> np.ndarray:
+        """Render the three views side by side, scaled to the same height, with lines marking the slices
+        shown in the other views.
+
+        Args:
+            indices (tuple, optional): Slice indices of the three axes. Defaults to the center slices.
+            height (int, optional): Height of the image. Defaults to the largest height of the views.
+            crosshairs (bool, optional): Draw the crosshair lines. Defaults to True.
+            color (tuple, optional): RGB color of the lines. Defaults to (255, 0, 0).
+            interpolation (int, optional): OpenCV interpolation used for resizing. Defaults to cv2.INTER_LINEAR.
+
+        Returns:
+            np.ndarray: The RGB image.
+        """
+
+        if indices is None:
+            indices = tuple(self._views[axis].shape[0]//2 for axis in range(3))
+        if height is None:
+            height = max(self._views[axis].shape[1] for axis in range(3))
+
+        images = []
+        for axis in range(3):
+            rows, columns = self._views[axis].shape[1:3]
+            scale = height/rows
+            image = self.RenderView(axis, indices[axis], (max(int(round(columns*scale)), 1), height), interpolation)
+            if crosshairs:
+                row, column = CrosshairPosition(self._shape, axis, indices)
+                y = int((row + 0.5)*scale)
+                x = int((column + 0.5)*image.shape[1]/columns)
+                cv2.line(image, (0, y), (image.shape[1] - 1, y), color, 1)
+                cv2.line(image, (x, 0), (x, image.shape[0] - 1), color, 1)
+            images.append(image)
+
+        return np.hstack(images)
+
+    def RenderMontage(self, axis: int = 0, indices: list = None, columns: int = None, size: tuple = None, labels: bool = True,
+                      interpolation: int = cv2.INTER_AREA) -> np.ndarray:
+        """Render slices of one axis as a grid.
+
+        Args:
+            axis (int, optional): The axis to slice. Defaults to 0.
+            indices (list, optional): Slice indices. Defaults to all slices.
+            columns (int, optional): Number of columns of the grid. Defaults to a square grid.
+            size (tuple, optional): Width and height of every tile. Defaults to the size of the slices.
+            labels (bool, optional): Write the slice index into every tile. Defaults to True.
+            interpolation (int, optional): OpenCV interpolation used for resizing. Defaults to cv2.INTER_AREA.
+
+        Returns:
+            np.ndarray: The RGB image.
+        """
+
+        indices = list(range(self._views[axis].shape[0])) if indices is None else list(indices)
+        if not indices:
+            raise ValueError("No slices to render")
+        columns = int(np.ceil(np.sqrt(len(indices)))) if columns is None else columns
+        rows = -(-len(indices) // columns)
+        width, height = (self._views[axis].shape[2], self._views[axis].shape[1]) if size is None else size
+
+        montage = np.zeros((rows*height, columns*width, 3), dtype=np.uint8)
+        for n, index in enumerate(indices):
+            tile = self.RenderView(axis, index, (width, height), interpolation)
+            if labels:
+                cv2.putText(tile, str(index), (2, 12), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1, cv2.LINE_AA)
+            row, column = divmod(n, columns)
+            montage[row*height:(row + 1)*height, column*width:(column + 1)*width] = tile
+
+        return montage
+
+    def ExportSlices(self, directory: str, axis: int = 0, indices: list = None, size: tuple = None, prefix: str = "slice",
+                     workers: int = 4) -> list:
+        """Render slices of one axis and save them as PNG files, using a thread pool.
+
+        Args:
+            directory (str): Output directory.
+            axis (int, optional): The axis to slice. Defaults to 0.
+            indices (list, optional): Slice indices. Defaults to all slices.
+            size (tuple, optional): Width and height of the images. Defaults to the size of the slices.
+            prefix (str, optional): Prefix of the file names. Defaults to "slice".
+            workers (int, optional): Number of threads. Defaults to 4.
+
+        Returns:
+            list: Paths of the written files.
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        indices = range(self._views[axis].shape[0]) if indices is None else indices
+        paths = {index: os.path.join(directory, f"{prefix}_{axis}_{index:04d}.png") for index in indices}
+
+        def export(index):
+            SaveImage(paths[index], self.RenderView(axis, index, size))
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            list(executor.map(export, paths))
+
+        return list(paths.values())
+
+
+def _ExportSnapshot(job: dict) -> str:
+    """Render and save the snapshot of one job. Runs in a worker process.
+
+    Args:
+        job (dict): The job, see ExportSnapshots.
+
+    Returns:
+        str: Path of the written file.
+    """
+
+    job = dict(job)
+    volume = job.pop("volume")
+    if isinstance(volume, str):
+        volume = np.load(volume, mmap_mode="r")
+    output = job.pop("output")
+    view = job.pop("view", "triple")
+    renderer = SliceRenderer(volume, job.pop("window", None), job.pop("level", None), job.pop("colormap", "gray"))
+
+    if view == "single":
+        image = renderer.RenderView(job.pop("axis", 0), job.pop("index", renderer.getShape()[0]//2), **job)
+    elif view == "triple":
+        image = renderer.RenderTripleView(**job)
+    elif view == "montage":
+        image = renderer.RenderMontage(**job)
+    else:
+        raise ValueError(f"Unknown view {view}")
+
+    SaveImage(output, image)
+    return output
+
+
+def ExportSnapshots(jobs: list, workers: int = None) -> list:
+    """Render snapshots of many volumes, e.g. one per patient, in a process pool.
+
+    Every job is a dictionary with the keys "volume" (an array or the path to a .npy file, which is memory
+    mapped in the worker), "output" (path of the image file) and optionally "view" ("single", "triple" or
+    "montage", defaults to "triple"), "window", "level" and "colormap". All other keys are passed to the
+    corresponding render method of SliceRenderer.
+
+    Args:
+        jobs (list): The jobs.
+        workers (int, optional): Number of processes. Defaults to the number of CPUs.
+
+    Returns:
+        list: Paths of the written files, in the order of the jobs.
+    """
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_ExportSnapshot, jobs))
@@ -0,0 +1,169 @@
+import numpy as np
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Only needed for the annotations, importing dcmMLC at runtime would load pandas with the viewer.
+    from rtdicomtools.dcmMLC import DICOMMLC
+
+
+def PlaneAxes(normal, up=None, rotation: float = 0.0) -> tuple:
+    """Calculate orthonormal in-plane axes of a plane. Axes are given in the (axis 0, axis 1, axis 2) order
+    of the volume. For a plane normal to axis 0, the rows of the reslice run along axis 1 and the columns
+    along axis 2, so it matches the axial slice.
+
+    Args:
+        normal (array_like): Normal of the plane.
+        up (array_like, optional): Direction the rows of the reslice should follow. Defaults to axis 1, or axis 0 if the normal is close to axis 1.
+        rotation (float, optional): In-plane rotation in degrees. Defaults to 0.0.
+
+    Returns:
+        tuple: Unit normal, row direction and column direction.
+    """
+
+    normal = np.asarray(normal, dtype=np.float64)
+    length = np.linalg.norm(normal)
+    if length == 0:
+        raise ValueError("The normal must not be zero")
+    normal = normal / length
+
+    if up is None:
+        up = (0.0, 1.0, 0.0) if abs(normal[1]) < 0.99 else (1.0, 0.0, 0.0)
+    up = np.asarray(up, dtype=np.float64)
+    rows = up - np.dot(up, normal) * normal
+    if np.linalg.norm(rows) < 1e-6:
+        raise ValueError("The up direction must not be parallel to the normal")
+    rows /= np.linalg.norm(rows)
+    columns = np.cross(normal, rows)
+
+    if rotation:
+        angle = np.deg2rad(rotation)
+        rows, columns = np.cos(angle)*rows - np.sin(angle)*columns, np.sin(angle)*rows + np.cos(angle)*columns
+
+    return normal, rows, columns
+
+
+def ResliceVolume(volume: np.ndarray, normal, point, shape: tuple = None, spacing: float = None, voxel_spacing: tuple = (1.0, 1.0, 1.0),
+                  up=None, rotation: float = 0.0, fill: float = 0.0) -> np.ndarray:
+    """Sample an arbitrary plane of a volume with trilinear interpolation. Only the samples of the plane
+    which lie inside the volume are interpolated, and the eight neighbours of each sample are gathered
+    from the flat volume in one vectorized pass.
+
+    Args:
+        volume (np.ndarray): Scalar volume, e.g. an np.memmap.
+        normal (array_like): Normal of the plane in the (axis 0, axis 1, axis 2) order of the volume, in mm.
+        point (array_like): Center of the reslice in voxel indices.
+        shape (tuple, optional): Rows and columns of the reslice. Defaults to a square covering the largest extent of the volume.
+        spacing (float, optional): Distance between the samples in mm. Defaults to the smallest voxel spacing.
+        voxel_spacing (tuple, optional): Voxel spacing along the three axes in mm. Defaults to (1.0, 1.0, 1.0).
+        up (array_like, optional): Direction the rows of the reslice should follow, see PlaneAxes. Defaults to None.
+        rotation (float, optional): In-plane rotation in degrees. Defaults to 0.0.
+        fill (float, optional): Value of the samples outside of the volume. Defaults to 0.0.
+
+    Returns:
+        np.ndarray: The reslice as float32.
+    """
+
+    if volume.ndim != 3:
+        raise ValueError("Only scalar 3D volumes can be resliced")
+
+    voxel_spacing = np.asarray(voxel_spacing, dtype=np.float64)
+    dimensions = np.array(volume.shape)
+    spacing = float(voxel_spacing.min()) if spacing is None else float(spacing)
+    if shape is None:
+        size = int(np.ceil((dimensions*voxel_spacing).max()/spacing))
+        shape = (size, size)
+
+    _, rows, columns = PlaneAxes(normal, up, rotation)
+    rows = rows*spacing/voxel_spacing
+    columns = columns*spacing/voxel_spacing
+    point = np.asarray(point, dtype=np.float64)
+
+    r = (np.arange(shape[0]) - (shape[0] - 1)/2).astype(np.float32)
+    c = (np.arange(shape[1]) - (shape[1] - 1)/2).astype(np.float32)
+    coordinates = [(point[k] + r[:, None]*np.float32(rows[k]) + c[None, :]*np.float32(columns[k])).astype(np.float32) for k in range(3)]
+
+    inside = np.ones(shape, dtype=bool)
+    for k in range(3):
+        inside &= (coordinates[k] >= -1e-4) & (coordinates[k] <= dimensions[k] - 1 + 1e-4)
+
+    result = np.full(shape, fill, dtype=np.float32)
+    if not inside.any():
+        return result
+
+    base = np.zeros(np.count_nonzero(inside), dtype=np.intp)
+    weights = []
+    offsets = []
+    strides = np.array([dimensions[1]*dimensions[2], dimensions[2], 1])
+    for k in range(3):
+        x = coordinates[k][inside]
+        lower = np.clip(np.floor(x), 0, max(dimensions[k] - 2, 0)).astype(np.intp)
+        weights.append(np.clip(x - lower, 0, 1))
+        base += lower*strides[k]
+        offsets.append(strides[k] if dimensions[k] > 1 else 0)
+
+    if volume.flags.c_contiguous:
+        flat = volume.reshape(-1)
+        gather = lambda index: flat.take(index).astype(np.float32)
+    else:
+        gather = lambda index: volume[np.unravel_index(index, volume.shape)].astype(np.float32)
+
+    w0, w1, w2 = weights
+    o0, o1, o2 = offsets
+    c00 = gather(base)*(1 - w2) + gather(base + o2)*w2
+    c01 = gather(base + o1)*(1 - w2) + gather(base + o1 + o2)*w2
+    c10 = gather(base + o0)*(1 - w2) + gather(base + o0 + o2)*w2
+    c11 = gather(base + o0 + o1)*(1 - w2) + gather(base + o0 + o1 + o2)*w2
+    result[inside] = (c00*(1 - w1) + c01*w1)*(1 - w0) + (c10*(1 - w1) + c11*w1)*w0
+
+    return result
+
+
+def BeamsEyeViewNormal(gantry_angle: float, couch_angle: float = 0.0) -> np.ndarray:
+    """Calculate the beam direction from the source to the isocenter, in the (axis 0, axis 1, axis 2) order of
+    a CT volume indexed as [z, y, x] in the DICOM patient coordinate system. A head first supine patient is
+    assumed, so a gantry angle of 0 degrees points from anterior to posterior.
+
+    Args:
+        gantry_angle (float): Gantry angle in degrees.
+        couch_angle (float, optional): Patient support angle in degrees. Defaults to 0.0.
+
+    Returns:
+        np.ndarray: Unit beam direction.
+    """
+
+    gantry = np.deg2rad(gantry_angle)
+    couch = np.deg2rad(couch_angle)
+    x, y, z = -np.sin(gantry), np.cos(gantry), 0.0
+    x, z = x*np.cos(couch) + z*np.sin(couch), -x*np.sin(couch) + z*np.cos(couch)
+
+    return np.array([z, y, x])
+
+
+def ResliceBeamsEyeView(volume: np.ndarray, plan: "DICOMMLC", beam: int, isocenter, control_point: int = 0, depth: float = 0.0,
+                        couch_angle: float = 0.0, **options) -> np.ndarray:
+    """Sample the plane perpendicular to the beam axis of a control point, e.g. through the isocenter. The rows
+    of the reslice follow the patient z axis at gantry angle 0, and the reslice is rotated with the collimator.
+
+    Args:
+        volume (np.ndarray): Scalar CT volume indexed as [z, y, x].
+        plan (DICOMMLC): The plan.
+        beam (int): Beam number.
+        isocenter (array_like): Isocenter in voxel indices of the volume.
+        control_point (int, optional): Control point whose gantry angle is used. Defaults to 0.
+        depth (float, optional): Distance of the plane from the isocenter along the beam axis in mm. Defaults to 0.0.
+        couch_angle (float, optional): Patient support angle in degrees. Defaults to 0.0.
+        **options: Options passed to ResliceVolume, e.g. voxel_spacing, shape and spacing.
+
+    Returns:
+        np.ndarray: The reslice as float32.
+    """
+
+    beam_mlc = plan.getBeamMLCSequence()[beam]
+    normal = BeamsEyeViewNormal(beam_mlc.getGantryAngles()[control_point], couch_angle)
+    voxel_spacing = np.asarray(options.get("voxel_spacing", (1.0, 1.0, 1.0)), dtype=np.float64)
+    point = np.asarray(isocenter, dtype=np.float64) + depth*normal/voxel_spacing
+    options.setdefault("up", (1.0, 0.0, 0.0) if abs(normal[0]) < 0.99 else (0.0, 1.0, 0.0))
+    options.setdefault("rotation", beam_mlc.getCollimatorAngle())
+
+    return ResliceVolume(volume, normal, point, **options)
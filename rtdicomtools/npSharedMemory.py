@@ -0,0 +1,127 @@
+import os
+import numpy as np
+import multiprocessing
+
+from multiprocessing import shared_memory, resource_tracker
+
+
+class SharedArrays:
+    """Packs a dictionary of numpy arrays into one shared memory block. The picklable descriptor of the
+    block can be sent to worker processes, which attach to it and get zero-copy views of the arrays.
+    The creating process owns the block and has to unlink it once all workers are done.
+    """
+
+    _alignment = 64
+
+    def __init__(self, arrays: dict, metadata: dict = None) -> None:
+        """Initialize the SharedArrays class by copying the arrays into a new shared memory block.
+
+        Args:
+            arrays (dict): Arrays to share, by name.
+            metadata (dict, optional): Small picklable data sent along with the descriptor. Defaults to None.
+        """
+
+        layout = {}
+        size = 0
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            layout[name] = (size, array.shape, array.dtype.str)
+            size += -(-array.nbytes // self._alignment) * self._alignment
+
+        self._shared_memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self._layout = layout
+        self._metadata = metadata if metadata is not None else {}
+        self._owner = True
+        self._pid = os.getpid()
+        self._arrays = self._CreateViews()
+
+        for name, array in arrays.items():
+            self._arrays[name][...] = array
+
+    @classmethod
+    def Attach(cls, descriptor: dict) -> "SharedArrays":
+        """Attach to a shared memory block created in another process.
+
+        Args:
+            descriptor (dict): Descriptor returned by getDescriptor.
+
+        Returns:
+            SharedArrays: Zero-copy views of the shared arrays.
+        """
+
+        shared = cls.__new__(cls)
+        try:
+            shared._shared_memory = shared_memory.SharedMemory(name=descriptor["name"], track=False)
+        except TypeError:
+            # Before Python 3.13, attaching registers the block with the resource tracker. Child processes of
+            # the creator share its tracker, but an unrelated process would unlink the block when it exits.
+            shared._shared_memory = shared_memory.SharedMemory(name=descriptor["name"])
+            parent = multiprocessing.parent_process()
+            if descriptor["pid"] != os.getpid() and (parent is None or parent.pid != descriptor["pid"]):
+                try:
+                    resource_tracker.unregister(shared._shared_memory._name, "shared_memory")
+                except Exception:
+                    pass
+        shared._layout = descriptor["layout"]
+        shared._metadata = descriptor["metadata"]
+        shared._owner = False
+        shared._pid = descriptor["pid"]
+        shared._arrays = shared._CreateViews()
+
+        return shared
+
+    def _CreateViews(self) -> dict:
+        """Create the numpy views into the shared memory block.
+
+        Returns:
+            dict: Arrays by name.
+        """
+
+        return {name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._shared_memory.buf, offset=offset)
+                for name, (offset, shape, dtype) in self._layout.items()}
+
+    def __enter__(self) -> "SharedArrays":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.Close()
+        if self._owner:
+            self.Unlink()
+
+    def getDescriptor(self) -> dict:
+        """Get the picklable descriptor of the block.
+
+        Returns:
+            dict: Name, creating process, layout and metadata of the block.
+        """
+
+        return {"name": self._shared_memory.name, "pid": self._pid, "layout": self._layout, "metadata": self._metadata}
+
+    def getArrays(self) -> dict:
+        """Get the shared arrays.
+
+        Returns:
+            dict: Arrays by name.
+        """
+
+        return self._arrays
+
+    def getMetadata(self) -> dict:
+        """Get the metadata sent along with the block.
+
+        Returns:
+            dict: Metadata.
+        """
+
+        return self._metadata
+
+    def Close(self) -> None:
+        """Release the views and close this process' handle to the block."""
+
+        self._arrays = {}
+        self._shared_memory.close()
+
+    def Unlink(self) -> None:
+        """Free the shared memory block. Only the creating process should call this."""
+
+        self._shared_memory.unlink()
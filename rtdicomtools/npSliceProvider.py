@@ -0,0 +1,432 @@
+import threading
+import numpy as np
+import pydicom
+
+from collections import OrderedDict
+from pydicom.pixel_data_handlers import apply_rescale
+
+
+class SliceProvider:
+    """Base class for lazily loaded 3D volumes. A slice provider exposes the `shape`, `ndim` and `dtype` of
+    the volume and returns single planes with getSlice, so only the requested data has to be read.
+
+    Planes along the axes which can be read directly are read one at a time. Planes along the other axes
+    are read in slabs of `chunk_size` consecutive planes, so scrolling through them only touches the
+    source data once per slab. Both are kept in a least recently used cache.
+
+    Subclasses set `shape` and `dtype`, and implement _ReadSlab.
+    """
+
+    def __init__(self, shape: tuple, dtype, direct_axes: tuple = (0,), chunk_size: int = 16, cache_size: int = 8) -> None:
+        """Initializes the SliceProvider class.
+
+        Args:
+            shape (tuple): Shape of the volume, optionally with a trailing RGB axis.
+            dtype (np.dtype): Data type of the volume.
+            direct_axes (tuple, optional): Axes along which single planes can be read efficiently. Defaults to (0,).
+            chunk_size (int, optional): Number of planes read at once along the other axes. Defaults to 16.
+            cache_size (int, optional): Number of cached planes and slabs. Defaults to 8.
+        """
+
+        if chunk_size < 1:
+            raise ValueError("The chunk size must be at least 1")
+
+        self.shape = tuple(shape)
+        self.ndim = len(self.shape)
+        self.dtype = np.dtype(dtype)
+        self._direct_axes = direct_axes
+        self._chunk_size = chunk_size
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _ReadSlab(self, axis: int, start: int, stop: int) -> np.ndarray:
+        """Reads consecutive planes of the volume.
+
+        Args:
+            axis (int): The axis to slice.
+            start (int): First plane.
+            stop (int): Plane after the last plane.
+
+        Returns:
+            np.ndarray: The planes, with the sliced axis first.
+        """
+
+        raise NotImplementedError
+
+    def _getCached(self, key: tuple, read) -> np.ndarray:
+        """Returns an entry of the cache, reading it if needed.
+
+        Args:
+            key (tuple): Axis, start and stop of the slab.
+            read (callable): Function reading the slab.
+
+        Returns:
+            np.ndarray: The slab.
+        """
+
+        with self._lock:
+            slab = self._cache.get(key)
+            if slab is not None:
+                self._cache.move_to_end(key)
+                return slab
+
+        slab = read()
+        self._putCached(key, slab)
+        return slab
+
+    def _putCached(self, key: tuple, slab: np.ndarray) -> None:
+        """Adds an entry to the cache, e.g. a slab which was read together with the requested one.
+
+        Args:
+            key (tuple): Axis, start and stop of the slab.
+            slab (np.ndarray): The slab.
+        """
+
+        with self._lock:
+            self._cache[key] = slab
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def getSlice(self, axis: int, index: int) -> np.ndarray:
+        """Returns a plane of the volume.
+
+        Args:
+            axis (int): The axis to slice.
+            index (int): The plane index.
+
+        Returns:
+            np.ndarray: The plane, with the remaining axes in their original order.
+        """
+
+        if not 0 <= index < self.shape[axis]:
+            raise IndexError(f"Index {index} is out of bounds for axis {axis} with size {self.shape[axis]}")
+
+        if axis in self._direct_axes:
+            return self._getCached((axis, index, index + 1), lambda: self._ReadSlab(axis, index, index + 1))[0]
+
+        start = index - index % self._chunk_size
+        stop = min(start + self._chunk_size, self.shape[axis])
+        return self._getCached((axis, start, stop), lambda: self._ReadSlab(axis, start, stop))[index - start]
+
+    def getValueRange(self, samples: int = 8) -> tuple:
+        """Estimates the range of the values from evenly spaced planes along the first axis.
+
+        Args:
+            samples (int, optional): Number of sampled planes. Defaults to 8.
+
+        Returns:
+            tuple: Minimum and maximum value.
+        """
+
+        indices = np.unique(np.linspace(0, self.shape[0] - 1, min(samples, self.shape[0])).astype(int))
+        planes = [self.getSlice(0, i) for i in indices]
+        return (float(min(np.nanmin(plane) for plane in planes)), float(max(np.nanmax(plane) for plane in planes)))
+
+    def clearCache(self) -> None:
+        """Removes all cached planes and slabs."""
+
+        with self._lock:
+            self._cache.clear()
+
+
+class ArraySliceProvider(SliceProvider):
+    """Slice provider for numpy arrays and memory mapped files. Arrays in memory are sliced without copying.
+    Memory mapped files are read plane by plane along their slowest varying axis and in slabs along the
+    other axes, so only the pages of the requested planes are loaded.
+    """
+
+    def __init__(self, array: np.ndarray, chunk_size: int = 16, cache_size: int = 8) -> None:
+        """Initializes the ArraySliceProvider class.
+
+        Args:
+            array (np.ndarray): The volume, e.g. an np.memmap.
+            chunk_size (int, optional): Number of planes read at once along the strided axes. Defaults to 16.
+            cache_size (int, optional): Number of cached planes and slabs. Defaults to 8.
+        """
+
+        direct_axis = int(np.argmax(array.strides[:3]))
+        super().__init__(array.shape, array.dtype, (direct_axis,), chunk_size, cache_size)
+        self._array = array
+        self._chunked = isinstance(array, np.memmap)
+
+    def getArray(self) -> np.ndarray:
+        """Returns the wrapped array.
+
+        Returns:
+            np.ndarray: The volume.
+        """
+
+        return self._array
+
+    def _ReadSlab(self, axis: int, start: int, stop: int) -> np.ndarray:
+        slab = self._array[(slice(None),)*axis + (slice(start, stop),)]
+        return np.ascontiguousarray(np.moveaxis(slab, axis, 0))
+
+    def getSlice(self, axis: int, index: int) -> np.ndarray:
+        if not self._chunked:
+            return self._array[(slice(None),)*axis + (index,)]
+        return super().getSlice(axis, index)
+
+    def getValueRange(self, samples: int = 8) -> tuple:
+        if not self._chunked:
+            return (float(np.nanmin(self._array)), float(np.nanmax(self._array)))
+        return super().getValueRange(samples)
+
+
+class DICOMSeriesSliceProvider(SliceProvider):
+    """Slice provider for a series of single frame DICOM images, such as a CT. Only the headers are read
+    up front to sort the images along the patient z axis. The pixel data of each image is decoded and
+    rescaled when it is first needed, and kept in a cache of decoded images.
+
+    Planes along the in-plane axes need every image of the series. When one of their slabs is missing,
+    each image is read once and `slab_batch` neighbouring slabs of that axis are filled from it, so
+    scrolling through a coronal or sagittal view decodes the series once per batch instead of once
+    per slab.
+    """
+
+    def __init__(self, files: list, chunk_size: int = 16, cache_size: int = 32, image_cache_size: int = 64, slab_batch: int = 8) -> None:
+        """Initializes the DICOMSeriesSliceProvider class.
+
+        Args:
+            files (list): Paths to the DICOM images.
+            chunk_size (int, optional): Number of planes read at once along the in-plane axes. Defaults to 16.
+            cache_size (int, optional): Number of cached slabs. Defaults to 32.
+            image_cache_size (int, optional): Number of cached decoded images. Defaults to 64.
+            slab_batch (int, optional): Number of slabs of an in-plane axis filled from one pass over the images. Defaults to 8.
+        """
+
+        if slab_batch < 1:
+            raise ValueError("The slab batch must be at least 1")
+
+        headers = [(file, pydicom.dcmread(file, stop_before_pixels=True)) for file in files]
+        if not headers:
+            raise ValueError("The series does not contain any images")
+        headers.sort(key=lambda header: float(header[1].ImagePositionPatient[2]) if "ImagePositionPatient" in header[1] else int(header[1].InstanceNumber))
+
+        self._files = [file for file, _ in headers]
+        first = headers[0][1]
+        rescaled = any(float(getattr(header, "RescaleSlope", 1)) != 1 or float(getattr(header, "RescaleIntercept", 0)) != 0 for _, header in headers)
+        super().__init__((len(self._files), int(first.Rows), int(first.Columns)), np.float32 if rescaled else np.int32, (0,), chunk_size, cache_size)
+        self._image_cache_size = image_cache_size
+        self._images = OrderedDict()
+        self._image_lock = threading.Lock()
+        self._slab_batch = slab_batch
+
+    def _ReadImage(self, index: int) -> np.ndarray:
+        """Decodes and rescales an image of the series.
+
+        Args:
+            index (int): The image index.
+
+        Returns:
+            np.ndarray: The rescaled pixel data.
+        """
+
+        with self._image_lock:
+            image = self._images.get(index)
+            if image is not None:
+                self._images.move_to_end(index)
+                return image
+
+        ds = pydicom.dcmread(self._files[index])
+        image = apply_rescale(ds.pixel_array, ds).astype(self.dtype)
+        with self._image_lock:
+            self._images[index] = image
+            while len(self._images) > self._image_cache_size:
+                self._images.popitem(last=False)
+
+        return image
+
+    def _ReadSlab(self, axis: int, start: int, stop: int) -> np.ndarray:
+        if axis == 0:
+            if stop - start == 1:
+                return self._ReadImage(start)[None]
+            return np.stack([self._ReadImage(i) for i in range(start, stop)])
+
+        # The batch of slabs containing the requested one, which are filled from the same pass over the images.
+        # Batches are aligned, so scrolling in either direction reads the series once per batch.
+        chunks = -(-self.shape[axis] // self._chunk_size)
+        first = start // self._chunk_size // self._slab_batch * self._slab_batch
+        bounds = [(c*self._chunk_size, min((c + 1)*self._chunk_size, self.shape[axis])) for c in range(first, min(first + self._slab_batch, chunks))]
+        low, high = bounds[0][0], bounds[-1][1]
+
+        batch = np.empty((high - low,) + tuple(np.delete(self.shape, axis)), dtype=self.dtype)
+        for i in range(self.shape[0]):
+            image = self._ReadImage(i)
+            batch[:, i] = image[low:high] if axis == 1 else image[:, low:high].T
+
+        for bound in bounds:
+            if bound[0] != start:
+                self._putCached((axis,) + bound, batch[bound[0] - low:bound[1] - low])
+        return batch[start - low:stop - low]
+
+    def clearCache(self) -> None:
+        """Removes all cached slabs and decoded images."""
+
+        super().clearCache()
+        with self._image_lock:
+            self._images.clear()
+
+
+class SlicePyramid:
+    """Downsampled copies of the planes of a volume along all three axes, in the orientation used by
+    NumpyViewer3D. Every plane is kept, but subsampled in-plane by the factors of the pyramid, so a coarse
+    plane exists for every slice index. The pyramid is built lazily in a background thread from a single
+    pass along the first axis, and levels which would exceed the memory limit are skipped.
+    """
+
+    def __init__(self, provider: SliceProvider, factors: tuple = (2, 4), max_bytes: int = 256*1024**2) -> None:
+        """Initializes the SlicePyramid class.
+
+        Args:
+            provider (SliceProvider): The volume.
+            factors (tuple, optional): Downsampling factors. Defaults to (2, 4).
+            max_bytes (int, optional): Memory limit of all levels in bytes. Defaults to 256 MiB.
+        """
+
+        self._provider = provider
+        self._levels = {}
+        self._ready = threading.Event()
+        self._cancelled = threading.Event()
+
+        depth, height, width = provider.shape[:3]
+        channels = tuple(provider.shape[3:])
+        used = 0
+        self._factors = []
+        for factor in sorted(factors, reverse=True):
+            shapes = [(depth, -(-height // factor), -(-width // factor)),
+                      (height, -(-depth // factor), -(-width // factor)),
+                      (width, -(-height // factor), -(-depth // factor))]
+            size = sum(int(np.prod(shape + channels)) for shape in shapes)*provider.dtype.itemsize
+            if used + size > max_bytes:
+                continue
+            used += size
+            self._factors.append(factor)
+            self._levels[factor] = [np.empty(shape + channels, dtype=provider.dtype) for shape in shapes]
+
+        self._thread = threading.Thread(target=self._Build, daemon=True)
+
+    def start(self) -> "SlicePyramid":
+        """Starts building the pyramid in the background.
+
+        Returns:
+            SlicePyramid: The pyramid.
+        """
+
+        if self._levels:
+            self._thread.start()
+        return self
+
+    def cancel(self) -> None:
+        """Stops building the pyramid."""
+
+        self._cancelled.set()
+
+    def _Build(self) -> None:
+        depth = self._provider.shape[0]
+        for i in range(depth):
+            if self._cancelled.is_set():
+                return
+            plane = self._provider.getSlice(0, i)
+            for factor, (axial, coronal, sagittal) in self._levels.items():
+                axial[i] = plane[::factor, ::factor]
+                if (depth - 1 - i) % factor == 0:
+                    coronal[:, (depth - 1 - i)//factor] = plane[:, ::factor]
+                if i % factor == 0:
+                    sagittal[:, :, i//factor] = np.swapaxes(plane[::factor, ::-1], 0, 1)
+        self._ready.set()
+
+    def isReady(self) -> bool:
+        """Returns whether the pyramid has been built.
+
+        Returns:
+            bool: True if the levels can be used.
+        """
+
+        return self._ready.is_set()
+
+    def getFactors(self) -> list:
+        """Returns the downsampling factors of the levels within the memory limit.
+
+        Returns:
+            list: The factors, coarsest first.
+        """
+
+        return self._factors
+
+    def getSlice(self, axis: int, index: int, factor: int) -> np.ndarray:
+        """Returns a downsampled plane.
+
+        Args:
+            axis (int): The axis to slice.
+            index (int): The slice index.
+            factor (int): The downsampling factor.
+
+        Returns:
+            np.ndarray: The plane, or None if the pyramid is not built yet or the level does not exist.
+        """
+
+        if not self._ready.is_set() or factor not in self._levels:
+            return None
+        return self._levels[factor][axis][index]
+
+
+class SliceProviderView:
+    """A read-only view of the planes of a SliceProvider along one axis, which can be indexed like a stack of
+    2D arrays. The planes can be reoriented for display.
+    """
+
+    def __init__(self, provider: SliceProvider, axis: int, reverse: bool = False, flip: bool = False, transpose: bool = False) -> None:
+        """Initializes the SliceProviderView class.
+
+        Args:
+            provider (SliceProvider): The volume.
+            axis (int): The axis to slice.
+            reverse (bool, optional): Reverse the order of the planes. Defaults to False.
+            flip (bool, optional): Flip the planes vertically. Defaults to False.
+            transpose (bool, optional): Transpose the planes, after flipping. Defaults to False.
+        """
+
+        self._provider = provider
+        self._axis = axis
+        self._reverse = reverse
+        self._flip = flip
+        self._transpose = transpose
+
+        plane = [size for i, size in enumerate(provider.shape[:3]) if i != axis]
+        if transpose:
+            plane = plane[::-1]
+        self.shape = (provider.shape[axis], *plane) + tuple(provider.shape[3:])
+        self.ndim = provider.ndim
+        self.dtype = provider.dtype
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        index = int(index)
+        if self._reverse:
+            index = self.shape[0] - 1 - index
+        plane = self._provider.getSlice(self._axis, index)
+        if self._flip:
+            plane = plane[::-1]
+        if self._transpose:
+            plane = np.swapaxes(plane, 0, 1)
+        return plane
+
+
+def OrientedViews(provider: SliceProvider) -> dict:
+    """Create the views of the three axes in the orientation used by NumpyViewer3D.
+
+    Args:
+        provider (SliceProvider): The volume.
+
+    Returns:
+        dict: SliceProviderView objects by axis.
+    """
+
+    return {0: SliceProviderView(provider, 0),
+            1: SliceProviderView(provider, 1, flip=True),
+            2: SliceProviderView(provider, 2, reverse=True, transpose=True)}
@@ -1,36 +1,228 @@
-import cv2
+import time
+import threading
 import numpy as np
 import tkinter as tk
 import customtkinter as ctk
 from PIL import Image, ImageTk
+from collections import OrderedDict
 
-class NumpyViewer3D(ctk.CTk):
-    """A 3D viewer for numpy arrays.
+from rtdicomtools.npLayers import COLORMAPS, VolumeLayer, colormap_lut, window_slice
+from rtdicomtools.npRender import SliceRenderer, CrosshairPosition
+from rtdicomtools.npReslice import ResliceVolume
+from rtdicomtools.Instrumentation import instrumented
+from rtdicomtools.npSliceProvider import ArraySliceProvider, SlicePyramid
+
+
+class SliceCache:
+    """A thread-safe least recently used cache of rendered slice images.
     """
 
-    def __init__(self, array: np.ndarray) -> None:
-        
-        super().__init__(fg_color="black")
-        
+    def __init__(self, capacity: int = 64) -> None:
+        """Initializes the SliceCache class.
+
+        Args:
+            capacity (int, optional): Maximum number of cached images. Defaults to 64.
+        """
+
+        self._capacity = capacity
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._images
+
+    def get(self, key) -> Image.Image:
+        """Returns the cached image and marks it as recently used.
+
+        Args:
+            key (tuple): The cache key.
+
+        Returns:
+            Image.Image: The image, or None if it is not cached.
+        """
+
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+            return image
+
+    def put(self, key, image: Image.Image) -> None:
+        """Adds an image and evicts the least recently used ones above the capacity.
+
+        Args:
+            key (tuple): The cache key.
+            image (Image.Image): The image.
+        """
+
+        with self._lock:
+            self._images[key] = image
+            self._images.move_to_end(key)
+            while len(self._images) > self._capacity:
+                self._images.popitem(last=False)
+
+    def clear(self) -> None:
+        """Removes all cached images."""
+
+        with self._lock:
+            self._images.clear()
+
+
+class SlicePrefetcher(threading.Thread):
+    """A background thread which renders requested slices into a SliceCache. A new request replaces
+    the pending ones, so the thread always works on the slices next to the current scroll position. The
+    thread holds the render function and with it the viewer, so it has to be stopped when the viewer closes.
+    """
+
+    def __init__(self, render, cache: SliceCache) -> None:
+        """Initializes the SlicePrefetcher class and starts the thread.
+
+        Args:
+            render (callable): Function which renders the image for a cache key.
+            cache (SliceCache): The cache to fill.
+        """
+
+        super().__init__(daemon=True)
+        self._render = render
+        self._cache = cache
+        self._pending = []
+        self._stopped = False
+        self._condition = threading.Condition()
+        self.start()
+
+    def request(self, keys: list) -> None:
+        """Replaces the pending requests.
+
+        Args:
+            keys (list): Cache keys to render, in order of priority.
+        """
+
+        with self._condition:
+            if self._stopped:
+                return
+            self._pending = [key for key in keys if key not in self._cache]
+            self._condition.notify()
+
+    def stop(self) -> None:
+        """Discards the pending requests and ends the thread after the slice which is being rendered."""
+
+        with self._condition:
+            self._stopped = True
+            self._pending = []
+            self._condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    break
+                key = self._pending.pop(0)
+            if key in self._cache:
+                continue
+            try:
+                self._cache.put(key, self._render(*key))
+            except Exception:
+                continue
+
+        # Release the render function, and with it the viewer and its volume.
+        self._render = None
+
+
+RESAMPLING = getattr(Image, "Resampling", Image)
+
+
+def debounce(widget: tk.Misc, job: str, delay: int, callback) -> str:
+    """Cancels a pending Tk job and schedules the callback after the delay instead, so a burst of events
+    results in a single call.
+
+    Args:
+        widget (tk.Misc): Widget whose event loop runs the callback.
+        job (str): Identifier of the pending job, or None.
+        delay (int): Delay in milliseconds.
+        callback (callable): The callback.
+
+    Returns:
+        str: Identifier of the new job.
+    """
+
+    if job is not None:
+        widget.after_cancel(job)
+    return widget.after(delay, callback)
+
+
+def fit_size(image_size: tuple, widget_size: tuple) -> tuple:
+    """Calculates the size an image is scaled to in order to fill a widget, keeping its aspect ratio.
+
+    Args:
+        image_size (tuple): Width and height of the image.
+        widget_size (tuple): Width and height of the widget.
+
+    Returns:
+        tuple: Width and height of the scaled image.
+    """
+
+    width, height = widget_size
+    aspect_ratio = image_size[0]/image_size[1]
+    if aspect_ratio == 1:
+        size = min([width, height])
+        return (size, size)
+    elif aspect_ratio > 1:
+        return (width, int(width/aspect_ratio))
+    else:
+        return (int(height*aspect_ratio), height)
+
+
+class _ViewerMixin:
+    """Viewer logic shared by the NumpyViewer3D application and the NumpyViewerWindow toplevel window.
+    """
+
+    def close(self) -> None:
+        """Closes the window, which stops the background threads."""
+
+        self.destroy()
+
+    def destroy(self) -> None:
+        """Stops building the pyramid and prefetching slices, so the threads release the volume, and destroys the window."""
+
+        if getattr(self, "pyramid", None) is not None:
+            self.pyramid.cancel()
+        if getattr(self, "prefetcher", None) is not None:
+            self.prefetcher.stop()
+        super().destroy()
+
+    def setup_viewer(self, array, window: float = None, level: float = None, colormap: str = "gray", voxel_spacing: tuple = (1.0, 1.0, 1.0),
+                     pyramid: bool = None) -> None:
+        """Builds the viewer. The volume is kept in its native dtype and only the visible slices are
+        read and mapped to 8 bit.
+
+        Args:
+            array (np.ndarray, SliceProvider or LayerStack): The volume, either scalar of any dtype or RGB, or a stack
+            of layers which are composited per visible slice. Memory mapped arrays and slice providers are read
+            lazily, one plane or slab at a time.
+            window (float, optional): Width of the display window of the volume. Defaults to the range of the volume.
+            level (float, optional): Center of the display window of the volume. Defaults to the center of the range of the volume.
+            colormap (str, optional): Name of the colormap used for scalar volumes. Defaults to "gray".
+            voxel_spacing (tuple, optional): Voxel spacing along the three axes in mm, used for oblique reslicing. Defaults to (1.0, 1.0, 1.0).
+            pyramid (bool, optional): Build downsampled copies of the volume in the background, which are shown while
+            scrubbing quickly. Defaults to volumes larger than 64 MiB.
+        """
+
         self.apptitle = ("3D Numpy Viewer")
         self.author = "Sebastian Schäfer"
         self.version = "1.0"
         self.title(f"{self.apptitle} v{self.version} by {self.author}")
 
-        ctk.set_appearance_mode("dark")
-        ctk.set_default_color_theme("dark-blue")
-
         self.geometry("800x600")
         self.minsize(800, 600)
         
-        self.image_data = array
-        self.dimensions = self.image_data.shape        
-        self.X = array
+        self.renderer = SliceRenderer(array, window, level, colormap)
+        self.layers = self.renderer.getLayers()
+        self.X, self.Y, self.Z = (self.layers.getViews()[axis] for axis in range(3))
+        self.image_data = self.X
         self.dimensions = self.X.shape
-        
-        self.Y = np.rot90(self.X, k=1, axes=(1, 0))
-        self.Z = np.rot90(self.Y, k=1, axes=(0, 2))
-        self.Z = np.rot90(self.Z, k=-1, axes=(1, 2))
 
         self.index = 0
         self.xindex = 0
@@ -39,12 +231,33 @@ class NumpyViewer3D(ctk.CTk):
         
         self.axis = 0
 
+        self.volumes = {0: self.X, 1: self.Y, 2: self.Z}
+        self.base_layer = self.layers.getLayers()[0] if isinstance(self.layers.getLayers()[0], VolumeLayer) else None
+        self.rgb = self.base_layer is None or self.base_layer.rgb
+        self.voxel_spacing = voxel_spacing
+        self.debounce_delay = 50
+        self.refine_delay = 250
+        self.prefetch_depth = 4
+        self.scrub_speed = 30
+        self.pyramid = None
+        if self.base_layer is not None:
+            provider = self.base_layer.getProvider()
+            if pyramid or (pyramid is None and np.prod(provider.shape)*provider.dtype.itemsize > 64*1024**2):
+                self.pyramid = SlicePyramid(provider).start()
+        self.slice_cache = SliceCache()
+        self.prefetcher = SlicePrefetcher(self.render_slice, self.slice_cache)
+
         self.tabview = ctk.CTkTabview(self)
         self.tabview.add("Single")
         self.tabview.add("Triple")
 
         self.single_frame = ctk.CTkFrame(self.tabview.tab("Single"), bg_color="black")
         self.triple_frame = self.TripleFrame(self.tabview.tab("Triple"))
+        self.oblique_frame = None
+        if not self.rgb and isinstance(self.base_layer.getProvider(), ArraySliceProvider):
+            self.tabview.add("Oblique")
+            self.oblique_frame = self.ObliqueFrame(self.tabview.tab("Oblique"))
+            self.oblique_frame.pack(fill=tk.BOTH, expand=True)
 
         self.controlframe = self.ControlFrame(self.single_frame)
         self.viewframe = self.ViewFrame(self.single_frame)
@@ -60,9 +273,122 @@ class NumpyViewer3D(ctk.CTk):
         self.triple_frame.pack(fill=tk.BOTH, expand=True)
 
         self.tabview.pack(fill=tk.BOTH, expand=True)
-        self.single_frame.bind("<Configure>", lambda x : self.viewframe.update_image())
 
-        self.mainloop()
+    def get_display(self) -> tuple:
+        """Returns the current display settings of all layers, which are part of the slice cache key.
+
+        Returns:
+            tuple: The states of the layers.
+        """
+
+        return self.layers.getState()
+
+    def set_display(self, window: float = None, level: float = None, colormap: str = None) -> None:
+        """Changes the display settings of the base volume and redraws the views.
+
+        Args:
+            window (float, optional): Width of the display window. Defaults to None.
+            level (float, optional): Center of the display window. Defaults to None.
+            colormap (str, optional): Name of the colormap. Defaults to None.
+        """
+
+        if window is not None:
+            self.base_layer.window = max(float(window), np.finfo(np.float32).eps)
+        if level is not None:
+            self.base_layer.level = float(level)
+        if colormap is not None:
+            self.base_layer.colormap = colormap
+
+        self.update_views()
+
+    def update_views(self) -> None:
+        """Redraws all views, e.g. after the settings of a layer were changed."""
+
+        self.viewframe.update_image()
+        for view in (self.triple_frame.xview, self.triple_frame.yview, self.triple_frame.zview):
+            view.update_image()
+        if self.oblique_frame is not None:
+            self.oblique_frame.update_image()
+
+    @instrumented("NumpyViewer3D.render_slice")
+    def render_slice(self, axis: int, index: int, size: tuple, resample: int = RESAMPLING.NEAREST, display: tuple = None) -> Image.Image:
+        """Renders a slice of the volume as an image of the given size. Does not use Tk, so it can run
+        in the prefetch thread.
+
+        Args:
+            axis (int): The axis to slice.
+            index (int): The slice index.
+            size (tuple): Width and height of the image.
+            resample (int, optional): PIL resampling filter. Defaults to nearest neighbour.
+            display (tuple, optional): Display settings of the layers. Defaults to the current settings.
+
+        Returns:
+            Image.Image: The image.
+        """
+
+        image = Image.fromarray(self.renderer.RenderView(axis, index, state=display))
+        try:
+            return image.resize(size, resample)
+        except ValueError:
+            return image
+
+    def get_scrub_image(self, axis: int, index: int, size: tuple, speed: float) -> Image.Image:
+        """Returns a coarse image of the base volume from the pyramid while the slices are scrubbed faster than
+        scrub_speed slices per second. The coarsest level is used above four times that speed.
+
+        Args:
+            axis (int): The axis to slice.
+            index (int): The slice index.
+            size (tuple): Width and height of the image.
+            speed (float): Current scrubbing speed in slices per second.
+
+        Returns:
+            Image.Image: The image, or None if the full resolution slice should be shown.
+        """
+
+        if self.pyramid is None or speed < self.scrub_speed or not self.pyramid.isReady():
+            return None
+
+        factors = self.pyramid.getFactors()
+        factor = factors[0] if speed >= 4*self.scrub_speed else factors[-1]
+        plane = self.pyramid.getSlice(axis, index, factor)
+        base = self.base_layer
+        image = Image.fromarray(window_slice(plane, base.window, base.level, None if base.rgb else colormap_lut(base.colormap)))
+        try:
+            return image.resize(size, RESAMPLING.NEAREST)
+        except ValueError:
+            return image
+
+    def get_slice_image(self, axis: int, index: int, size: tuple, direction: int = 0, final: bool = False) -> Image.Image:
+        """Returns a rendered slice from the cache, rendering it if needed, and prefetches the next
+        slices in the scroll direction in the background.
+
+        Args:
+            axis (int): The axis to slice.
+            index (int): The slice index.
+            size (tuple): Width and height of the image.
+            direction (int, optional): Scroll direction, -1, 0 or 1. Defaults to 0.
+            final (bool, optional): Use high quality resampling instead of the fast nearest neighbour
+            resampling used while interacting. Defaults to False.
+
+        Returns:
+            Image.Image: The image.
+        """
+
+        resample = RESAMPLING.LANCZOS if final else RESAMPLING.NEAREST
+        display = self.get_display()
+        key = (axis, index, tuple(size), resample, display)
+        image = self.slice_cache.get(key)
+        if image is None:
+            image = self.render_slice(*key)
+            self.slice_cache.put(key, image)
+
+        if direction != 0:
+            length = self.volumes[axis].shape[0]
+            self.prefetcher.request([(axis, index + direction*k, tuple(size), resample, display) for k in range(1, self.prefetch_depth + 1)
+                                     if 0 <= index + direction*k < length])
+
+        return image
         
     class ControlFrame(ctk.CTkFrame):
         """The control frame of the application.
@@ -95,6 +421,42 @@ class NumpyViewer3D(ctk.CTk):
             self.YAxis.grid(row=0, column=5, sticky="W", padx=5, pady=5)
             self.ZAxis.grid(row=0, column=6, sticky="W", padx=5, pady=5)
 
+            if not self.parent.rgb:
+                minimum, maximum = self.parent.base_layer.value_range
+                span = max(maximum - minimum, 1.0)
+                self.window_slider = ctk.CTkSlider(self, from_=span/1000, to=2*span, orientation=tk.HORIZONTAL, width=300, height=10, command = self.update_window)
+                self.window_slider.set(self.parent.base_layer.window)
+                self.level_slider = ctk.CTkSlider(self, from_=minimum - span/2, to=maximum + span/2, orientation=tk.HORIZONTAL, width=300, height=10, command = self.update_level)
+                self.level_slider.set(self.parent.base_layer.level)
+                self.window_label = ctk.CTkLabel(self, font=("Arial", 20), text_color="white")
+                self.level_label = ctk.CTkLabel(self, font=("Arial", 20), text_color="white")
+                self.ColormapLabel = ctk.CTkLabel(self, text="Colormap:", font=("Arial", 20), text_color="white")
+                self.Colormap = ctk.CTkOptionMenu(self, values=list(COLORMAPS), command = self.change_colormap)
+                self.Colormap.set(self.parent.base_layer.colormap)
+                self.update_display_labels()
+
+                self.window_slider.grid(row=1, column=0, sticky="nsew", padx=5, pady=5)
+                self.window_label.grid(row=1, column=1, sticky="nsew", padx=5, pady=5)
+                self.ColormapLabel.grid(row=1, column=3, sticky="nsew", padx=5, pady=5)
+                self.Colormap.grid(row=1, column=4, columnspan=3, sticky="W", padx=5, pady=5)
+                self.level_slider.grid(row=2, column=0, sticky="nsew", padx=5, pady=5)
+                self.level_label.grid(row=2, column=1, sticky="nsew", padx=5, pady=5)
+
+        def update_display_labels(self):
+            self.window_label.configure(text=f"Window: {self.parent.base_layer.window:.4g}")
+            self.level_label.configure(text=f"Level: {self.parent.base_layer.level:.4g}")
+
+        def update_window(self, value):
+            self.parent.set_display(window=value)
+            self.update_display_labels()
+
+        def update_level(self, value):
+            self.parent.set_display(level=value)
+            self.update_display_labels()
+
+        def change_colormap(self, value):
+            self.parent.set_display(colormap=value)
+
         def update_index_label(self, value):
             self.slider_label.configure(text=f"Index: {int(value)}")
             setattr(self.parent, {0: "xindex", 1: "yindex", 2: "zindex"}[self.parent.axis], int(value))
@@ -128,6 +490,11 @@ class NumpyViewer3D(ctk.CTk):
             self.columnconfigure(0, weight=1)
             self.rowconfigure(0, weight=1)
 
+            self.last_index = self.parent.index
+            self.last_time = time.perf_counter()
+            self.widget_size = (self.winfo_width(), self.winfo_height())
+            self.configure_job = None
+            self.refine_job = None
             self.image = self.array_to_image(self.parent.image_data, self.parent.index)
             self.label = tk.Label(self, bg="black", image = self.image)
             self.label.image = self.image
@@ -137,59 +504,65 @@ class NumpyViewer3D(ctk.CTk):
 
             self.label.bind("<Enter>", self.on_enter)
             self.label.bind("<Leave>", self.on_leave)
+            self.bind("<Configure>", self.on_configure)
+
+        def on_configure(self, event):
+            self.widget_size = (event.width, event.height)
+            self.configure_job = debounce(self, self.configure_job, self.parent.debounce_delay, self.update_image)
 
         def on_enter(self, event):                
             self.parent.bind("<MouseWheel>", self.parent.controlframe.scroll)
         def on_leave(self, event):        
             self.parent.unbind("<MouseWheel>")
 
-        def array_to_image(self, array: np.ndarray, slice: int) -> ctk.CTkImage:
+        def array_to_image(self, array: np.ndarray, slice: int, final: bool = False) -> ctk.CTkImage:
             """Converts a numpy array to an image.
             
 
             Args:
                 array (np.ndarray): The array to convert.
                 slice (int): The slice to take.
+                final (bool, optional): Use high quality resampling. Defaults to False.
 
             Returns:
                 ctk.CTkImage: The image.
             """
-   
-            image = array[slice,:,:] 
-   
-            image = self.resize(Image.fromarray(image))
+
+            now = time.perf_counter()
+            speed = abs(slice - self.last_index)/max(now - self.last_time, 1e-3)
+            direction = int(np.sign(slice - self.last_index))
+            self.last_index = slice
+            self.last_time = now
+            size = fit_size((array.shape[2], array.shape[1]), self.widget_size)
+            image = None if final else self.parent.get_scrub_image(self.parent.axis, slice, size, speed)
+            if image is None:
+                image = self.parent.get_slice_image(self.parent.axis, slice, size, direction, final)
 
             return ImageTk.PhotoImage(image)
             
 
-        def update_image(self):
-            """Updates the image.
+        def update_image(self, final: bool = False):
+            """Updates the image. Interactive updates use fast resampling, and a high quality update
+            follows once the view has been idle for the refine delay.
+
+            Args:
+                final (bool, optional): Use high quality resampling. Defaults to False.
             """
 
-            self.image = self.array_to_image(self.parent.image_data, self.parent.index)
+            self.configure_job = None
+            self.image = self.array_to_image(self.parent.image_data, self.parent.index, final)
             self.label.config(image = self.image)
             self.label.image = self.image
+            if not final:
+                self.refine_job = debounce(self, self.refine_job, self.parent.refine_delay, lambda: self.update_image(final=True))
+            else:
+                self.refine_job = None
             
-        def resize(self, image: Image):
+        def resize(self, image: Image, resample: int = RESAMPLING.NEAREST):
             try:
-                aspect_ratio = image.size[0]/image.size[1]
-                if aspect_ratio == 1:
-                    size = min([self.winfo_width(), self.winfo_height()])
-                    image = image.resize((size,size))
-                elif self.winfo_width() < self.winfo_height():
-                    if aspect_ratio > 1:
-                        image = image.resize((self.winfo_width(), int(self.winfo_width()/aspect_ratio)))
-                    else:
-                        image = image.resize((int(self.winfo_height()*aspect_ratio), self.winfo_height()))
-                else:
-                    if aspect_ratio > 1:
-                        image = image.resize((self.winfo_width(), int(self.winfo_width()/aspect_ratio)))
-                    else:
-                        image = image.resize((int(self.winfo_height()*aspect_ratio), self.winfo_height()))
+                return image.resize(fit_size(image.size, self.widget_size), resample)
             except Exception:
                 return image
-            finally:
-                return image
 
     class TripleFrame(ctk.CTkFrame):
         """Shows the three different views of the array side by side.
@@ -237,91 +610,209 @@ class NumpyViewer3D(ctk.CTk):
                 self.index_slider.pack(side="top", fill="x", expand=False, padx=5, pady=5)
                 self.slider_label.pack(side="top", fill="x", expand=False, padx=5, pady=5)
 
-                self.label = tk.Label(self, bg="black")
-                self.label.pack(side="top", fill="both", expand=True, padx=5, pady=5)
-                self.image = self.array_to_image(self.ref_image_data, self.index)
-                self.label.config(image=self.image)
-                self.label.image = self.image
-                self.label.bind("<Enter>", self.on_enter)
-                self.label.bind("<Leave>", self.on_leave)
-                self.bind("<Configure>", lambda x: self.update_image())
+                self.widget_size = (self.winfo_width(), self.winfo_height())
+                self.configure_job = None
+                self.refine_job = None
+                self.display_box = (0, 0, 1, 1)
+                self.last_index = self.index
+                self.last_time = time.perf_counter()
+
+                self.canvas = tk.Canvas(self, bg="black", highlightthickness=0)
+                self.canvas.pack(side="top", fill="both", expand=True, padx=5, pady=5)
+                self.image_item = self.canvas.create_image(0, 0, anchor="nw")
+                self.horizontal_line = self.canvas.create_line(0, 0, 0, 0, fill="red")
+                self.vertical_line = self.canvas.create_line(0, 0, 0, 0, fill="red")
+                self.canvas.bind("<Enter>", self.on_enter)
+                self.canvas.bind("<Leave>", self.on_leave)
+                self.canvas.bind("<Configure>", self.on_configure)
                 self.update_image()
 
+            def on_configure(self, event):
+                self.widget_size = (event.width, event.height)
+                self.configure_job = debounce(self, self.configure_job, self.parent.debounce_delay, self.update_image)
+
             def on_enter(self, event): 
                 self.parent.bind("<MouseWheel>", self.scroll)
             def on_leave(self, event):      
                 self.parent.unbind("<MouseWheel>")
 
-            def array_to_image(self, array: np.ndarray, slice: int, line_index=None, line_direction=None) -> ctk.CTkImage:
+            def array_to_image(self, array: np.ndarray, slice: int, final: bool = False) -> ctk.CTkImage:
                 """Converts a numpy array to an image.
                 
 
                 Args:
                     array (np.ndarray): The array to convert.
                     slice (int): The slice to take.
+                    final (bool, optional): Use high quality resampling. Defaults to False.
 
                 Returns:
                     ctk.CTkImage: The image.
                 """
-    
-                image = array[slice,:,:].copy()
-
-                if line_index is not None:
-                    if self.axis == 0 and line_direction =="x":
-                        line_index = image.shape[1] - line_index
-                    if self.axis == 1:
-                        if line_direction =="x":
-                            line_index = image.shape[1] - line_index
-                        if line_direction =="y":
-                            line_index = image.shape[0] - line_index
-                    
-                    if line_direction == "x":
-                        cv2.line(image, (line_index, 0), (line_index, image.shape[0]), (255, 0, 0), 1)
-                    elif line_direction == "y":
-                        cv2.line(image, (0, line_index), (image.shape[1], line_index), (255, 0, 0), 1)
 
-                image = self.resize(Image.fromarray(image))
-                
+                now = time.perf_counter()
+                speed = abs(slice - self.last_index)/max(now - self.last_time, 1e-3)
+                self.last_index = slice
+                self.last_time = now
+                size = fit_size((array.shape[2], array.shape[1]), self.widget_size)
+                image = None if final else self.parent.get_scrub_image(self.axis, slice, size, speed)
+                if image is None:
+                    image = self.parent.get_slice_image(self.axis, slice, size, final=final)
                 return ImageTk.PhotoImage(image)
                 
-            def update_image(self, line_index=None, line_direction=None):
-                """Updates the image.
+            def update_image(self, final: bool = False):
+                """Updates the image, centered in the canvas, and the crosshair. Interactive updates use fast
+                resampling, and a high quality update follows once the view has been idle for the refine delay.
+
+                Args:
+                    final (bool, optional): Use high quality resampling. Defaults to False.
                 """
 
-                self.image = self.array_to_image(self.ref_image_data, self.index,  line_index=line_index, line_direction=line_direction,)
-                self.label.config(image = self.image)
-                self.label.image = self.image
-                
-            def resize(self, image: Image):
-                try:
-                    aspect_ratio = image.size[0]/image.size[1]
-                    if aspect_ratio == 1:
-                        size = min([self.winfo_width(), self.winfo_height()])
-                        image = image.resize((size,size))
-                    elif self.winfo_width() < self.winfo_height():
-                        if aspect_ratio > 1:
-                            image = image.resize((self.winfo_width(), int(self.winfo_width()/aspect_ratio)))
-                        else:
-                            image = image.resize((int(self.winfo_height()*aspect_ratio), self.winfo_height()))
-                    else:
-                        if aspect_ratio > 1:
-                            image = image.resize((self.winfo_width(), int(self.winfo_width()/aspect_ratio)))
-                        else:
-                            image = image.resize((int(self.winfo_height()*aspect_ratio), self.winfo_height()))
-                except Exception:
-                    return image
-                finally:
-                    return image
+                self.configure_job = None
+                self.image = self.array_to_image(self.ref_image_data, self.index, final)
+                width, height = self.image.width(), self.image.height()
+                x, y = max((self.widget_size[0] - width)//2, 0), max((self.widget_size[1] - height)//2, 0)
+                self.canvas.coords(self.image_item, x, y)
+                self.canvas.itemconfig(self.image_item, image = self.image)
+                self.display_box = (x, y, width, height)
+                self.update_crosshair()
+                if not final:
+                    self.refine_job = debounce(self, self.refine_job, self.parent.refine_delay, lambda: self.update_image(final=True))
+                else:
+                    self.refine_job = None
+
+            def update_crosshair(self):
+                """Moves the crosshair lines to the slices shown in the other views, without rendering the image.
+                """
+
+                views = [getattr(self.master, name, None) for name in ("xview", "yview", "zview")]
+                indices = [view.index if view is not None else self.parent.volumes[axis].shape[0]//2 for axis, view in enumerate(views)]
+                row, column = CrosshairPosition(self.parent.X.shape, self.axis, indices)
+                x, y, width, height = self.display_box
+                rows, columns = self.ref_image_data.shape[1:3]
+                line_x = x + (column + 0.5)*width/columns
+                line_y = y + (row + 0.5)*height/rows
+                self.canvas.coords(self.horizontal_line, x, line_y, x + width, line_y)
+                self.canvas.coords(self.vertical_line, line_x, y, line_x, y + height)
 
             def update_index_label(self, value):
                     
                 self.slider_label.configure(text=f"Index: {int(value)}")
                 self.index = int(value)
                 setattr(self.parent, {0: "xindex", 1: "yindex", 2: "zindex"}[self.axis], self.index+1)
-                getattr(self.master, {0: "yview", 1: "zview", 2: "xview"}[self.axis]).update_image(self.index, {0: "y", 1: "y", 2: "x"}[self.axis])
-                getattr(self.master, {0: "zview", 1: "xview", 2: "yview"}[self.axis]).update_image(self.index, {0: "x", 1: "y", 2: "x"}[self.axis])
+                getattr(self.master, {0: "yview", 1: "zview", 2: "xview"}[self.axis]).update_crosshair()
+                getattr(self.master, {0: "zview", 1: "xview", 2: "yview"}[self.axis]).update_crosshair()
                 self.update_image()
 
             def scroll(self, event):
                 self.index_slider.set(self.index_slider.get() + event.delta/120)
-                self.update_index_label(self.index_slider.get())
\ No newline at end of file
+                self.update_index_label(self.index_slider.get())
+
+
+    class ObliqueFrame(ctk.CTkFrame):
+        """Shows an arbitrary plane through the base volume, resliced with trilinear interpolation at the
+        resolution of the display.
+        """
+
+        def __init__(self, parent) -> None:
+            super().__init__(master = parent, bg_color="black")
+
+            self.parent = parent.master.master
+            self.volume = self.parent.base_layer.getProvider().getArray()
+            self.center = (np.array(self.volume.shape) - 1)/2
+            extent = float(np.linalg.norm(np.array(self.volume.shape)*np.array(self.parent.voxel_spacing)))/2
+
+            self.widget_size = (self.winfo_width(), self.winfo_height())
+            self.configure_job = None
+
+            self.label = tk.Label(self, bg="black")
+            self.controls = ctk.CTkFrame(self, bg_color="black")
+            self.sliders = {}
+            for row, (name, start, stop) in enumerate([("Tilt", -90, 90), ("Rotation", -180, 180), ("Offset", -extent, extent)]):
+                slider = ctk.CTkSlider(self.controls, from_=start, to=stop, orientation=tk.HORIZONTAL, width=300, height=10, command = self.schedule_update)
+                slider.set(0)
+                label = ctk.CTkLabel(self.controls, font=("Arial", 20), text_color="white")
+                slider.grid(row=row, column=0, sticky="nsew", padx=5, pady=5)
+                label.grid(row=row, column=1, sticky="W", padx=5, pady=5)
+                self.sliders[name] = (slider, label)
+
+            self.rowconfigure(0, weight=1)
+            self.columnconfigure(0, weight=1)
+            self.label.grid(row=0, column=0, sticky="nsew", padx=5, pady=5)
+            self.controls.grid(row=1, column=0, sticky="nsew", padx=5, pady=5)
+            self.label.bind("<Configure>", self.on_configure)
+            self.update_image()
+
+        def on_configure(self, event):
+            self.widget_size = (event.width, event.height)
+            self.schedule_update()
+
+        def schedule_update(self, value=None):
+            self.configure_job = debounce(self, self.configure_job, self.parent.debounce_delay, self.update_image)
+
+        def get_plane(self) -> tuple:
+            """Returns the normal and the center of the plane set by the sliders.
+
+            Returns:
+                tuple: Normal in mm and center in voxel indices.
+            """
+
+            tilt, rotation, offset = (np.deg2rad(self.sliders["Tilt"][0].get()), np.deg2rad(self.sliders["Rotation"][0].get()),
+                                      self.sliders["Offset"][0].get())
+            normal = np.array([np.cos(tilt), np.sin(tilt)*np.cos(rotation), np.sin(tilt)*np.sin(rotation)])
+            return normal, self.center + offset*normal/np.array(self.parent.voxel_spacing)
+
+        def update_image(self):
+            """Reslices the volume at the resolution of the display and updates the image.
+            """
+
+            self.configure_job = None
+            for name, (slider, label) in self.sliders.items():
+                label.configure(text=f"{name}: {slider.get():.1f}")
+
+            normal, point = self.get_plane()
+            samples = max(min(self.widget_size), 1)
+            extent = float((np.array(self.volume.shape)*np.array(self.parent.voxel_spacing)).max())
+            plane = ResliceVolume(self.volume, normal, point, (samples, samples), extent/samples, self.parent.voxel_spacing)
+
+            base = self.parent.base_layer
+            image = Image.fromarray(window_slice(plane, base.window, base.level, colormap_lut(base.colormap)))
+            self.image = ImageTk.PhotoImage(image)
+            self.label.config(image = self.image)
+            self.label.image = self.image
+
+
+class NumpyViewer3D(_ViewerMixin, ctk.CTk):
+    """A 3D viewer for numpy arrays.
+    """
+
+    def __init__(self, array, window: float = None, level: float = None, colormap: str = "gray", voxel_spacing: tuple = (1.0, 1.0, 1.0),
+                 pyramid: bool = None) -> None:
+        """Opens the viewer as an application and blocks until it is closed. See _ViewerMixin.setup_viewer
+        for the arguments.
+        """
+
+        super().__init__(fg_color="black")
+
+        ctk.set_appearance_mode("dark")
+        ctk.set_default_color_theme("dark-blue")
+
+        self.setup_viewer(array, window, level, colormap, voxel_spacing, pyramid)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.mainloop()
+
+
+class NumpyViewerWindow(_ViewerMixin, ctk.CTkToplevel):
+    """The 3D viewer as a toplevel window of another application, e.g. the Explorer. Does not block.
+    """
+
+    def __init__(self, master, array, window: float = None, level: float = None, colormap: str = "gray", voxel_spacing: tuple = (1.0, 1.0, 1.0),
+                 pyramid: bool = None) -> None:
+        """Opens the viewer in a new window. See _ViewerMixin.setup_viewer for the arguments.
+
+        Args:
+            master (tk.Misc): The parent window.
+        """
+
+        super().__init__(master, fg_color="black")
+        self.setup_viewer(array, window, level, colormap, voxel_spacing, pyramid)
+        self.protocol("WM_DELETE_WINDOW", self.close)
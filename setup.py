@@ -23,13 +23,16 @@ setuptools.setup(
     install_requires=[
         "numpy",
         "opencv-python",
-        "Pillow",
-        "matplotlib",
         "pandas",
-        "pydicom",
-        "imutils"
-        "customtkinter"
+        "pydicom"
     ],
+    extras_require={
+        "gui": ["Pillow", "customtkinter"],
+        "parquet": ["pyarrow"],
+    },
+    entry_points={
+        "console_scripts": ["rtdicomtools=rtdicomtools.Pipeline:main"],
+    },
     packages=[
         "rtdicomtools"
     ],